@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings')
 
 application = get_asgi_application()
+
+# Preload caches before the first request (WARMUP_ON_STARTUP)
+from order_management.warmup import warm_up_on_startup  # noqa: E402
+
+warm_up_on_startup()
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'order_management.middleware.QueryCountHeaderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +63,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Add an X-DB-Queries header to every response (load testing)
+QUERY_COUNT_HEADER = env.bool('QUERY_COUNT_HEADER', default=False)
+
 ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
@@ -96,6 +100,17 @@ DATABASES = {
     }
 }
 
+# Optional separate database for archived orders
+if env('ARCHIVE_DATABASE_URL', default=None):
+    DATABASES['archive'] = env.db('ARCHIVE_DATABASE_URL')
+
+DATABASE_ROUTERS = ['order_management.routers.OrderArchiveRouter']
+
+# Order archival (see `manage.py archive_orders`)
+ORDER_ARCHIVE_DATABASE = 'archive' if 'archive' in DATABASES else 'default'
+ORDER_ARCHIVE_AFTER_DAYS = env.int('ORDER_ARCHIVE_AFTER_DAYS', default=365)
+ORDER_ARCHIVE_BATCH_SIZE = env.int('ORDER_ARCHIVE_BATCH_SIZE', default=500)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,19 +155,110 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'order_management.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'order_management.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'order_management.utils.StandardResultsSetPagination',
     'PAGE_SIZE': 10
 }
 
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'order_management.serializers.VersionedTokenObtainPairSerializer',
+}
+
+# Seconds an authenticated user is served from the cache
+AUTH_USER_CACHE_TIMEOUT = env.int('AUTH_USER_CACHE_TIMEOUT', default=60)
+# Build the user from token claims on read-only requests, after one cache get
+# of the user's token version (revoked tokens and inactive users are refused)
+AUTH_TRUST_TOKEN_CLAIMS = env.bool('AUTH_TRUST_TOKEN_CLAIMS', default=False)
+
+# Use a shared cache (e.g. CACHE_URL=rediscache://127.0.0.1:6379/1) when
+# running several workers so invalidations reach all of them
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
-    }
-}
\ No newline at end of file
+    'default': env.cache('CACHE_URL', default='locmemcache://unique-snowflake')
+}
+
+# Seconds the discount rule snapshot is cached; scheduled windows
+# (starts_at/ends_at) switch inside the snapshot without a rebuild
+RULE_SNAPSHOT_TIMEOUT = env.int('RULE_SNAPSHOT_TIMEOUT', default=300)
+
+# Evaluate only the discount rules an order can match (category index,
+# minimum amounts) instead of every active rule
+DISCOUNT_RULE_INDEX = env.bool('DISCOUNT_RULE_INDEX', default=True)
+# Seconds between flushes of each worker's per-rule evaluation counters to
+# DiscountRuleStats (order_management.telemetry); 0 disables them
+RULE_STATS_FLUSH_INTERVAL = env.int('RULE_STATS_FLUSH_INTERVAL', default=60)
+# Rule evaluation time is measured on one order in this many
+RULE_STATS_TIMING_SAMPLE = env.int('RULE_STATS_TIMING_SAMPLE', default=10)
+
+# Memory-mapped catalogue and rule snapshot shared by all workers on a host
+# (see `manage.py build_catalogue_snapshot`); empty to disable
+CATALOGUE_SNAPSHOT_PATH = env('CATALOGUE_SNAPSHOT_PATH', default='')
+CATALOGUE_SNAPSHOT_CHECK_INTERVAL = env.float('CATALOGUE_SNAPSHOT_CHECK_INTERVAL', default=1.0)
+
+# Preload caches in each worker before its first request (order_management.warmup)
+WARMUP_ON_STARTUP = env.bool('WARMUP_ON_STARTUP', default=True)
+# Slowest acceptable first request on a fresh worker (`manage.py profile_startup`)
+COLD_START_BUDGET_MS = env.int('COLD_START_BUDGET_MS', default=250)
+
+# Transactional outbox (see `manage.py run_outbox_worker`)
+OUTBOX_BATCH_SIZE = env.int('OUTBOX_BATCH_SIZE', default=100)
+OUTBOX_MAX_ATTEMPTS = env.int('OUTBOX_MAX_ATTEMPTS', default=10)
+OUTBOX_RETENTION_DAYS = env.int('OUTBOX_RETENTION_DAYS', default=7)
+
+# Most orders accepted by one POST /api/orders/bulk/ request
+BULK_ORDER_MAX_BATCH = env.int('BULK_ORDER_MAX_BATCH', default=500)
+
+# Group commit for POST /api/orders/: a writer thread per worker commits the
+# orders queued within WINDOW_MS of each other, up to MAX_ORDERS, together.
+# Needs threaded workers to group anything
+CHECKOUT_GROUP_COMMIT = env.bool('CHECKOUT_GROUP_COMMIT', default=False)
+CHECKOUT_GROUP_COMMIT_WINDOW_MS = env.float('CHECKOUT_GROUP_COMMIT_WINDOW_MS', default=2)
+CHECKOUT_GROUP_COMMIT_MAX_ORDERS = env.int('CHECKOUT_GROUP_COMMIT_MAX_ORDERS', default=64)
+# Seconds a request waits for its group to commit before answering 503
+CHECKOUT_GROUP_COMMIT_TIMEOUT = env.float('CHECKOUT_GROUP_COMMIT_TIMEOUT', default=10)
+
+# Coupons: Bloom filter of every code, mapped by each worker to reject
+# unknown codes without a query (empty disables it), and its false
+# positive rate
+COUPON_FILTER_PATH = env('COUPON_FILTER_PATH', default='')
+COUPON_FILTER_ERROR_RATE = env.float('COUPON_FILTER_ERROR_RATE', default=0.001)
+COUPON_CODE_LENGTH = env.int('COUPON_CODE_LENGTH', default=12)
+
+# Product recommendations (`manage.py update_recommendations`): neighbours
+# kept per product and co-purchases needed to recommend a product
+RECOMMENDATIONS_TOP_K = env.int('RECOMMENDATIONS_TOP_K', default=10)
+RECOMMENDATIONS_MIN_CO_PURCHASES = env.int('RECOMMENDATIONS_MIN_CO_PURCHASES', default=2)
+# Co-purchase matrix kept between updates so that they only count new
+# orders; empty rebuilds it from every completed order each time
+RECOMMENDATIONS_STATE_PATH = env('RECOMMENDATIONS_STATE_PATH', default='')
+RECOMMENDATIONS_CACHE_TIMEOUT = env.int('RECOMMENDATIONS_CACHE_TIMEOUT', default=3600)
+
+# Admission control for checkout (order_management.admission): per-user token
+# bucket (requests per second, burst) and requests in flight across all
+# workers, kept in the shared cache; 0 disables a limit. Off by default
+ADMISSION_CONTROL = {
+    'order_create': {
+        'rate': env.float('ORDER_CREATE_RATE', default=0),
+        'burst': env.int('ORDER_CREATE_BURST', default=5),
+        'concurrency': env.int('ORDER_CREATE_CONCURRENCY', default=0),
+    },
+    'order_bulk_create': {
+        'rate': env.float('ORDER_BULK_CREATE_RATE', default=0),
+        'burst': env.int('ORDER_BULK_CREATE_BURST', default=2),
+        'concurrency': env.int('ORDER_BULK_CREATE_CONCURRENCY', default=0),
+    },
+}
+
+# Admin changelists of large tables count at most this many rows exactly
+# (order_management.utils.EstimatedCountPaginator)
+ADMIN_EXACT_COUNT_LIMIT = env.int('ADMIN_EXACT_COUNT_LIMIT', default=10000)
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
\ No newline at end of file
@@ -1,18 +1,62 @@
 from django.contrib import admin
-from django.db.models import Count, Sum
-from django.core.cache import cache
+from django.db.models import Count, Sum, Q
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
 from .models import (
     CustomUser, ProductCategory, Product,
-    Order, OrderItem, DiscountRule
+    Order, OrderItem, DiscountRule, DiscountRuleStats, DiscountRuleReport, OutboxEvent,
+    Coupon
 )
+from .coupons import normalize_code
+from .rules import rules_changed
+from .utils import EstimatedCountPaginator
+
+
+def prefix_range(field, prefix):
+    """
+    Values of ``field`` starting with ``prefix``, as a range condition that
+    a plain B-tree index can serve (LIKE 'x%' often cannot)
+    """
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+
+def exact_id(term):
+    """Search term as a primary key (``123`` or ``#123``), or None"""
+    term = term.lstrip('#')
+    if term.isdigit() and len(term) < 19:
+        return int(term)
+    return None
+
 
 class OrderItemInline(admin.TabularInline):
-    """ Inline admin for OrderItems """
+    """ Inline admin for existing OrderItems """
     
     model = OrderItem
     extra = 0
-    readonly_fields = ['unit_price', 'category', 'item_discount']
+    readonly_fields = ['product', 'unit_price', 'category', 'item_discount']
     fields = ['product', 'quantity', 'unit_price', 'category', 'item_discount']
+    
+    def get_queryset(self, request):
+        # Products and categories are shown read-only from one join
+        return super().get_queryset(request).select_related('order', 'product', 'category')
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class OrderItemAddInline(admin.TabularInline):
+    """ New OrderItems, products picked with autocomplete """
+    
+    model = OrderItem
+    extra = 1
+    fields = ['product', 'quantity']
+    autocomplete_fields = ['product']
+    verbose_name_plural = "Add items"
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).none()
 
 
 @admin.register(CustomUser)
@@ -20,15 +64,46 @@ class UserAdmin(admin.ModelAdmin):
     """ Admin configuration for User model """
     list_display = ['username', 'email', 'loyalty_points']
     list_filter = ['is_staff', 'is_superuser']
-    search_fields = ['username', 'email']
+    search_fields = ['username', '=email']
+    search_help_text = "User id, e-mail address (exact) or username prefix (case-sensitive)"
     readonly_fields = ['loyalty_points']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Only indexed lookups: id, exact e-mail or username prefix """
+        
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if exact_id(term) is not None:
+            return queryset.filter(pk=exact_id(term)), False
+        if '@' in term:
+            return queryset.filter(email=term), False
+        return queryset.filter(prefix_range('username', term)), False
 
 
 @admin.register(ProductCategory)
 class ProductCategoryAdmin(admin.ModelAdmin):
     """Admin configuration for ProductCategory"""
-    list_display = ['name', 'discount_percentage']
+    list_display = ['name', 'parent', 'discount_percentage']
+    list_select_related = ['parent']
     search_fields = ['name']
+    autocomplete_fields = ['parent']
+    
+    def save_model(self, request, obj, form, change):
+        """Nesting and default discounts are part of the rule snapshot"""
+        
+        super().save_model(request, obj, form, change)
+        rules_changed()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rules_changed()
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        rules_changed()
 
 
 @admin.register(Product)
@@ -36,9 +111,24 @@ class ProductAdmin(admin.ModelAdmin):
     """Admin configuration for Product"""
     
     list_display = ['name', 'category', 'price', 'stock_quantity', 'is_active']
+    list_select_related = ['category']
     list_filter = ['category', 'is_active']
     search_fields = ['name']
     list_editable = ['price', 'stock_quantity', 'is_active']
+    
+    def save_model(self, request, obj, form, change):
+        """Rebuild the shared catalogue snapshot on save (via the outbox) """
+        
+        super().save_model(request, obj, form, change)
+        OutboxEvent.enqueue('catalogue.changed')
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        OutboxEvent.enqueue('catalogue.changed')
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        OutboxEvent.enqueue('catalogue.changed')
 
 
 @admin.register(Order)
@@ -49,22 +139,47 @@ class OrderAdmin(admin.ModelAdmin):
         'id', 'user', 'order_date', 'status',
         'subtotal', 'total_discount', 'final_amount'
     ]
+    list_select_related = ['user']
     list_filter = ['status', 'is_cancelled', 'is_returned']
     
-    search_fields = ['user__username', 'id']
+    search_fields = ['=id', 'user__username']
+    search_help_text = "Order id (exact) or username prefix (case-sensitive)"
+    
+    # Exact counts of millions of rows time out
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
+    autocomplete_fields = ['user']
     readonly_fields = [
         'subtotal', 'total_discount', 'final_amount',
-        'discount_breakdown'
+        'discount_breakdown', 'coupon'
     ]
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderItemAddInline]
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Only indexed lookups: exact order id or username prefix """
+        
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if exact_id(term) is not None:
+            return queryset.filter(pk=exact_id(term)), False
+        return queryset.filter(prefix_range('user__username', term)), False
     
     actions = ['mark_as_completed']
     
+    @transaction.atomic
     def mark_as_completed(self, request, queryset):
         """Admin action to mark orders as completed"""
         
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        queryset.filter(completed_at__isnull=True).update(completed_at=timezone.now())
         queryset.update(status='completed')
+        # update() skips Order.save(), so queue the loyalty refresh here
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(topic='order.settled', payload={'user_id': user_id})
+            for user_id in user_ids
+        ])
     mark_as_completed.short_description = "Mark selected orders as completed"
 
 
@@ -75,16 +190,188 @@ class DiscountRuleAdmin(admin.ModelAdmin):
     list_display = [
         'name', 'discount_type', 'value', 'is_active',
         'priority', 'min_order_amount', 'min_quantity',
-        'category', 'min_completed_orders'
+        'category', 'min_completed_orders',
+        'exclusivity_group', 'is_combinable', 'requires_coupon',
+        'starts_at', 'ends_at'
     ]
-    list_filter = ['discount_type', 'is_active']
+    list_select_related = ['category']
+    list_filter = ['discount_type', 'is_active', 'is_combinable', 'requires_coupon']
     
     search_fields = ['name']
     
     list_editable = ['is_active', 'priority', 'value']
     
     def save_model(self, request, obj, form, change):
-        """Clear discount rules cache on save """
+        """Clear discount rules cache on save"""
+        
+        super().save_model(request, obj, form, change)
+        rules_changed()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rules_changed()
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        rules_changed()
+
+
+@admin.register(Coupon)
+class CouponAdmin(admin.ModelAdmin):
+    """ Admin configuration for Coupon; codes are generated in bulk by generate_coupons """
+    
+    list_display = ['code', 'rule', 'uses', 'max_uses', 'is_active', 'created_at']
+    list_select_related = ['rule']
+    list_filter = ['is_active']
+    
+    search_fields = ['=code']
+    search_help_text = "Coupon code (exact)"
+    
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    autocomplete_fields = ['rule']
+    readonly_fields = ['uses']
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Only the unique index: exact code """
+        
+        term = normalize_code(search_term)
+        if not term:
+            return queryset, False
+        return queryset.filter(code=term), False
+    
+    def save_model(self, request, obj, form, change):
+        """Normalize the code and add it to the coupon filter (via the outbox) """
         
+        obj.code = normalize_code(obj.code)
         super().save_model(request, obj, form, change)
-        cache.delete('active_discount_rules')
\ No newline at end of file
+        # New coupons are queued by Coupon.save()
+        if change and 'code' in form.changed_data:
+            OutboxEvent.enqueue('coupons.renamed', codes=[obj.code])
+
+
+class RuleActivityFilter(admin.SimpleListFilter):
+    """ Rules by what their stats show """
+    
+    title = "activity"
+    parameter_name = 'activity'
+    
+    def lookups(self, request, model_admin):
+        return [
+            ('never_evaluated', "Never evaluated"),
+            ('never_matched', "Never matched"),
+            ('never_applied', "Never applied"),
+            ('applied', "Applied"),
+        ]
+    
+    def queryset(self, request, queryset):
+        no_stats = Q(stats__isnull=True)
+        if self.value() == 'never_evaluated':
+            return queryset.filter(no_stats | Q(stats__evaluations=0))
+        if self.value() == 'never_matched':
+            return queryset.filter(no_stats | Q(stats__matches=0))
+        if self.value() == 'never_applied':
+            return queryset.filter(no_stats | Q(stats__applications=0))
+        if self.value() == 'applied':
+            return queryset.filter(stats__applications__gt=0)
+        return queryset
+
+
+@admin.register(DiscountRuleReport)
+class DiscountRuleReportAdmin(admin.ModelAdmin):
+    """ How often each rule is evaluated, matches and is applied """
+    
+    list_display = [
+        'rule', 'discount_type', 'is_active', 'evaluations', 'match_rate',
+        'applications', 'discount_granted', 'avg_evaluation_us',
+        'last_matched_at', 'counting_since'
+    ]
+    list_display_links = None
+    list_select_related = ['stats']
+    list_filter = [RuleActivityFilter, 'discount_type', 'is_active']
+    search_fields = ['name']
+    # Rules that never matched first
+    ordering = ['stats__matches', 'stats__evaluations', 'id']
+    actions = ['deactivate_rules']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    @staticmethod
+    def _stats(obj):
+        try:
+            return obj.stats
+        except DiscountRuleStats.DoesNotExist:
+            return None
+    
+    @admin.display(description="rule", ordering='name')
+    def rule(self, obj):
+        url = reverse('admin:order_management_discountrule_change', args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.name)
+    
+    @admin.display(ordering='stats__evaluations')
+    def evaluations(self, obj):
+        stats = self._stats(obj)
+        return stats.evaluations if stats else 0
+    
+    @admin.display(description="match rate")
+    def match_rate(self, obj):
+        stats = self._stats(obj)
+        if not stats or not stats.evaluations:
+            return '-'
+        return f"{stats.matches / stats.evaluations:.1%}"
+    
+    @admin.display(ordering='stats__applications')
+    def applications(self, obj):
+        stats = self._stats(obj)
+        return stats.applications if stats else 0
+    
+    @admin.display(description="discount granted", ordering='stats__discount_granted')
+    def discount_granted(self, obj):
+        stats = self._stats(obj)
+        return stats.discount_granted if stats else 0
+    
+    @admin.display(description="avg. evaluation (µs)")
+    def avg_evaluation_us(self, obj):
+        stats = self._stats(obj)
+        if not stats or not stats.timed_evaluations:
+            return '-'
+        return f"{stats.evaluation_ns / stats.timed_evaluations / 1000:.1f}"
+    
+    @admin.display(description="last matched", ordering='stats__last_matched_at')
+    def last_matched_at(self, obj):
+        stats = self._stats(obj)
+        return stats.last_matched_at if stats else None
+    
+    @admin.display(description="counting since")
+    def counting_since(self, obj):
+        stats = self._stats(obj)
+        return stats.created_at if stats else None
+    
+    @admin.action(description="Deactivate selected rules", permissions=['change'])
+    def deactivate_rules(self, request, queryset):
+        with transaction.atomic():
+            updated = queryset.update(is_active=False)
+            rules_changed()
+        self.message_user(request, f"{updated} rules deactivated")
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    """ Read-only view of pending and failed outbox events """
+    
+    list_display = ['id', 'topic', 'created_at', 'attempts', 'processed_at']
+    list_filter = ['topic']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [
+        'topic', 'payload', 'created_at', 'available_at',
+        'attempts', 'processed_at', 'last_error'
+    ]
+    
+    def has_add_permission(self, request):
+        return False
\ No newline at end of file
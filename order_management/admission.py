@@ -0,0 +1,167 @@
+"""
+Admission control for write endpoints.
+
+Checkout requests are admitted before their transaction starts, so a flash
+sale is turned away with a fast 429 and ``Retry-After`` instead of queuing
+behind database locks and slowing every other request down. Each scope in
+``ADMISSION_CONTROL`` (e.g. ``order_create``) has:
+
+    rate, burst    per-user token bucket: ``rate`` requests per second on
+                   average, up to ``burst`` at once
+    concurrency    requests of the scope in flight across all workers
+    retry_after    seconds suggested to clients turned away by the
+                   concurrency limit
+
+State lives in the default cache, which must be shared between workers
+(e.g. Redis) for the limits to hold across processes. A limit of 0 disables
+it.
+"""
+import math
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+
+KEY_PREFIX = 'admission'
+
+# The per-user bucket is updated under a short-lived lock taken with
+# cache.add(), which is atomic on every cache backend. Waiters back off from
+# LOCK_WAIT to LOCK_WAIT_MAX seconds between attempts, for at most
+# LOCK_TIMEOUT, by when a lock left by a killed worker has expired
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.001
+LOCK_WAIT_MAX = 0.02
+
+# In-flight counters expire so that slots leaked by killed workers come back
+IN_FLIGHT_TIMEOUT = 300
+
+
+def get_limits(scope):
+    """Configured limits of ``scope`` with defaults filled in"""
+    limits = {'rate': 0, 'burst': 1, 'concurrency': 0, 'retry_after': 1}
+    limits.update(settings.ADMISSION_CONTROL.get(scope, {}))
+    return limits
+
+
+@contextmanager
+def _locked(key):
+    """Yield True while holding the lock of ``key``, False if it stayed busy"""
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    wait = LOCK_WAIT
+    while True:
+        if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            try:
+                yield True
+            finally:
+                cache.delete(lock_key)
+            return
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(wait)
+        wait = min(wait * 2, LOCK_WAIT_MAX)
+    yield False
+
+
+def take_token(scope, user_id, rate, burst, now=None):
+    """
+    Take a token from the user's bucket. Returns 0 when admitted, otherwise
+    the seconds until a token is available.
+
+    The bucket is stored as its theoretical arrival time (GCRA): the moment
+    it would be full again. A request is admitted while that moment is less
+    than ``burst`` intervals ahead, which is a token bucket in one value.
+    """
+    key = f'{KEY_PREFIX}:{scope}:user:{user_id}'
+    interval = 1 / rate
+    with _locked(key):
+        # Still busy after LOCK_TIMEOUT only if the cache is misbehaving;
+        # update the bucket unlocked rather than refuse a request that may
+        # have tokens left
+        now = time.time() if now is None else now
+        arrival = max(cache.get(key, now), now) + interval
+        wait = arrival - burst * interval - now
+        if wait > 0:
+            return wait
+        cache.set(key, arrival, timeout=math.ceil(arrival - now) + 1)
+        return 0
+
+
+def acquire_slot(scope, concurrency):
+    """Count a request of ``scope`` in flight, False if the limit is reached"""
+    key = f'{KEY_PREFIX}:{scope}:in_flight'
+    cache.add(key, 0, timeout=IN_FLIGHT_TIMEOUT)
+    try:
+        in_flight = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.add(key, 1, timeout=IN_FLIGHT_TIMEOUT)
+        in_flight = 1
+    if in_flight > concurrency:
+        release_slot(scope)
+        return False
+    return True
+
+
+def release_slot(scope):
+    key = f'{KEY_PREFIX}:{scope}:in_flight'
+    try:
+        if cache.decr(key) < 0:
+            # The counter expired while requests were in flight
+            cache.set(key, 0, timeout=IN_FLIGHT_TIMEOUT)
+    except ValueError:
+        pass
+
+
+def admit(scope, user_id):
+    """
+    Admit a request of ``user_id`` to ``scope`` or raise Throttled (429 with
+    Retry-After). Returns True when a concurrency slot was taken, which the
+    caller must give back with release_slot() once the request is done.
+    """
+    limits = get_limits(scope)
+    holds_slot = False
+    if limits['concurrency']:
+        if not acquire_slot(scope, limits['concurrency']):
+            raise Throttled(
+                wait=limits['retry_after'],
+                detail="Too many orders are being placed right now, please retry shortly."
+            )
+        holds_slot = True
+
+    if limits['rate']:
+        wait = take_token(scope, user_id, limits['rate'], limits['burst'])
+        if wait:
+            if holds_slot:
+                release_slot(scope)
+            raise Throttled(wait=wait)
+    return holds_slot
+
+
+class AdmissionControlMixin:
+    """
+    Admit unsafe requests of a view through ``admission_scope`` once the
+    user is authenticated, and free the concurrency slot when done.
+    """
+    admission_scope = None
+
+    def get_admission_scope(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return None
+        return self.admission_scope
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        scope = self.get_admission_scope(request)
+        if scope and admit(scope, request.user.pk):
+            self._admission_slot = scope
+
+    def dispatch(self, request, *args, **kwargs):
+        self._admission_slot = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._admission_slot:
+                release_slot(self._admission_slot)
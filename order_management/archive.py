@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    CustomUser, Order, OrderItem,
+    ArchivedOrder, ArchivedOrderItem
+)
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+ORDER_FIELDS = [
+    'id', 'user_id', 'order_date', 'status', 'subtotal', 'total_discount',
+    'final_amount', 'is_cancelled', 'is_returned', 'discount_breakdown',
+    'completed_at', 'coupon_id'
+]
+ITEM_FIELDS = [
+    'id', 'order_id', 'product_id', 'quantity', 'unit_price',
+    'category_id', 'item_discount'
+]
+
+
+def _archived_item(item):
+    """Archive row of ``item``, keeping its product and category as they are now"""
+    archived = ArchivedOrderItem(**{field: getattr(item, field) for field in ITEM_FIELDS})
+    archived.product_name = item.product.name
+    archived.product_price = item.product.price
+    archived.category_name = item.category.name
+    return archived
+
+
+def archive_cutoff(days=None):
+    """Orders placed before the returned datetime are eligible for archival"""
+    if days is None:
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_orders(cutoff):
+    """Completed/cancelled orders older than cutoff, oldest first"""
+    return Order.objects.filter(
+        status__in=ARCHIVABLE_STATUSES,
+        order_date__lt=cutoff
+    ).order_by('id')
+
+
+def archive_batch(cutoff, batch_size):
+    """Move one batch of orders into the archive tables.
+
+    The batch is copied first, then the user totals are updated and the
+    live rows deleted in the main database's transaction. With the archive
+    on the main database that is all one transaction. On a separate
+    ``ARCHIVE_DATABASE_URL`` the copy commits first: if the delete then
+    fails, the orders stay live and the next run copies them again over
+    the same archive rows, so nothing is lost or counted twice.
+    Returns the number of archived orders.
+    """
+    archive_db = settings.ORDER_ARCHIVE_DATABASE
+    
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        orders = list(
+            archivable_orders(cutoff)
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not orders:
+            return 0
+        
+        order_ids = [order.id for order in orders]
+        items = OrderItem.objects.filter(order_id__in=order_ids).select_related(
+            'product', 'category'
+        )
+        
+        # Rows left by a run whose delete failed are overwritten
+        with transaction.atomic(using=archive_db):
+            ArchivedOrder.objects.using(archive_db).bulk_create(
+                [
+                    ArchivedOrder(**{field: getattr(order, field) for field in ORDER_FIELDS})
+                    for order in orders
+                ],
+                update_conflicts=True, unique_fields=['id'], update_fields=ORDER_FIELDS[1:]
+            )
+            ArchivedOrderItem.objects.using(archive_db).bulk_create(
+                [_archived_item(item) for item in items],
+                update_conflicts=True, unique_fields=['id'],
+                update_fields=ITEM_FIELDS[1:] + ['product_name', 'product_price', 'category_name']
+            )
+        
+        # Carry the completed-order totals over to the users
+        totals = defaultdict(lambda: [0, Decimal('0')])
+        for order in orders:
+            if order.status == 'completed' and not order.is_cancelled \
+                    and not order.is_returned:
+                totals[order.user_id][0] += 1
+                totals[order.user_id][1] += order.final_amount
+        for user_id, (count, amount) in totals.items():
+            CustomUser.objects.filter(pk=user_id).update(
+                archived_completed_orders=F('archived_completed_orders') + count,
+                archived_completed_total=F('archived_completed_total') + amount
+            )
+        
+        Order.objects.filter(id__in=order_ids).delete()
+        
+        # Cached request users still carry the old archived totals
+        cache.delete_many([
+            CustomUser.auth_cache_key(pk, version)
+            for pk, version in CustomUser.objects.filter(
+                pk__in=totals
+            ).values_list('pk', 'token_version')
+        ])
+    
+    return len(orders)
+
+
+def archive_orders(cutoff, batch_size=None, max_batches=None):
+    """Archive eligible orders batch by batch, returns the total moved"""
+    if batch_size is None:
+        batch_size = settings.ORDER_ARCHIVE_BATCH_SIZE
+    
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        archived += moved
+        batches += 1
+    return archived
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+TOKEN_VERSION_CLAIM = 'token_version'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from the cache.
+    
+    Users are cached for ``AUTH_USER_CACHE_TIMEOUT`` seconds under their id
+    and token version, without their password hash, and saving the user
+    drops the entry. With ``AUTH_TRUST_TOKEN_CLAIMS`` enabled, read-only
+    requests of non-staff users get a user built from the token claims
+    once the cached token version of the active user matches the claim;
+    staff status always comes from the database.
+    """
+    
+    def authenticate(self, request):
+        self.trust_claims = (
+            settings.AUTH_TRUST_TOKEN_CLAIMS and request.method in SAFE_METHODS
+        )
+        return super().authenticate(request)
+    
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        
+        token_version = validated_token.get(TOKEN_VERSION_CLAIM, 0)
+        # A staff claim may be stale (demoted or revoked user): look it up
+        if self.trust_claims and not validated_token.get('is_staff', False):
+            # Only set for active users and dropped when the user is saved,
+            # so revoked tokens and deactivated users fall through
+            version_key = self.user_model.token_version_cache_key(user_id)
+            if cache.get(version_key) == token_version:
+                return self.get_claims_user(user_id, token_version, validated_token)
+        
+        cache_key = self.user_model.auth_cache_key(user_id, token_version)
+        user = cache.get(cache_key)
+        
+        if user is None:
+            user = super().get_user(validated_token)
+            if user.token_version != token_version:
+                raise AuthenticationFailed(
+                    _("Token has been revoked"), code="token_revoked"
+                )
+            # Left deferred: read from the database if ever needed, and
+            # never written back by save()
+            del user.__dict__['password']
+            cache.set_many({
+                cache_key: user,
+                self.user_model.token_version_cache_key(user_id): token_version,
+            }, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+        
+        return user
+    
+    def get_claims_user(self, user_id, token_version, validated_token):
+        """Unsaved non-staff user instance carrying only what the token claims"""
+        user = self.user_model(
+            id=user_id,
+            username=validated_token.get('username', ''),
+            is_staff=False,
+            is_superuser=False,
+            is_active=True,
+            token_version=token_version
+        )
+        # Behave like a fetched row so it can be used in queryset filters
+        user._state.adding = False
+        user._state.db = DEFAULT_DB_ALIAS
+        return user
@@ -0,0 +1,264 @@
+"""
+Shared, memory-mapped catalogue and rule snapshot.
+
+``build_catalogue_snapshot()`` writes the pricing data of every product and
+the active discount rules to one binary file; workers map it read-only, so
+the page cache holds a single copy shared by every process on the host
+instead of one warmed cache per worker.
+
+Layout (little endian)::
+
+    header   magic, version, capacity, count, rules offset/length, built_at
+    table    ``capacity`` product slots, open addressing, linear probing
+    rules    JSON-encoded rule snapshot
+
+A slot is (product id, price in paise, category id, stock, active); id 0
+marks an empty slot. Rebuilds write a temporary file and rename it over the
+old one, so readers always see a complete file; a worker notices the new
+file within ``CATALOGUE_SNAPSHOT_CHECK_INTERVAL`` seconds and remaps it.
+
+The file is local to a host and the outbox worker only rebuilds the one on
+its own host; other hosts must rebuild theirs with ``build_catalogue_snapshot``.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import orjson
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import DiscountRule, Product, ProductCategory
+from .rules import RuleSnapshot
+
+MAGIC = b'OMCATLG\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIIQQd')
+SLOT = struct.Struct('<qqIIB')
+MAX_LOAD = 0.7
+
+# Fibonacci hashing spreads sequential ids over the whole table
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+PRODUCT_FIELDS = ('id', 'price', 'category_id', 'stock_quantity', 'is_active')
+RULE_FIELDS = [field for field in DiscountRule._meta.concrete_fields]
+
+
+def table_capacity(count):
+    """Smallest power of two keeping the load factor under MAX_LOAD"""
+    capacity = 8
+    while count > capacity * MAX_LOAD:
+        capacity *= 2
+    return capacity
+
+
+def slot_index(product_id, bits):
+    return ((product_id * HASH_MULTIPLIER) & MASK64) >> (64 - bits)
+
+
+def _insert(table, capacity, bits, product_id, price, category_id, stock, active):
+    index = slot_index(product_id, bits)
+    while True:
+        offset = HEADER.size + index * SLOT.size
+        if SLOT.unpack_from(table, offset)[0] == 0:
+            SLOT.pack_into(table, offset, product_id, price, category_id, stock, active)
+            return
+        index = (index + 1) & (capacity - 1)
+
+
+def _encode_rules(snapshot):
+    return orjson.dumps({
+        'built_at': snapshot.built_at.isoformat(),
+        'rules': [
+            dict(
+                {field.attname: field.value_from_object(rule) for field in RULE_FIELDS},
+                category_name=rule.category.name if rule.category_id else None,
+            )
+            for rule in snapshot.rules
+        ],
+        'ancestors': {
+            str(category_id): sorted(ancestors) for category_id, ancestors in snapshot.ancestors.items()
+        },
+        'default_categories': [
+            [category.pk, category.name, category.discount_percentage]
+            for category in snapshot.default_categories
+        ],
+    }, default=str)
+
+
+def _decode_rules(data):
+    payload = orjson.loads(data)
+    rules = []
+    for values in payload['rules']:
+        category_name = values.pop('category_name')
+        # Fields added since the file was written keep their default
+        rule = DiscountRule(**{
+            field.attname: field.to_python(values[field.attname])
+            for field in RULE_FIELDS if field.attname in values
+        })
+        rule._state.adding = False
+        if rule.category_id:
+            rule.category = ProductCategory(id=rule.category_id, name=category_name)
+        rules.append(rule)
+    # Files written before categories were nested have neither
+    ancestors = {
+        int(category_id): frozenset(ids) for category_id, ids in payload.get('ancestors', {}).items()
+    }
+    default_categories = [
+        ProductCategory(id=pk, name=name, discount_percentage=Decimal(percentage))
+        for pk, name, percentage in payload.get('default_categories', [])
+    ]
+    return RuleSnapshot(
+        rules, built_at=datetime.fromisoformat(payload['built_at']),
+        ancestors=ancestors, default_categories=default_categories
+    )
+
+
+def build_catalogue_snapshot(path=None):
+    """Write a new snapshot of all products and active rules, returns its path"""
+    path = path or settings.CATALOGUE_SNAPSHOT_PATH
+    snapshot = RuleSnapshot.build()
+    rules = _encode_rules(snapshot)
+
+    count = Product.objects.count()
+    while True:
+        capacity = table_capacity(count)
+        bits = capacity.bit_length() - 1
+        table = bytearray(HEADER.size + capacity * SLOT.size)
+        inserted = 0
+        rows = Product.objects.order_by().values_list(*PRODUCT_FIELDS)
+        for pk, price, category_id, stock, active in rows.iterator(chunk_size=10000):
+            if inserted >= capacity * MAX_LOAD:
+                break
+            _insert(table, capacity, bits, pk, int(price * 100), category_id, stock, active)
+            inserted += 1
+        else:
+            break
+        # Products were added while building; retry with a bigger table
+        count = inserted * 2
+
+    # built_at is when the rules were read, so rule edits committed while
+    # the table was built count as newer than the file
+    HEADER.pack_into(
+        table, 0, MAGIC, VERSION, capacity, inserted, 0,
+        len(table), len(rules), snapshot.built_at.timestamp()
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.catalogue-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(table)
+            tmp.write(rules)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.chmod(tmp_path, 0o644)
+        # Atomic: readers see either the old or the new file, never a mix
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+class CatalogueSnapshot:
+    """Read-only view over a mapped snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.stat = os.fstat(snapshot_file.fileno())
+            self.buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.capacity, self.count, _,
+         self.rules_offset, self.rules_length, built_at) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} catalogue snapshot")
+        self.path = path
+        self.bits = self.capacity.bit_length() - 1
+        self.built_at = datetime.fromtimestamp(built_at, tz=dt_timezone.utc)
+        self._rules = None
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, product_id):
+        """(price in paise, category id, stock, active) or None, O(1)"""
+        buffer = self.buffer
+        mask = self.capacity - 1
+        index = slot_index(product_id, self.bits)
+        while True:
+            slot = SLOT.unpack_from(buffer, HEADER.size + index * SLOT.size)
+            if slot[0] == product_id:
+                return slot[1:]
+            if slot[0] == 0:
+                return None
+            index = (index + 1) & mask
+
+    def product(self, product_id):
+        """
+        Product with the snapshot's pricing fields, or None. Other fields
+        are deferred and load from the database if accessed.
+        """
+        slot = self.lookup(product_id)
+        if slot is None:
+            return None
+        price, category_id, stock, active = slot
+        return Product.from_db(
+            DEFAULT_DB_ALIAS, PRODUCT_FIELDS,
+            (product_id, Decimal(price).scaleb(-2), category_id, stock, bool(active))
+        )
+
+    @property
+    def rules(self):
+        """Rule snapshot stored with the catalogue, decoded once per file"""
+        if self._rules is None:
+            start = self.rules_offset
+            self._rules = _decode_rules(self.buffer[start:start + self.rules_length])
+        return self._rules
+
+
+_lock = threading.Lock()
+_current = None
+_checked_at = 0.0
+
+
+def get_catalogue():
+    """
+    Mapped snapshot at CATALOGUE_SNAPSHOT_PATH, or None when disabled or
+    missing. Remaps when the file was replaced by a rebuild.
+    """
+    global _current, _checked_at
+
+    path = settings.CATALOGUE_SNAPSHOT_PATH
+    if not path:
+        return None
+
+    now = time.monotonic()
+    if (_current is not None and _current.path == path
+            and now - _checked_at < settings.CATALOGUE_SNAPSHOT_CHECK_INTERVAL):
+        return _current
+
+    with _lock:
+        _checked_at = now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _current = None
+            return None
+        if (_current is None or _current.path != path
+                or (_current.stat.st_ino, _current.stat.st_mtime_ns)
+                != (stat.st_ino, stat.st_mtime_ns)):
+            # The previous mapping stays valid for callers still holding it
+            _current = CatalogueSnapshot(path)
+        return _current
+
+
+def rebuild_catalogue_snapshot():
+    """Rebuild the shared snapshot if one is configured"""
+    if settings.CATALOGUE_SNAPSHOT_PATH:
+        build_catalogue_snapshot()
@@ -0,0 +1,210 @@
+"""
+Bulk order placement.
+
+A batch is validated order by order, but its products are read with one
+lookup, every order is priced against the same rule snapshot and the
+accepted orders and their items are written with batched inserts. Orders
+that fail validation are reported without affecting the others. Coupons
+are redeemed in the same transaction, just before the inserts.
+
+``create_orders()`` does the pricing and writing for orders of any users;
+it backs both the bulk endpoint and the group-commit checkout
+(groupcommit.py).
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from .catalogue import get_catalogue
+from .coupons import NOT_APPLICABLE, coupon_error, load_coupons, redeem
+from .models import DiscountRule, Order, OrderItem, Product
+from .serializers import BulkOrderSerializer
+from .utils import DiscountCalculator
+
+BulkOrderResult = namedtuple('BulkOrderResult', 'index reference order errors')
+
+# Rows per INSERT statement for order items
+ITEM_INSERT_BATCH_SIZE = 1000
+
+
+def load_products(product_ids):
+    """
+    Active products by id, from the catalogue snapshot or one query.
+    Products added since the snapshot was built are read from the database.
+    """
+    products = {}
+    catalogue = get_catalogue()
+    if catalogue is not None:
+        missing = []
+        for pk in product_ids:
+            product = catalogue.product(pk)
+            if product is None:
+                missing.append(pk)
+            elif product.is_active:
+                products[pk] = product
+        if not missing:
+            return products
+        product_ids = missing
+    products.update(Product.objects.filter(is_active=True).only(
+        'name', 'price', 'category_id', 'stock_quantity', 'is_active'
+    ).in_bulk(product_ids))
+    return products
+
+
+def _build_order(user, data, products):
+    """Unsaved order and items for validated data, or item errors"""
+    item_errors = []
+    stock_errors = []
+    items = []
+    for item in data['items']:
+        product = products.get(item['product_id'])
+        if product is None:
+            item_errors.append({'product_id': [
+                f'Invalid pk "{item["product_id"]}" - object does not exist.'
+            ]})
+            continue
+        item_errors.append({})
+        if product.stock_quantity < item['quantity']:
+            stock_errors.append(f"Not enough stock for {product.name}")
+        items.append(OrderItem(
+            product_id=product.pk,
+            quantity=item['quantity'],
+            unit_price=product.price,
+            category_id=product.category_id
+        ))
+
+    if any(item_errors):
+        return None, None, {'items': item_errors}
+    if stock_errors:
+        return None, None, {'non_field_errors': stock_errors}
+
+    order = Order(user=user, status='pending')
+    order.subtotal = sum(
+        (item.unit_price * item.quantity for item in items), Decimal('0')
+    )
+    return order, items, None
+
+
+def _insert(priced):
+    """Write orders and their items with batched inserts"""
+    orders = [order for _, order, _ in priced]
+    Order.objects.bulk_create(orders)
+    items = []
+    for _, order, order_items in priced:
+        for item in order_items:
+            item.order = order
+            items.append(item)
+    OrderItem.objects.bulk_create(items, batch_size=ITEM_INSERT_BATCH_SIZE)
+
+
+def _commit(priced):
+    """
+    Redeem the coupons of priced orders and write the orders that got
+    theirs. Returns ``{index: errors}`` of the orders rejected.
+    """
+    rejected = {}
+    for index, order, _ in priced:
+        if order.coupon is not None:
+            error = redeem(order.coupon, order.user)
+            if error:
+                rejected[index] = {'coupon_code': [error]}
+    _insert([entry for entry in priced if entry[0] not in rejected])
+    return rejected
+
+
+def _reset(priced):
+    """Forget primary keys assigned by a rolled back insert"""
+    for _, order, items in priced:
+        order.pk = None
+        order._state.adding = True
+        for item in items:
+            item.pk = None
+            item._state.adding = True
+
+
+def create_orders(submissions):
+    """
+    Price and create validated orders, ``submissions`` being ``[(user,
+    validated order data)]``, in one transaction.
+
+    Returns ``(order, None)`` or ``(None, errors)`` per submission, in order.
+    """
+    outcomes = [None] * len(submissions)
+    products = load_products({
+        item['product_id'] for _, data in submissions for item in data['items']
+    })
+    coupons = load_coupons({
+        data['coupon_code'] for _, data in submissions if data.get('coupon_code')
+    })
+    # One rule set for the whole batch
+    rules = DiscountRule.get_compiled_rules()
+
+    priced = []
+    for index, (user, data) in enumerate(submissions):
+        order, items, errors = _build_order(user, data, products)
+        coupon = None
+        if not errors and data.get('coupon_code'):
+            coupon = coupons.get(data['coupon_code'])
+            error = coupon_error(coupon)
+            if error:
+                errors = {'coupon_code': [error]}
+        if errors:
+            outcomes[index] = (None, errors)
+            continue
+        DiscountCalculator(order, items=items, rules=rules, coupon=coupon).apply_discounts()
+        if coupon is not None and order.coupon is None:
+            outcomes[index] = (None, {'coupon_code': [NOT_APPLICABLE]})
+            continue
+        priced.append((index, order, items))
+
+    try:
+        with transaction.atomic():
+            rejected = _commit(priced)
+    except IntegrityError:
+        # A product vanished since the lookup: find the failing orders
+        _reset(priced)
+        rejected = {}
+        failed = set()
+        for entry in priced:
+            try:
+                with transaction.atomic():
+                    rejected.update(_commit([entry]))
+            except IntegrityError:
+                _reset([entry])
+                failed.add(entry[0])
+        priced = [entry for entry in priced if entry[0] not in failed]
+        for index in failed:
+            outcomes[index] = (
+                None, {'non_field_errors': ["A product of this order is no longer available"]}
+            )
+    for index, errors in rejected.items():
+        outcomes[index] = (None, errors)
+    priced = [entry for entry in priced if entry[0] not in rejected]
+
+    for index, order, _ in priced:
+        outcomes[index] = (order, None)
+    return outcomes
+
+
+def place_orders(user, orders):
+    """
+    Validate, price and create ``orders`` (raw order dicts) for ``user``.
+
+    Returns one BulkOrderResult per order, in input order, holding either
+    the created order or the validation errors of a rejected one.
+    """
+    results = [None] * len(orders)
+    valid = []
+    for index, data in enumerate(orders):
+        serializer = BulkOrderSerializer(data=data)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            reference = data.get('reference') if isinstance(data, dict) else None
+            results[index] = BulkOrderResult(index, reference, None, serializer.errors)
+
+    outcomes = create_orders([(user, data) for _, data in valid])
+    for (index, data), (order, errors) in zip(valid, outcomes):
+        results[index] = BulkOrderResult(index, data.get('reference'), order, errors)
+    return results
@@ -0,0 +1,152 @@
+"""
+Item-item co-purchase matrix behind product recommendations.
+
+``counts[a, b]`` is the number of completed orders containing both products
+``a`` and ``b`` (rows and columns are product ids), ``orders[a]`` the number
+of completed orders containing ``a``. Neighbours are ranked by cosine
+similarity ``counts[a, b] / sqrt(orders[a] * orders[b])``, which keeps best
+sellers from topping every list.
+
+Between runs the matrix is saved to RECOMMENDATIONS_STATE_PATH. An update
+only adds the orders completed since the previous run and recomputes the
+neighbours of the products in them; scores of other products drift as
+popularity changes, and returned orders stay counted, until a full rebuild.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from scipy import sparse
+
+STATE_VERSION = 1
+# Orders are re-read this far behind the watermark so that an order whose
+# transaction committed late, with an older completed_at, is not missed
+LOOKBACK = timedelta(minutes=10)
+
+
+def _lines_to_matrix(order_ids, product_ids, size):
+    """Binary orders x products matrix of the order lines"""
+    _, rows = np.unique(order_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, product_ids)),
+        shape=(rows.max() + 1 if len(rows) else 0, size)
+    )
+    # A product listed twice in one order counts once
+    matrix.data[:] = 1
+    return matrix
+
+
+def _resize(matrix, size):
+    if matrix.shape[0] == size:
+        return matrix
+    matrix = matrix.tocoo()
+    return sparse.csr_matrix((matrix.data, (matrix.row, matrix.col)), shape=(size, size))
+
+
+class CoPurchaseMatrix:
+    """Co-purchase counts plus the watermark of the orders already counted"""
+
+    def __init__(self, counts=None, orders=None, watermark=None, recent=None):
+        self.counts = counts if counts is not None else sparse.csr_matrix((0, 0), dtype=np.int32)
+        self.orders = orders if orders is not None else np.zeros(0, dtype=np.int64)
+        # Orders completed before ``watermark`` are counted, as are the
+        # ``recent`` ones {order id: completed_at timestamp} after it
+        self.watermark = watermark
+        self.recent = recent or {}
+
+    @property
+    def size(self):
+        return self.counts.shape[0]
+
+    def add_lines(self, order_ids, product_ids):
+        """
+        Count order lines given as two integer arrays; every order must be
+        complete in one call. Returns the ids of the products whose counts
+        changed.
+        """
+        order_ids = np.asarray(order_ids, dtype=np.int64)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(product_ids):
+            return np.zeros(0, dtype=np.int64)
+
+        size = max(self.size, int(product_ids.max()) + 1)
+        lines = _lines_to_matrix(order_ids, product_ids, size)
+        delta = (lines.T @ lines).tocsr()
+        # The diagonal holds each product's own order count
+        bought = delta.diagonal()
+        delta = (delta - sparse.diags(bought, format='csr', dtype=delta.dtype)).astype(np.int32)
+        delta.eliminate_zeros()
+
+        self.counts = _resize(self.counts, size) + delta
+        orders = np.zeros(size, dtype=np.int64)
+        orders[:len(self.orders)] = self.orders
+        self.orders = orders + bought
+        return np.flatnonzero(bought)
+
+    def neighbours(self, product_ids, k, min_count=1):
+        """
+        ``{product id: [[neighbour id, score, co-purchases], ...]}`` with at
+        most ``k`` neighbours bought together at least ``min_count`` times
+        """
+        indptr, indices, data = self.counts.indptr, self.counts.indices, self.counts.data
+        result = {}
+        for product_id in product_ids:
+            start, end = indptr[product_id], indptr[product_id + 1]
+            counts = data[start:end]
+            keep = counts >= min_count
+            columns, counts = indices[start:end][keep], counts[keep]
+            if not len(columns):
+                result[int(product_id)] = []
+                continue
+            scores = counts / np.sqrt(self.orders[product_id] * self.orders[columns])
+            top = np.arange(len(columns))
+            if len(top) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            # Highest score first, lower id first on ties
+            top = top[np.lexsort((columns[top], -scores[top]))]
+            result[int(product_id)] = [
+                [int(columns[i]), round(float(scores[i]), 6), int(counts[i])] for i in top
+            ]
+        return result
+
+    def save(self, path):
+        """Write the matrix to ``path`` atomically"""
+        recent = np.array(sorted(self.recent.items()), dtype=np.float64).reshape(-1, 2)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.copurchase-', suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                np.savez(
+                    tmp, version=STATE_VERSION,
+                    indptr=self.counts.indptr, indices=self.counts.indices,
+                    data=self.counts.data, orders=self.orders, recent=recent,
+                    watermark=self.watermark.timestamp() if self.watermark else np.nan,
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Matrix saved at ``path``, or None if missing or of another version"""
+        try:
+            state = np.load(path)
+        except FileNotFoundError:
+            return None
+        with state:
+            if int(state['version']) != STATE_VERSION:
+                return None
+            orders = state['orders']
+            counts = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']),
+                shape=(len(orders), len(orders))
+            )
+            watermark = float(state['watermark'])
+            recent = {int(order_id): float(at) for order_id, at in state['recent']}
+        return cls(
+            counts, orders,
+            None if np.isnan(watermark) else datetime.fromtimestamp(watermark, tz=dt_timezone.utc),
+            recent
+        )
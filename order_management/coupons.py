@@ -0,0 +1,397 @@
+"""
+Coupon codes.
+
+A rule with ``requires_coupon`` only applies to orders redeeming one of its
+codes, generated in bulk by ``manage.py generate_coupons``.
+
+Lookup: with ``COUPON_FILTER_PATH`` set, workers map a Bloom filter of every
+code and reject codes it does not contain without a query. Codes that pass
+are read with one query on the unique index; the filter's false positives
+(``COUPON_FILTER_ERROR_RATE``) are simply not found there.
+
+The filter covers every coupon up to its ``max_id``. Creating coupons (in
+generate_coupons, the admin or the shell) replaces a stamp in the shared
+cache and queues an outbox event; the outbox worker then adds them to the
+filter under a file lock. Until then the filter's stamp differs from the
+cached one, and codes missing from the filter are looked up among the
+coupons newer than ``max_id`` instead of being rejected. Requests never
+update the filter and check the stamp only for codes the filter rejects.
+
+Redemption: in the order's transaction, the coupon's ``uses`` and the user's
+CouponUsage of the rule are incremented by conditional UPDATEs (``uses <
+limit``). An update matching no row means the code, or the user's allowance,
+is used up, however many checkouts race for it.
+"""
+import fcntl
+import logging
+import math
+import mmap
+import os
+import secrets
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Coupon, CouponUsage, OutboxEvent
+from .rules import is_live
+
+# Crockford's base32: no I, L, O or U to misread
+CODE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+# Random byte -> character; 256 is a multiple of 32, so each is equally likely
+_BYTE_TO_CHAR = bytes(ord(CODE_ALPHABET[byte % 32]) for byte in range(256))
+
+INVALID_CODE = "Invalid coupon code"
+USED_UP = "This coupon has already been used"
+USER_LIMIT_REACHED = "You have already used the maximum number of these coupons"
+NOT_APPLICABLE = "This coupon does not apply to this order"
+EXPIRED = "This coupon has expired"
+
+logger = logging.getLogger(__name__)
+
+FILTER_MAGIC = b'OMCOUPON'
+FILTER_VERSION = 3
+# magic, version, hashes, bits, codes added, capacity, largest coupon id
+# added, Coupon.CREATED_CACHE_KEY stamp when synced
+FILTER_HEADER = struct.Struct('<8sIIQQQQ16s')
+FILTER_CHECK_INTERVAL = 1
+MASK64 = (1 << 64) - 1
+
+
+def normalize_code(code):
+    return code.strip().upper()
+
+
+def generate_codes(count, length=None, prefix=''):
+    """``count`` distinct random codes"""
+    length = length or settings.COUPON_CODE_LENGTH
+    codes = set()
+    while len(codes) < count:
+        missing = count - len(codes)
+        chars = secrets.token_bytes(missing * length).translate(_BYTE_TO_CHAR).decode()
+        codes.update(prefix + chars[i:i + length] for i in range(0, len(chars), length))
+    return codes
+
+
+def create_coupons(rule, count, length=None, prefix='', max_uses=1, batch_size=5000):
+    """
+    Insert ``count`` new codes of ``rule``, one transaction per batch, then
+    add them to the coupon filter. Returns the codes.
+    """
+    created = set()
+    while len(created) < count:
+        codes = generate_codes(min(batch_size, count - len(created)), length, prefix)
+        # Random codes hardly ever collide; skip the ones that did
+        codes -= created
+        with transaction.atomic():
+            codes -= set(Coupon.objects.filter(code__in=codes).values_list('code', flat=True))
+            Coupon.objects.bulk_create([
+                Coupon(code=code, rule=rule, max_uses=max_uses) for code in codes
+            ])
+            # bulk_create() skips Coupon.save(); batches committed before a
+            # crash are added by the outbox worker
+            OutboxEvent.enqueue('coupons.created')
+            transaction.on_commit(Coupon.mark_created)
+        created |= codes
+    sync_coupon_filter()
+    return created
+
+
+def _hashes(code):
+    digest = blake2b(code.encode(), digest_size=16).digest()
+    # Double hashing: bit i is h1 + i * h2; an odd h2 never cycles early
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter:
+    """Bloom filter over a buffer (a bytearray, or a read-only mmap)"""
+
+    def __init__(self, buffer, hashes, bits, count, capacity, max_id=0, stamp=b''):
+        self.buffer = buffer
+        self.hashes = hashes
+        self.bits = bits
+        self.count = count
+        self.capacity = capacity
+        self.max_id = max_id
+        self.stamp = stamp
+
+    @classmethod
+    def create(cls, capacity, error_rate=None):
+        """Empty filter sized for ``capacity`` codes at ``error_rate``"""
+        error_rate = error_rate or settings.COUPON_FILTER_ERROR_RATE
+        capacity = max(capacity, 1000)
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        bits += -bits % 8
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        buffer = bytearray(FILTER_HEADER.size + bits // 8)
+        return cls(buffer, hashes, bits, 0, capacity)
+
+    def __contains__(self, code):
+        h1, h2 = _hashes(code)
+        buffer, bits, offset = self.buffer, self.bits, FILTER_HEADER.size
+        for i in range(self.hashes):
+            position = ((h1 + i * h2) & MASK64) % bits
+            if not buffer[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_many(self, codes):
+        """Add codes, hashed and set in bulk with NumPy"""
+        import numpy as np
+
+        codes = list(codes)
+        if not codes:
+            return
+        digests = np.frombuffer(
+            b''.join(blake2b(code.encode(), digest_size=16).digest() for code in codes),
+            dtype='<u8'
+        ).reshape(-1, 2)
+        h1, h2 = digests[:, 0], digests[:, 1] | np.uint64(1)
+        table = np.frombuffer(self.buffer, dtype=np.uint8, offset=FILTER_HEADER.size)
+        for i in range(self.hashes):
+            # uint64 arithmetic wraps like the & MASK64 of __contains__
+            positions = (h1 + np.uint64(i) * h2) % np.uint64(self.bits)
+            np.bitwise_or.at(
+                table, positions >> np.uint64(3),
+                np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+            )
+        self.count += len(codes)
+
+    def save(self, path):
+        """Write the filter to ``path`` atomically"""
+        FILTER_HEADER.pack_into(
+            self.buffer, 0, FILTER_MAGIC, FILTER_VERSION,
+            self.hashes, self.bits, self.count, self.capacity, self.max_id, self.stamp
+        )
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.coupons-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(self.buffer)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, writable=False):
+        """Filter saved at ``path``, mapped read-only unless ``writable``"""
+        with open(path, 'rb') as filter_file:
+            if writable:
+                buffer = bytearray(filter_file.read())
+            else:
+                buffer = mmap.mmap(filter_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from('<8sI', buffer, 0)
+        if magic != FILTER_MAGIC or version != FILTER_VERSION:
+            raise ValueError(f"{path} is not a version {FILTER_VERSION} coupon filter")
+        return cls(buffer, *FILTER_HEADER.unpack_from(buffer, 0)[2:])
+
+
+@contextmanager
+def _file_lock(path):
+    """Serialize updates of the filter at ``path`` across processes"""
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _add_coupons(bloom, coupons):
+    """Add ``(id, code)`` rows to the filter in batches"""
+    batch = []
+    for pk, code in coupons.iterator(chunk_size=50000):
+        batch.append(code)
+        bloom.max_id = max(bloom.max_id, pk)
+        if len(batch) >= 100000:
+            bloom.add_many(batch)
+            batch = []
+    bloom.add_many(batch)
+
+
+def _created_stamp():
+    """Current Coupon.CREATED_CACHE_KEY stamp, set if the cache lost it"""
+    cache.add(Coupon.CREATED_CACHE_KEY, Coupon.new_stamp(), timeout=None)
+    return cache.get(Coupon.CREATED_CACHE_KEY)
+
+
+def _build(extra=0):
+    # Read first: coupons created while reading the table change it
+    stamp = _created_stamp()
+    max_id = Coupon.objects.aggregate(max_id=Max('pk'))['max_id'] or 0
+    bloom = BloomFilter.create(2 * (Coupon.objects.count() + extra))
+    _add_coupons(bloom, Coupon.objects.filter(pk__lte=max_id).order_by().values_list('pk', 'code'))
+    bloom.max_id = max_id
+    bloom.stamp = stamp
+    return bloom
+
+
+def build_coupon_filter(path=None, extra=0):
+    """Write a filter of every code, with room for ``extra`` more; returns it"""
+    path = path or settings.COUPON_FILTER_PATH
+    with _file_lock(path):
+        bloom = _build(extra)
+        bloom.save(path)
+    _refresh()
+    return bloom
+
+
+def add_to_coupon_filter(codes, path=None):
+    """Add codes of existing coupons, e.g. renamed ones, to the filter"""
+    path = path or settings.COUPON_FILTER_PATH
+    if not path:
+        return
+    with _file_lock(path):
+        try:
+            bloom = BloomFilter.load(path, writable=True)
+        except FileNotFoundError:
+            return
+        bloom.add_many(codes)
+        bloom.save(path)
+    _refresh()
+
+
+def sync_coupon_filter(path=None):
+    """
+    Add the coupons created since the filter was last updated, rebuilding it
+    when it is full or missing. Run by the outbox worker and generate_coupons,
+    never by requests. Returns the filter, None when disabled.
+    """
+    path = path or settings.COUPON_FILTER_PATH
+    if not path:
+        return None
+    with _file_lock(path):
+        try:
+            bloom = BloomFilter.load(path, writable=True)
+        except (FileNotFoundError, ValueError):
+            bloom = None
+        if bloom is not None:
+            stamp = _created_stamp()
+            new = Coupon.objects.filter(pk__gt=bloom.max_id).order_by().values_list('pk', 'code')
+            if stamp == bloom.stamp and not new.exists():
+                return bloom
+            if bloom.count + new.count() <= bloom.capacity:
+                _add_coupons(bloom, new)
+                bloom.stamp = stamp
+            else:
+                bloom = None
+        if bloom is None:
+            bloom = _build()
+        bloom.save(path)
+    _refresh()
+    return bloom
+
+
+_lock = threading.Lock()
+_current = None
+_current_stat = None
+_checked_at = 0.0
+
+
+def _refresh():
+    """Check the file on the next lookup; other processes see it within a second"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def get_coupon_filter():
+    """
+    Mapped filter at COUPON_FILTER_PATH, or None when disabled, missing or
+    written by another version. Remaps when the file was replaced.
+    """
+    global _current, _current_stat, _checked_at
+
+    path = settings.COUPON_FILTER_PATH
+    if not path:
+        return None
+
+    now = time.monotonic()
+    if (_current is not None and _current_stat[0] == path
+            and now - _checked_at < FILTER_CHECK_INTERVAL):
+        return _current
+
+    with _lock:
+        _checked_at = now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _current = None
+            return None
+        key = (path, stat.st_ino, stat.st_mtime_ns)
+        if _current is None or _current_stat != key:
+            try:
+                _current, _current_stat = BloomFilter.load(path), key
+            except ValueError:
+                logger.warning("Ignoring %s, rebuild it with build_coupon_filter", path)
+                _current = None
+        return _current
+
+
+def might_exist(code):
+    """False when ``code`` is certainly not a coupon"""
+    bloom = get_coupon_filter()
+    if bloom is None or code in bloom:
+        return True
+    if cache.get(Coupon.CREATED_CACHE_KEY) == bloom.stamp:
+        return False
+    # Coupons were created since the filter was synced: one query on the
+    # code index among them
+    return Coupon.objects.filter(pk__gt=bloom.max_id, code=code).exists()
+
+
+def load_coupons(codes):
+    """Coupons by code with their rules, one query"""
+    if not codes:
+        return {}
+    return {
+        coupon.code: coupon
+        for coupon in Coupon.objects.filter(code__in=codes).select_related('rule__category')
+    }
+
+
+def coupon_error(coupon, now=None):
+    """Why ``coupon`` (None if not found) cannot be redeemed, or None"""
+    if coupon is None or not coupon.is_active or not coupon.rule.requires_coupon:
+        return INVALID_CODE
+    if not coupon.rule.is_active or not is_live(coupon.rule, now or timezone.now()):
+        return EXPIRED
+    if coupon.uses >= coupon.max_uses:
+        return USED_UP
+    return None
+
+
+def redeem(coupon, user):
+    """
+    Count a redemption of ``coupon`` by ``user`` inside the current
+    transaction. Returns None, or the error when the coupon or the user's
+    allowance is used up (nothing is counted then).
+    """
+    with transaction.atomic():
+        redeemed = Coupon.objects.filter(
+            pk=coupon.pk, is_active=True, uses__lt=F('max_uses')
+        ).update(uses=F('uses') + 1)
+        if not redeemed:
+            return USED_UP
+
+        rule = coupon.rule
+        CouponUsage.objects.bulk_create(
+            [CouponUsage(user=user, rule=rule)], ignore_conflicts=True
+        )
+        usage = CouponUsage.objects.filter(user=user, rule=rule)
+        if rule.max_uses_per_user is not None:
+            usage = usage.filter(uses__lt=rule.max_uses_per_user)
+        if not usage.update(uses=F('uses') + 1):
+            transaction.set_rollback(True)
+            return USER_LIMIT_REACHED
+    coupon.uses += 1
+    return None
@@ -0,0 +1,137 @@
+"""
+Group commit for checkout.
+
+With ``CHECKOUT_GROUP_COMMIT`` on, ``POST /api/orders/`` validates the
+request and hands the order to a writer thread instead of opening its own
+transaction. The writer takes the orders queued within
+``CHECKOUT_GROUP_COMMIT_WINDOW_MS`` of the first one, up to
+``CHECKOUT_GROUP_COMMIT_MAX_ORDERS``, reads their products with one lookup,
+prices them against one rule snapshot and writes them in one transaction
+with batched inserts (checkout.create_orders). Concurrent checkouts share a
+commit, and its fsync, instead of queuing for the write lock one by one.
+Each caller waits for its own order or validation errors.
+
+The queue lives in the worker process, so orders are only grouped with
+those of other threads of the same worker (e.g. gunicorn ``--threads``).
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError, Future
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .checkout import create_orders
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The order could not be confirmed in time, check your orders before retrying."
+    default_code = 'checkout_unavailable'
+
+
+class GroupCommitQueue:
+    """Orders waiting for the writer thread, committed in groups"""
+
+    def __init__(self, window, max_orders):
+        # Seconds the writer waits for more orders after the first one
+        self.window = window
+        self.max_orders = max_orders
+        self.groups = 0
+        self.orders = 0
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def submit(self, user, data):
+        """Queue a validated order; returns a Future of ``(order, errors)``"""
+        future = Future()
+        self._start_writer()
+        self._queue.put((user, data, future))
+        return future
+
+    def _start_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._run, name='checkout-group-commit', daemon=True
+                )
+                self._writer.start()
+
+    def _collect(self):
+        """Block for an order, then take the ones queued within the window"""
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_orders:
+            try:
+                group.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        while True:
+            self.commit(self._collect())
+
+    def commit(self, group):
+        """Create a group of ``(user, data, future)`` and resolve the futures"""
+        # The writer is long-lived, like a request it must not keep a broken
+        # or expired connection
+        close_old_connections()
+        try:
+            outcomes = create_orders([(user, data) for user, data, _ in group])
+        except Exception as exc:
+            logger.exception("Group commit of %d orders failed", len(group))
+            for _, _, future in group:
+                future.set_exception(exc)
+            return
+        self.groups += 1
+        self.orders += len(group)
+        for (_, _, future), outcome in zip(group, outcomes):
+            future.set_result(outcome)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = GroupCommitQueue(
+                    settings.CHECKOUT_GROUP_COMMIT_WINDOW_MS / 1000,
+                    settings.CHECKOUT_GROUP_COMMIT_MAX_ORDERS
+                )
+    return _queue
+
+
+def submit_order(user, data):
+    """
+    Create a validated order through the writer and wait for it. Returns
+    ``(order, errors)``; raises CheckoutUnavailable when the group has not
+    committed within ``CHECKOUT_GROUP_COMMIT_TIMEOUT`` seconds.
+    """
+    future = get_queue().submit(user, data)
+    try:
+        return future.result(timeout=settings.CHECKOUT_GROUP_COMMIT_TIMEOUT)
+    except FutureTimeoutError:
+        raise CheckoutUnavailable()
@@ -0,0 +1,326 @@
+"""
+Load generation for local capacity testing.
+
+`seed_loadtest` fills the database with a realistic dataset and
+`loadtest` replays mixed checkout traffic against a running server.
+"""
+import asyncio
+import itertools
+import random
+import time
+from bisect import bisect
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    CustomUser, ProductCategory, Product, DiscountRule, Order, OrderItem
+)
+
+USER_PREFIX = 'loadtest-user-'
+ADMIN_USERNAME = 'loadtest-admin'
+CATEGORY_PREFIX = 'loadtest-category-'
+RULE_PREFIX = 'loadtest '
+
+DEFAULT_MIX = {
+    'browse': 55,
+    'order_history': 25,
+    'order_create': 19,
+    'rule_edit': 1,
+}
+
+
+def zipf_cum_weights(n, s=1.1):
+    """Cumulative Zipf weights for ranks 1..n, for random.choices()"""
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def parse_mix(value):
+    """Parse ``browse=55,order_create=20`` into a weight dict"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+@transaction.atomic
+def seed(products=5000, categories=20, users=200, max_history=12,
+         password='loadtest', zipf_s=1.1, rng=None):
+    """
+    Create loadtest categories, products, users with completed-order
+    histories and overlapping discount rules. Returns a summary dict.
+    """
+    rng = rng or random.Random()
+
+    category_objs = ProductCategory.objects.bulk_create([
+        ProductCategory(name=f'{CATEGORY_PREFIX}{i}') for i in range(categories)
+    ])
+    product_objs = Product.objects.bulk_create([
+        Product(
+            name=f'Loadtest product {i}',
+            description=f'Generated product number {i} for load testing',
+            price=Decimal(round(rng.lognormvariate(6.5, 1.0), 2)).quantize(Decimal('0.01')),
+            category=rng.choice(category_objs),
+            stock_quantity=1_000_000
+        )
+        for i in range(products)
+    ])
+
+    # Popularity follows a Zipf distribution over product rank
+    cum_weights = zipf_cum_weights(len(product_objs), zipf_s)
+
+    hashed_password = make_password(password)
+    user_objs = CustomUser.objects.bulk_create([
+        CustomUser(username=f'{USER_PREFIX}{i}', password=hashed_password)
+        for i in range(users)
+    ])
+    CustomUser.objects.create(
+        username=ADMIN_USERNAME, password=hashed_password, is_staff=True
+    )
+
+    # Geometric-ish history lengths: many new customers, a long tail of
+    # loyal ones that pass the flat discount threshold (5 completed orders)
+    histories = [min(max_history, int(rng.expovariate(1 / 4))) for _ in user_objs]
+    # bulk_create() skips Order.save(), which sets completed_at
+    now = timezone.now()
+    orders = Order.objects.bulk_create([
+        Order(user=user, status='completed', completed_at=now)
+        for user, history in zip(user_objs, histories)
+        for _ in range(history)
+    ])
+
+    items = []
+    for order in orders:
+        picked = {
+            product_objs[i].id: product_objs[i]
+            for i in (bisect(cum_weights, rng.random() * cum_weights[-1])
+                      for _ in range(rng.randint(1, 4)))
+        }
+        subtotal = Decimal('0')
+        for product in picked.values():
+            quantity = rng.randint(1, 3)
+            subtotal += product.price * quantity
+            items.append(OrderItem(
+                order=order, product=product, quantity=quantity,
+                unit_price=product.price, category_id=product.category_id
+            ))
+        order.subtotal = order.final_amount = subtotal
+    OrderItem.objects.bulk_create(items, batch_size=2000)
+    Order.objects.bulk_update(orders, ['subtotal', 'final_amount'], batch_size=2000)
+
+    spent = defaultdict(Decimal)
+    for order in orders:
+        spent[order.user_id] += order.final_amount
+    for user in user_objs:
+        user.loyalty_points = int(spent[user.id] // 100)
+    CustomUser.objects.bulk_update(user_objs, ['loyalty_points'], batch_size=2000)
+
+    # Overlapping rules of every type
+    rules = [
+        DiscountRule(name=f'{RULE_PREFIX}5% over 1000', discount_type='percentage',
+                     value=5, min_order_amount=1000, priority=1),
+        DiscountRule(name=f'{RULE_PREFIX}10% over 5000', discount_type='percentage',
+                     value=10, min_order_amount=5000, priority=2),
+        DiscountRule(name=f'{RULE_PREFIX}12% over 10000', discount_type='percentage',
+                     value=12, min_order_amount=10000, priority=3),
+        DiscountRule(name=f'{RULE_PREFIX}loyal 100 off', discount_type='flat',
+                     value=100, min_completed_orders=5, priority=1),
+        DiscountRule(name=f'{RULE_PREFIX}loyal 250 off', discount_type='flat',
+                     value=250, min_completed_orders=5, priority=2),
+    ]
+    for category in category_objs[:max(1, categories // 2)]:
+        rules.append(DiscountRule(
+            name=f'{RULE_PREFIX}{category.name} 5%', discount_type='category',
+            value=5, category=category, priority=1
+        ))
+        rules.append(DiscountRule(
+            name=f'{RULE_PREFIX}{category.name} 8% on 3+', discount_type='category',
+            value=8, category=category, min_quantity=3, priority=2
+        ))
+    DiscountRule.objects.bulk_create(rules)
+
+    return {
+        'categories': len(category_objs),
+        'products': len(product_objs),
+        'users': len(user_objs),
+        'eligible_users': sum(1 for history in histories if history >= 5),
+        'orders': len(orders),
+        'order_items': len(items),
+        'rules': len(rules),
+    }
+
+
+@transaction.atomic
+def reset():
+    """Delete everything created by seed()"""
+    users = CustomUser.objects.filter(username__startswith=USER_PREFIX)
+    OrderItem.objects.filter(order__user__in=users).delete()
+    Order.objects.filter(user__in=users).delete()
+    users.delete()
+    CustomUser.objects.filter(username=ADMIN_USERNAME).delete()
+    DiscountRule.objects.filter(name__startswith=RULE_PREFIX).delete()
+    Product.objects.filter(category__name__startswith=CATEGORY_PREFIX).delete()
+    ProductCategory.objects.filter(name__startswith=CATEGORY_PREFIX).delete()
+
+
+class EndpointStats:
+    """Latency, status and query samples for one endpoint"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.queries = []
+
+    def record(self, latency, status, queries):
+        self.latencies.append(latency)
+        if status == 429:
+            self.throttled += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+        if queries is not None:
+            self.queries.append(queries)
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'rps': count / duration if duration else 0.0,
+            'error_rate': self.errors / count if count else 0.0,
+            'throttled': self.throttled,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            'queries': sum(self.queries) / len(self.queries) if self.queries else None,
+        }
+
+
+class LoadTest:
+    """
+    Open-loop traffic generator: requests are started at the target rate
+    regardless of how fast the server answers, so queuing shows up as
+    latency instead of silently lowering the offered load.
+    """
+
+    def __init__(self, base_url, usernames, password, product_ids, category_names,
+                 rule_ids, rps, duration, mix=None, max_in_flight=500,
+                 zipf_s=1.1, rng=None):
+        self.base_url = base_url.rstrip('/')
+        self.usernames = usernames
+        self.password = password
+        self.product_ids = product_ids
+        self.category_names = category_names
+        self.rule_ids = rule_ids
+        self.rps = rps
+        self.duration = duration
+        self.mix = mix or DEFAULT_MIX
+        self.max_in_flight = max_in_flight
+        self.rng = rng or random.Random()
+        self.cum_weights = zipf_cum_weights(len(product_ids), zipf_s)
+        self.stats = defaultdict(EndpointStats)
+        self.tokens = {}
+        self.admin_token = None
+
+    def run(self):
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.max_in_flight)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits,
+                                     timeout=30) as client:
+            await self._login(client)
+
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+            tasks = []
+            names = list(self.mix)
+            cum_mix = list(itertools.accumulate(self.mix.values()))
+            total = int(self.rps * self.duration)
+
+            start = time.perf_counter()
+            for n in range(total):
+                delay = start + n / self.rps - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                endpoint = names[bisect(cum_mix, self.rng.random() * cum_mix[-1])]
+                await in_flight.acquire()
+                task = asyncio.create_task(self._request(client, endpoint))
+                task.add_done_callback(lambda _task: in_flight.release())
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+
+        return {name: stats.summary(elapsed) for name, stats in sorted(self.stats.items())}
+
+    async def _login(self, client):
+        async def obtain(username):
+            response = await client.post('/api/token/', json={
+                'username': username, 'password': self.password
+            })
+            response.raise_for_status()
+            return username, response.json()['access']
+
+        results = await asyncio.gather(*(obtain(name) for name in self.usernames))
+        self.tokens = dict(results)
+        if self.rule_ids:
+            self.admin_token = (await obtain(ADMIN_USERNAME))[1]
+
+    def _product(self):
+        rank = bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+        return self.product_ids[rank]
+
+    def _build(self, endpoint):
+        """Return (method, url, json body, token) for one request"""
+        token = self.tokens[self.rng.choice(self.usernames)]
+
+        if endpoint == 'browse':
+            params = f'?page={self.rng.randint(1, 5)}'
+            if self.category_names and self.rng.random() < 0.3:
+                params += f'&category={self.rng.choice(self.category_names)}'
+            return 'GET', f'/api/products/{params}', None, token
+        if endpoint == 'order_history':
+            return 'GET', '/api/orders/', None, token
+        if endpoint == 'order_create':
+            product_ids = {self._product() for _ in range(self.rng.randint(1, 4))}
+            body = {'items': [
+                {'product_id': product_id, 'quantity': self.rng.randint(1, 3)}
+                for product_id in product_ids
+            ]}
+            return 'POST', '/api/orders/', body, token
+
+        rule_id = self.rng.choice(self.rule_ids)
+        return ('PATCH', f'/api/discount-rules/{rule_id}/',
+                {'priority': self.rng.randint(0, 5)}, self.admin_token)
+
+    async def _request(self, client, endpoint):
+        method, url, body, token = self._build(endpoint)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        status = queries = None
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body, headers=headers)
+            status = response.status_code
+            if 'X-DB-Queries' in response.headers:
+                queries = int(response.headers['X-DB-Queries'])
+        except Exception:
+            # Timeouts and connection errors are recorded as errors
+            pass
+        self.stats[endpoint].record(time.perf_counter() - start, status, queries)
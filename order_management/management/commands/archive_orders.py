@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from order_management.archive import (
+    archive_cutoff, archivable_orders, archive_orders
+)
+
+
+class Command(BaseCommand):
+    help = "Move old completed/cancelled orders into the archive tables"
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int,
+            default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+            help="Archive orders placed more than this many days ago"
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.ORDER_ARCHIVE_BATCH_SIZE,
+            help="Orders moved per transaction"
+        )
+        parser.add_argument(
+            '--max-batches', type=int, default=None,
+            help="Stop after this many batches"
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report how many orders would be archived"
+        )
+    
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['older_than_days'])
+        
+        if options['dry_run']:
+            count = archivable_orders(cutoff).count()
+            self.stdout.write(f"{count} orders placed before {cutoff:%Y-%m-%d} would be archived")
+            return
+        
+        archived = archive_orders(
+            cutoff,
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} orders"))
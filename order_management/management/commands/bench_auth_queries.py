@@ -0,0 +1,52 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from order_management.authentication import CachedJWTAuthentication
+from order_management.models import CustomUser
+from order_management.serializers import VersionedTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = "Measure DB queries and latency per authenticated request"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        count = options['requests']
+        
+        with transaction.atomic():
+            user = CustomUser.objects.create(username='bench-auth-user')
+            token = VersionedTokenObtainPairSerializer.get_token(user).access_token
+            factory = APIRequestFactory()
+            header = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+            
+            cases = [
+                ('JWTAuthentication', JWTAuthentication, 'get', False),
+                ('CachedJWTAuthentication', CachedJWTAuthentication, 'post', False),
+                ('CachedJWTAuthentication (claims, GET)', CachedJWTAuthentication, 'get', True),
+            ]
+            for label, auth_class, method, trust_claims in cases:
+                cache.delete(CustomUser.auth_cache_key(user.pk, user.token_version))
+                request = getattr(factory, method)('/api/orders/', **header)
+                
+                with override_settings(AUTH_TRUST_TOKEN_CLAIMS=trust_claims), \
+                        CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    for _ in range(count):
+                        authenticated, _token = auth_class().authenticate(request)
+                    elapsed = time.perf_counter() - start
+                
+                assert authenticated.pk == user.pk
+                self.stdout.write(
+                    f"{label:<40} {len(queries) / count:>6.3f} queries/request "
+                    f"{elapsed / count * 1e6:>8.1f} us/request"
+                )
+            
+            transaction.set_rollback(True)
@@ -0,0 +1,98 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from order_management.models import CustomUser, ProductCategory, Product, DiscountRule
+from order_management.serializers import VersionedTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare one POST /api/orders/ per order with POST /api/orders/bulk/ (orders/s, queries/order)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--batch-sizes', default='10,100,500')
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        
+        # Everything is created inside a transaction that is rolled back;
+        # the benchmark user posts far above the checkout rate limits
+        with transaction.atomic(), override_settings(ADMISSION_CONTROL={}):
+            client, product_ids = self._seed(options['products'])
+            orders = [
+                {'items': [
+                    {'product_id': product_id, 'quantity': rng.randint(1, 3)}
+                    for product_id in rng.sample(product_ids, options['items_per_order'])
+                ]}
+                for _ in range(options['orders'])
+            ]
+            
+            self.stdout.write(f"{'mode':<16}{'orders/s':>10}{'queries/order':>15}{'ms/request':>12}")
+            self._report('single', client, [
+                ('/api/orders/', order) for order in orders
+            ], len(orders))
+            for size in [int(size) for size in options['batch_sizes'].split(',') if size]:
+                self._report(f'bulk x{size}', client, [
+                    ('/api/orders/bulk/', {'orders': orders[start:start + size]})
+                    for start in range(0, len(orders), size)
+                ], len(orders))
+            
+            transaction.set_rollback(True)
+    
+    def _seed(self, count):
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f'bench-bulk-category-{i}') for i in range(10)
+        ])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'bench-bulk-product-{i}',
+                description='benchmark product',
+                price=Decimal('10.00') + i % 500,
+                category=categories[i % len(categories)],
+                stock_quantity=1_000_000
+            )
+            for i in range(count)
+        ])
+        DiscountRule.objects.bulk_create([
+            DiscountRule(name='bench-bulk 5%', discount_type='percentage', value=5,
+                         min_order_amount=500),
+            DiscountRule(name='bench-bulk loyal', discount_type='flat', value=50,
+                         min_completed_orders=5),
+        ] + [
+            DiscountRule(name=f'bench-bulk {category.name}', discount_type='category',
+                         value=8, category=category, min_quantity=2)
+            for category in categories[:5]
+        ])
+        user = CustomUser.objects.create(username='bench-bulk-user')
+        token = VersionedTokenObtainPairSerializer.get_token(user).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client, [product.id for product in products]
+    
+    def _report(self, mode, client, requests, order_count):
+        queries = []
+        
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+        
+        with connection.execute_wrapper(count_query):
+            start = time.perf_counter()
+            for url, body in requests:
+                response = client.post(url, body, format='json')
+                if response.status_code != 201:
+                    self.stderr.write(f"{mode}: unexpected {response.status_code}")
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{mode:<16}{order_count / elapsed:>10.0f}"
+            f"{len(queries) / order_count:>15.1f}{elapsed / len(requests) * 1000:>12.1f}"
+        )
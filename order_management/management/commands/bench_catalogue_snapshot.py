@@ -0,0 +1,170 @@
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from order_management.catalogue import CatalogueSnapshot, build_catalogue_snapshot
+from order_management.models import ProductCategory, Product, DiscountRule
+
+
+def memory_kib(path):
+    """
+    (private KiB of this process outside the mapping of ``path``, resident
+    and proportional KiB of that mapping), from /proc (Linux only)
+    """
+    private = mapped_rss = mapped_pss = 0
+    in_mapping = False
+    try:
+        with open('/proc/self/smaps') as smaps:
+            for line in smaps:
+                key, _, rest = line.partition(':')
+                if ' ' in key or '-' in key:
+                    # Mapping header: "start-end perms offset dev inode path"
+                    in_mapping = line.rstrip().endswith(path)
+                    continue
+                if not in_mapping and key in ('Private_Clean', 'Private_Dirty'):
+                    private += int(rest.split()[0])
+                elif in_mapping and key == 'Rss':
+                    mapped_rss += int(rest.split()[0])
+                elif in_mapping and key == 'Pss':
+                    mapped_pss += int(rest.split()[0])
+    except OSError:
+        return None
+    return private, mapped_rss, mapped_pss
+
+
+def _worker(mode, path, product_ids, barrier, results):
+    """Load the catalogue the way one server worker would and report memory"""
+    before = memory_kib(path)
+    snapshot = CatalogueSnapshot(path)
+    if mode == 'mmap':
+        # Fault in every page, as a long-running worker eventually does
+        buffer = snapshot.buffer
+        sum(buffer[offset] for offset in range(0, len(buffer), mmap.PAGESIZE))
+        keep = snapshot
+    else:
+        # Per-worker cache of product instances
+        keep = {pk: snapshot.product(pk) for pk in product_ids}
+        snapshot.buffer.close()
+    barrier.wait()
+    after = memory_kib(path)
+    results.put(None if before is None else (after[0] - before[0], after[1], after[2]))
+    # Stay alive until every worker has measured, so sharing is visible
+    barrier.wait()
+    del keep
+
+
+class Command(BaseCommand):
+    help = "Compare the shared memory-mapped catalogue with per-worker caches and ORM lookups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200_000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--lookups', type=int, default=100_000)
+        parser.add_argument('--orm-lookups', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalogue.snapshot')
+            # Everything is created inside a transaction that is rolled back
+            with transaction.atomic():
+                product_ids = self._seed(rng, options['products'])
+                start = time.perf_counter()
+                build_catalogue_snapshot(path)
+                self.stdout.write(
+                    f"built snapshot of {len(product_ids)} products in "
+                    f"{time.perf_counter() - start:.2f}s, "
+                    f"{os.path.getsize(path) / 1024 ** 2:.1f} MiB on disk"
+                )
+                self._latency(rng, path, product_ids, options)
+                transaction.set_rollback(True)
+
+            self._memory(path, product_ids, options['workers'])
+
+    def _seed(self, rng, count):
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f'bench-catalogue-category-{i}') for i in range(20)
+        ])
+        products = []
+        for offset in range(0, count, 5000):
+            products += Product.objects.bulk_create([
+                Product(
+                    name=f'bench-catalogue-product-{i}',
+                    description='benchmark product',
+                    price=Decimal(rng.randint(100, 500_000)) / 100,
+                    category=rng.choice(categories),
+                    stock_quantity=rng.randint(0, 500)
+                )
+                for i in range(offset, min(offset + 5000, count))
+            ])
+        DiscountRule.objects.bulk_create([
+            DiscountRule(name=f'bench-catalogue {category.name}', discount_type='category',
+                         value=5, category=category)
+            for category in categories
+        ])
+        return [product.id for product in products]
+
+    def _latency(self, rng, path, product_ids, options):
+        snapshot = CatalogueSnapshot(path)
+        cache = {pk: snapshot.product(pk) for pk in product_ids}
+        ids = [rng.choice(product_ids) for _ in range(options['lookups'])]
+        orm_ids = ids[:options['orm_lookups']]
+
+        def timed(label, lookup, sample):
+            start = time.perf_counter()
+            for pk in sample:
+                lookup(pk)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{label:<34}{elapsed / len(sample) * 1e6:>10.2f}")
+
+        self.stdout.write(f"{'lookup':<34}{'us/lookup':>10}")
+        timed('mmap slot (price, category, ...)', snapshot.lookup, ids)
+        timed('mmap Product instance', snapshot.product, ids)
+        timed('per-worker dict cache', cache.get, ids)
+        timed('ORM get(pk)', lambda pk: Product.objects.only(
+            'price', 'category_id', 'stock_quantity', 'is_active').get(pk=pk), orm_ids)
+        missing = max(product_ids) + 1
+        timed('mmap miss', snapshot.lookup, [missing] * len(ids))
+
+    def _memory(self, path, product_ids, workers):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(
+            "\nMiB per worker: private = heap growth, mapped = resident snapshot "
+            "pages, pss = private + proportional share of the mapping"
+        )
+        self.stdout.write(
+            f"{'mode':<8}{'workers':>8}{'private':>14}{'mapped':>13}"
+            f"{'pss/worker':>15}{'pss total':>12}"
+        )
+        for mode in ('mmap', 'dict'):
+            barrier = context.Barrier(workers)
+            results = context.Queue()
+            processes = [
+                context.Process(target=_worker, args=(mode, path, product_ids, barrier, results))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            samples = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            if samples[0] is None:
+                self.stdout.write(f"{mode:<8}{workers:>8}  (needs /proc/self/smaps)")
+                continue
+            private = sum(sample[0] for sample in samples) / workers / 1024
+            mapped_rss = sum(sample[1] for sample in samples) / workers / 1024
+            mapped_pss = sum(sample[2] for sample in samples) / workers / 1024
+            self.stdout.write(
+                f"{mode:<8}{workers:>8}{private:>14.1f}{mapped_rss:>13.1f}"
+                f"{private + mapped_pss:>15.1f}{(private + mapped_pss) * workers:>12.1f}"
+            )
@@ -0,0 +1,149 @@
+import random
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from order_management import groupcommit
+from order_management.models import CustomUser, ProductCategory, Product, DiscountRule, Order
+from order_management.serializers import VersionedTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-request checkout transactions with the group-commit checkout under "
+        "concurrent POST /api/orders/ (orders/s, latency). Writes to the database and "
+        "deletes its data afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16,
+                            help="Concurrent clients, one thread each")
+        parser.add_argument('--orders-per-client', type=int, default=50)
+        parser.add_argument('--windows', default='0,2,5',
+                            help="Group commit windows to try, in milliseconds")
+        parser.add_argument('--max-orders', type=int, default=64)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # The writer thread uses its own connection, so the data has to be
+        # committed rather than rolled back at the end
+        users, product_ids = self._seed(options['clients'], options['products'])
+        try:
+            bodies = [
+                [
+                    {'items': [
+                        {'product_id': product_id, 'quantity': rng.randint(1, 3)}
+                        for product_id in rng.sample(product_ids, options['items_per_order'])
+                    ]}
+                    for _ in range(options['orders_per_client'])
+                ]
+                for _ in users
+            ]
+            self.stdout.write(
+                f"{options['clients']} clients x {options['orders_per_client']} orders, "
+                f"{connection.vendor}"
+            )
+            self.stdout.write(
+                f"{'mode':<22}{'orders/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'orders/commit':>15}"
+            )
+            # Clients post far above the checkout rate limits
+            with override_settings(ADMISSION_CONTROL={}, CHECKOUT_GROUP_COMMIT=False):
+                self._report('per-request commit', users, bodies, None)
+            for window in [float(window) for window in options['windows'].split(',') if window]:
+                queue = groupcommit.GroupCommitQueue(window / 1000, options['max_orders'])
+                groupcommit._queue = queue
+                with override_settings(ADMISSION_CONTROL={}, CHECKOUT_GROUP_COMMIT=True):
+                    self._report(f'group commit {window:g}ms', users, bodies, queue)
+        finally:
+            groupcommit._queue = None
+            self._clean(users)
+
+    def _seed(self, clients, count):
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f'bench-checkout-category-{i}') for i in range(10)
+        ])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'bench-checkout-product-{i}',
+                description='benchmark product',
+                price=Decimal('10.00') + i % 500,
+                category=categories[i % len(categories)],
+                stock_quantity=1_000_000
+            )
+            for i in range(count)
+        ])
+        DiscountRule.objects.bulk_create([
+            DiscountRule(name='bench-checkout 5%', discount_type='percentage', value=5,
+                         min_order_amount=500),
+        ] + [
+            DiscountRule(name=f'bench-checkout {category.name}', discount_type='category',
+                         value=8, category=category, min_quantity=2)
+            for category in categories[:5]
+        ])
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-checkout-user-{i}') for i in range(clients)
+        ])
+        return users, [product.id for product in products]
+
+    def _clean(self, users):
+        Order.objects.filter(user__in=users).delete()
+        DiscountRule.objects.filter(name__startswith='bench-checkout').delete()
+        Product.objects.filter(name__startswith='bench-checkout-product-').delete()
+        ProductCategory.objects.filter(name__startswith='bench-checkout-category-').delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _report(self, mode, users, bodies, queue):
+        latencies = []
+        errors = []
+        start_line = threading.Barrier(len(users) + 1)
+
+        def client(user, orders):
+            token = VersionedTokenObtainPairSerializer.get_token(user).access_token
+            api = APIClient()
+            api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            start_line.wait()
+            try:
+                for body in orders:
+                    started = time.perf_counter()
+                    try:
+                        response = api.post('/api/orders/', body, format='json')
+                    except DatabaseError:
+                        # e.g. SQLite's "database is locked" when two
+                        # transactions upgrade to a write lock at once
+                        errors.append(500)
+                    else:
+                        if response.status_code != 201:
+                            errors.append(response.status_code)
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=client, args=(user, orders))
+            for user, orders in zip(users, bodies)
+        ]
+        for thread in threads:
+            thread.start()
+        start_line.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        per_commit = f"{queue.orders / queue.groups:>15.1f}" if queue and queue.groups else f"{1:>15}"
+        self.stdout.write(
+            f"{mode:<22}{(len(latencies) - len(errors)) / elapsed:>10.0f}"
+            f"{statistics.median(latencies) * 1000:>9.1f}{p99 * 1000:>9.1f}"
+            f"{len(errors):>8}{per_commit}"
+        )
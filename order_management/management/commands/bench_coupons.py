@@ -0,0 +1,200 @@
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from order_management import coupons, groupcommit
+from order_management.models import (
+    Coupon, CouponUsage, CustomUser, DiscountRule, Order, Product, ProductCategory
+)
+from order_management.serializers import VersionedTokenObtainPairSerializer
+from order_management.views import OrderListView
+
+# Attempts per checkout when SQLite reports "database is locked"
+ATTEMPTS = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Time coupon generation and lookups (Bloom filter vs the code index), then race "
+        "concurrent checkouts for the same codes and check none is redeemed past its "
+        "limits. Writes to the database and deletes its data afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codes', type=int, default=100_000,
+                            help="Single-use codes to generate")
+        parser.add_argument('--lookups', type=int, default=20_000,
+                            help="Unknown codes looked up")
+        parser.add_argument('--clients', type=int, default=16,
+                            help="Concurrent checkouts racing for each code, one thread each")
+        parser.add_argument('--rounds', type=int, default=5,
+                            help="Codes raced for per check")
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-coupons-')
+        path = os.path.join(directory, 'coupons.bloom')
+        users, product, rules = self._seed(options['clients'])
+        try:
+            with override_settings(COUPON_FILTER_PATH=path, ADMISSION_CONTROL={}):
+                codes = self._lookups(rules['single'], options)
+                self.stdout.write(
+                    f"{options['clients']} concurrent checkouts per code, {connection.vendor}"
+                )
+                self.stdout.write(f"{'race':<34}{'redeemed':>10}{'expected':>10}{'uses':>7}")
+                failures = 0
+                rounds = options['rounds']
+                for index, group_commit in enumerate((False, True)):
+                    mode = 'group commit' if group_commit else 'per-request'
+                    if group_commit:
+                        groupcommit._queue = groupcommit.GroupCommitQueue(0.002, 64)
+                    with override_settings(CHECKOUT_GROUP_COMMIT=group_commit):
+                        failures += self._races(
+                            mode, users, product, rules,
+                            codes[index * rounds:(index + 1) * rounds]
+                        )
+        finally:
+            groupcommit._queue = None
+            self._clean(users)
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            os.rmdir(directory)
+        if failures:
+            raise CommandError(f"{failures} races redeemed a coupon past its limits")
+
+    def _seed(self, clients):
+        category = ProductCategory.objects.create(name='bench-coupons-category')
+        product = Product.objects.create(
+            name='bench-coupons-product', description='benchmark product',
+            price=Decimal('50.00'), category=category, stock_quantity=1_000_000
+        )
+        rules = {
+            'single': DiscountRule.objects.create(
+                name='bench-coupons single-use', discount_type='percentage', value=10,
+                requires_coupon=True
+            ),
+            # A user may redeem one coupon of this rule, whichever code
+            'per_user': DiscountRule.objects.create(
+                name='bench-coupons one per user', discount_type='flat', value=5,
+                requires_coupon=True, max_uses_per_user=1
+            ),
+        }
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-coupons-user-{i}') for i in range(clients)
+        ])
+        return users, product, rules
+
+    def _clean(self, users):
+        Order.objects.filter(user__in=users).delete()
+        DiscountRule.objects.filter(name__startswith='bench-coupons').delete()
+        Product.objects.filter(name='bench-coupons-product').delete()
+        ProductCategory.objects.filter(name='bench-coupons-category').delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def _lookups(self, rule, options):
+        """Generate the codes, build the filter and time unknown code lookups"""
+        started = time.perf_counter()
+        codes = sorted(coupons.create_coupons(rule, options['codes']))
+        self.stdout.write(f"generated and inserted {len(codes)} codes in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        bloom = coupons.build_coupon_filter()
+        self.stdout.write(
+            f"built the filter in {time.perf_counter() - started:.2f}s: "
+            f"{bloom.bits // 8 / 2**10:.0f} KiB, {bloom.hashes} hashes"
+        )
+
+        unknown = sorted(coupons.generate_codes(options['lookups']) - set(codes))
+        coupons.might_exist(unknown[0])
+        started = time.perf_counter()
+        passed = sum(coupons.might_exist(code) for code in unknown)
+        filtered = time.perf_counter() - started
+        started = time.perf_counter()
+        for code in unknown:
+            Coupon.objects.filter(code=code).exists()
+        queried = time.perf_counter() - started
+        self.stdout.write(
+            f"unknown code, filter {filtered / len(unknown) * 1e6:.2f} us vs query "
+            f"{queried / len(unknown) * 1e6:.1f} us; false positives "
+            f"{passed / len(unknown):.3%}"
+        )
+        missed = sum(not coupons.might_exist(code) for code in codes)
+        self.stdout.write(f"valid codes rejected by the filter: {missed}")
+        return codes
+
+    def _races(self, mode, users, product, rules, single_use):
+        failures = 0
+        for code in single_use:
+            failures += self._race(
+                f'{mode}, single-use code', users, product, [code] * len(users), 1
+            )
+
+        # One user, a different code of a one-per-user rule in each checkout
+        user = users[0]
+        per_user = sorted(coupons.create_coupons(rules['per_user'], len(users), prefix='U'))
+        failures += self._race(
+            f'{mode}, one per user', [user] * len(users), product, per_user, 1
+        )
+        usage = CouponUsage.objects.filter(user=user, rule=rules['per_user']).first()
+        if usage is None or usage.uses != 1:
+            failures += 1
+        CouponUsage.objects.filter(rule=rules['per_user']).delete()
+        Order.objects.filter(coupon__rule=rules['per_user']).delete()
+        return failures
+
+    def _race(self, label, users, product, codes, expected):
+        """Post one checkout per user at once, returns 1 if a limit was broken"""
+        created = []
+        start_line = threading.Barrier(len(users))
+        tokens = {
+            user.pk: VersionedTokenObtainPairSerializer.get_token(user).access_token
+            for user in set(users)
+        }
+
+        view = OrderListView.as_view()
+        factory = APIRequestFactory()
+
+        def client(user, code):
+            body = {'items': [{'product_id': product.pk, 'quantity': 1}], 'coupon_code': code}
+            start_line.wait()
+            try:
+                for _ in range(ATTEMPTS):
+                    # Not the test client: it re-raises exceptions of requests
+                    # served by other threads
+                    request = factory.post(
+                        '/api/orders/', body, format='json',
+                        HTTP_AUTHORIZATION=f'Bearer {tokens[user.pk]}'
+                    )
+                    try:
+                        response = view(request)
+                    except OperationalError:
+                        # SQLite's "database is locked"; the order was rolled back
+                        time.sleep(0.01)
+                        continue
+                    if response.status_code == 201:
+                        created.append(response.data['id'])
+                    break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=pair) for pair in zip(users, codes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        uses = Coupon.objects.filter(code__in=set(codes)).aggregate(uses=Sum('uses'))['uses']
+        redeemed = Order.objects.filter(pk__in=created, coupon__code__in=set(codes)).count()
+        broken = len(created) != expected or redeemed != expected or uses != expected
+        self.stdout.write(
+            f"{label:<34}{len(created):>10}{expected:>10}{uses:>7}"
+            + ("  LIMIT BROKEN" if broken else "")
+        )
+        return int(broken)
@@ -0,0 +1,143 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from order_management.loadgen import percentile, zipf_cum_weights
+from order_management.models import ProductCategory, Product
+from order_management.search import search_products
+from order_management.serializers import ProductValuesSerializer
+
+ADJECTIVES = (
+    'wireless', 'portable', 'classic', 'organic', 'smart', 'compact', 'premium',
+    'vintage', 'ergonomic', 'waterproof', 'stainless', 'handmade', 'foldable',
+    'rechargeable', 'lightweight', 'heavy', 'digital', 'ceramic', 'leather', 'bamboo',
+)
+NOUNS = (
+    'headphones', 'speaker', 'keyboard', 'backpack', 'kettle', 'lamp', 'watch',
+    'camera', 'blender', 'jacket', 'sneakers', 'notebook', 'monitor', 'router',
+    'charger', 'mug', 'tent', 'bicycle', 'drone', 'printer', 'mattress', 'guitar',
+    'thermos', 'projector', 'microphone', 'tripod', 'wallet', 'sunglasses',
+)
+FILLER = (
+    'designed', 'for', 'everyday', 'use', 'with', 'durable', 'materials', 'and',
+    'a', 'two', 'year', 'warranty', 'ships', 'fast', 'great', 'gift', 'travel',
+    'office', 'home', 'outdoor', 'quality', 'comfort', 'battery', 'cable',
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the q search parameter of the product list on a large catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-baseline', action='store_true',
+                            help="Skip the unindexed icontains comparison")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # Everything is created inside a transaction that is rolled back
+        with transaction.atomic():
+            start = time.perf_counter()
+            categories = self._seed(rng, options)
+            self.stdout.write(
+                f"seeded {options['products']} products (index maintained by "
+                f"triggers) in {time.perf_counter() - start:.1f}s"
+            )
+            self._run(rng, categories, options)
+            transaction.set_rollback(True)
+
+    def _seed(self, rng, options):
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f'bench-search-category-{i}')
+            for i in range(options['categories'])
+        ])
+        # Zipf word popularity gives both very common and rare terms
+        noun_weights = zipf_cum_weights(len(NOUNS))
+        batch_size = 5000
+        for offset in range(0, options['products'], batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=' '.join([
+                        rng.choice(ADJECTIVES),
+                        rng.choices(NOUNS, cum_weights=noun_weights)[0],
+                        f'model {i}',
+                    ]),
+                    description=' '.join(rng.choices(FILLER, k=12)),
+                    price=Decimal(rng.randint(100, 500_000)) / 100,
+                    category=rng.choice(categories),
+                    stock_quantity=100
+                )
+                for i in range(offset, min(offset + batch_size, options['products']))
+            ])
+        return categories
+
+    def _queries(self, rng, categories):
+        """(label, query params) of the benchmarked requests"""
+        category = categories[0].name
+        return [
+            ('common term', {'q': NOUNS[0]}),
+            ('rare term', {'q': NOUNS[-1]}),
+            ('two terms', {'q': f'{ADJECTIVES[0]} {NOUNS[1]}'}),
+            ('prefix', {'q': NOUNS[2][:4]}),
+            ('term + category', {'q': NOUNS[0], 'category': category}),
+            ('term + price', {'q': NOUNS[0], 'min_price': '100', 'max_price': '250'}),
+            ('all filters', {'q': f'{ADJECTIVES[1]} {NOUNS[0]}', 'category': category,
+                             'max_price': '1000'}),
+            ('exact model', {'q': f'model {rng.randrange(1000)}'}),
+        ]
+
+    def _page(self, params, page_size, search):
+        """Count and first page, as the paginated list endpoint runs them"""
+        queryset = Product.objects.filter(is_active=True)
+        if 'category' in params:
+            queryset = queryset.filter(category__name__iexact=params['category'])
+        if 'min_price' in params:
+            queryset = queryset.filter(price__gte=Decimal(params['min_price']))
+        if 'max_price' in params:
+            queryset = queryset.filter(price__lte=Decimal(params['max_price']))
+        queryset = search(queryset, params['q'])
+        count = queryset.count()
+        rows = ProductValuesSerializer.values(queryset)[:page_size]
+        return count, ProductValuesSerializer.to_representation(rows)
+
+    def _run(self, rng, categories, options):
+        searches = [('fts', search_products)]
+        if not options['no_baseline']:
+            searches.append(('icontains', icontains_search))
+
+        self.stdout.write(
+            f"{'query':<18}{'search':<11}{'matches':>9}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        for label, params in self._queries(rng, categories):
+            for name, search in searches:
+                # Unindexed scans are slow; fewer repeats keep the run short
+                repeat = options['repeat'] if name == 'fts' else max(1, options['repeat'] // 10)
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    count, _ = self._page(params, options['page_size'], search)
+                    timings.append(time.perf_counter() - start)
+                timings.sort()
+                self.stdout.write(
+                    f"{label:<18}{name:<11}{count:>9}"
+                    f"{percentile(timings, 50) * 1000:>9.1f}"
+                    f"{percentile(timings, 99) * 1000:>9.1f}"
+                    f"{timings[-1] * 1000:>9.1f}"
+                )
+
+
+def icontains_search(queryset, query):
+    """Unindexed substring search, the previous client-side equivalent"""
+    condition = Q()
+    for term in query.split():
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).order_by('name')
@@ -0,0 +1,86 @@
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from order_management.copurchase import CoPurchaseMatrix
+
+
+class Command(BaseCommand):
+    help = "Time building the co-purchase matrix and top-K neighbours from a synthetic order history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=10_000_000)
+        parser.add_argument('--products', type=int, default=50_000)
+        parser.add_argument('--step', type=int, default=1_000_000,
+                            help="Lines per add_lines() call, as update_recommendations reads them")
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--incremental-orders', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        order_ids, product_ids = self._history(rng, options['lines'], options['products'])
+        self.stdout.write(
+            f"{len(product_ids):,} lines, {int(order_ids[-1]) + 1:,} orders, "
+            f"{options['products']:,} products"
+        )
+
+        tracemalloc.start()
+        matrix = CoPurchaseMatrix()
+        start = time.perf_counter()
+        for begin in range(0, len(order_ids), options['step']):
+            end = begin + options['step']
+            # Steps end on an order boundary
+            end = int(np.searchsorted(order_ids, order_ids[min(end, len(order_ids)) - 1], 'right'))
+            if begin < end:
+                matrix.add_lines(order_ids[begin:end], product_ids[begin:end])
+        build = time.perf_counter() - start
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        products = np.flatnonzero(matrix.orders)
+        start = time.perf_counter()
+        neighbours = matrix.neighbours(products, options['top_k'], min_count=2)
+        top_k = time.perf_counter() - start
+        _, top_k_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        counts = matrix.counts
+        matrix_bytes = counts.data.nbytes + counts.indices.nbytes + counts.indptr.nbytes
+        self.stdout.write(f"{'full build':<22}{build:>8.1f}s  peak {build_peak / 2**20:>7.0f} MiB")
+        self.stdout.write(
+            f"{'top-' + str(options['top_k']) + ' neighbours':<22}{top_k:>8.1f}s  "
+            f"peak {top_k_peak / 2**20:>7.0f} MiB  ({len(neighbours):,} products, "
+            f"{top_k / max(len(neighbours), 1) * 1e6:.0f} us each)"
+        )
+        self.stdout.write(f"{'matrix':<22}{counts.nnz:>9,} pairs  {matrix_bytes / 2**20:.0f} MiB")
+
+        # An incremental run: a batch of new orders, then only their products
+        new_orders, new_products = self._history(
+            rng, options['incremental_orders'] * 3, options['products'],
+            first_order=int(order_ids[-1]) + 1
+        )
+        start = time.perf_counter()
+        changed = matrix.add_lines(new_orders, new_products)
+        matrix.neighbours(changed, options['top_k'], min_count=2)
+        incremental = time.perf_counter() - start
+        self.stdout.write(
+            f"{'incremental update':<22}{incremental:>8.1f}s  "
+            f"({len(np.unique(new_orders)):,} orders, {len(changed):,} products re-ranked)"
+        )
+        self.stdout.write(
+            f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10:.0f} MiB"
+        )
+
+    def _history(self, rng, lines, products, first_order=0):
+        """Order lines sorted by order: Zipf-popular products, 1-8 lines per order"""
+        sizes = rng.integers(1, 9, size=lines // 2 + 1)
+        sizes = sizes[:int(np.searchsorted(np.cumsum(sizes), lines)) + 1]
+        order_ids = np.repeat(np.arange(first_order, first_order + len(sizes)), sizes)[:lines]
+        product_ids = (rng.zipf(1.3, size=len(order_ids)) - 1) % products
+        # Popularity spread over the catalogue instead of the lowest ids
+        product_ids = rng.permutation(products)[product_ids]
+        return order_ids, product_ids
@@ -0,0 +1,163 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from order_management import telemetry
+from order_management.models import (
+    CustomUser, DiscountRule, Order, OrderItem, Product, ProductCategory
+)
+from order_management.rules import CompiledRuleSet, category_default_rule
+from order_management.utils import DiscountCalculator
+
+
+def walk_ancestors(parents, category_id):
+    ancestors = set()
+    while category_id is not None:
+        ancestors.add(category_id)
+        category_id = parents.get(category_id)
+    return ancestors
+
+
+class ParentWalkRuleSet(CompiledRuleSet):
+    """Baseline walking an item's parent links on every order"""
+
+    def __init__(self, rules, parents, category_defaults=()):
+        super().__init__(rules, category_defaults=category_defaults)
+        self.parents = parents
+
+    def covering_categories(self, category_id):
+        return walk_ancestors(self.parents, category_id) & self.rule_categories
+
+
+class Command(BaseCommand):
+    help = (
+        "Time pricing with every rule evaluated vs the compiled rule index over a "
+        "category tree, with and without telemetry"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=5000)
+        parser.add_argument('--depth', type=int, default=8,
+                            help="Levels of the category tree")
+        parser.add_argument('--default-discounts', type=int, default=50,
+                            help="Categories with a default discount percentage")
+        parser.add_argument('--category-rules', type=int, default=400)
+        parser.add_argument('--percentage-rules', type=int, default=20)
+        parser.add_argument('--flat-rules', type=int, default=5)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        categories, parents = self._tree(rng, options['categories'], options['depth'])
+        rules = self._rules(rng, options, categories)
+        discounted = rng.sample(categories, min(options['default_discounts'], len(categories)))
+        for category in discounted:
+            category.discount_percentage = Decimal(rng.randint(1, 5))
+        defaults = [category_default_rule(category) for category in discounted]
+        orders = [self._order(rng, categories) for _ in range(options['orders'])]
+
+        # As ProductCategory.ancestor_map() reads it from the closure table
+        ancestors = {
+            category.pk: frozenset(walk_ancestors(parents, category.pk))
+            for category in categories if category.pk in parents
+        }
+        compiled = CompiledRuleSet(rules, ancestors, defaults)
+        walking = ParentWalkRuleSet(rules, parents, defaults)
+
+        self.stdout.write(
+            f"{len(rules)} rules and {len(defaults)} category defaults over "
+            f"{len(categories)} categories {options['depth']} levels deep, {len(orders)} orders; "
+            f"us/order and rules evaluated per order"
+        )
+        self.stdout.write(f"{'mode':<26}{'us/order':>10}{'evaluated':>11}")
+        results = {}
+        for label, index, flush_interval, rule_set in (
+            ('every rule', False, 0, compiled),
+            ('every rule + telemetry', False, 60, compiled),
+            ('index, parent walk', True, 0, walking),
+            ('index', True, 0, compiled),
+            ('index + telemetry', True, 60, compiled),
+        ):
+            with override_settings(DISCOUNT_RULE_INDEX=index, RULE_STATS_FLUSH_INTERVAL=flush_interval):
+                # Counts stay in memory, nothing is flushed
+                telemetry.reset()
+                totals = []
+                start = time.perf_counter()
+                for order, items in orders:
+                    calculator = DiscountCalculator(order, items=items, rules=rule_set)
+                    calculator.apply_discounts()
+                    totals.append(order.total_discount)
+                elapsed = time.perf_counter() - start
+                evaluated = sum(telemetry.reset()[0]['evaluations'].values())
+            results[label] = totals
+            per_order = f"{evaluated / len(orders):>11.1f}" if flush_interval else f"{'-':>11}"
+            self.stdout.write(f"{label:<26}{elapsed / len(orders) * 1e6:>10.1f}{per_order}")
+
+        mismatches = sum(a != b for a, b in zip(results['every rule'], results['index']))
+        self.stdout.write(f"orders priced differently with the index: {mismatches}")
+        mismatches = sum(a != b for a, b in zip(results['index, parent walk'], results['index']))
+        self.stdout.write(f"orders priced differently with the ancestor map: {mismatches}")
+
+        # Finding the rule categories covering each item, on its own
+        for label, rule_set in (('parent walk', walking), ('ancestor map', compiled)):
+            start = time.perf_counter()
+            for _, items in orders:
+                rule_set.items_by_category(items)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"category lookup, {label:<14}{elapsed / len(orders) * 1e6:>8.2f} us/order")
+
+    def _tree(self, rng, count, depth):
+        """Unsaved categories, level by level under a random parent, and their parent ids"""
+        categories = []
+        parents = {}
+        level = []
+        for depth_index in range(depth):
+            size = count // depth + (depth_index < count % depth)
+            previous, level = level, []
+            for _ in range(size):
+                pk = len(categories) + 1
+                category = ProductCategory(id=pk, name=f'bench-rules-category-{pk}')
+                if previous:
+                    category.parent_id = parents[pk] = rng.choice(previous).pk
+                categories.append(category)
+                level.append(category)
+        return categories, parents
+
+    def _rules(self, rng, options, categories):
+        rules = []
+
+        def rule(**fields):
+            rules.append(DiscountRule(
+                id=len(rules) + 1, name=f'bench rule {len(rules) + 1}', **fields
+            ))
+
+        for _ in range(options['percentage_rules']):
+            threshold = rng.choice([None, 500, 1000, 5000, 20000, 100000])
+            rule(discount_type='percentage', value=Decimal(rng.randint(2, 15)),
+                 min_order_amount=None if threshold is None else Decimal(threshold))
+        for _ in range(options['flat_rules']):
+            rule(discount_type='flat', value=Decimal(rng.randint(50, 300)))
+        # Unsaved, like the snapshot's rules with their category attached
+        for _ in range(options['category_rules']):
+            rule(discount_type='category', value=Decimal(rng.randint(2, 20)),
+                 category=rng.choice(categories), min_quantity=rng.choice([None, 2, 3]))
+        return rules
+
+    def _order(self, rng, categories):
+        order = Order(user=CustomUser(id=1, username='bench-rules-user'))
+        items = []
+        for product_id in range(rng.randint(1, 6)):
+            product = Product(
+                id=product_id + 1, price=Decimal(rng.randint(100, 500_000)) / 100,
+                category_id=rng.choice(categories).pk
+            )
+            items.append(OrderItem(
+                product=product, quantity=rng.randint(1, 3),
+                unit_price=product.price, category_id=product.category_id
+            ))
+        order.subtotal = sum(item.unit_price * item.quantity for item in items)
+        return order, items
@@ -0,0 +1,124 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from order_management.models import (
+    CustomUser, ProductCategory, Product, Order, OrderItem
+)
+from order_management.renderers import ORJSONRenderer
+from order_management.serializers import (
+    ProductSerializer, OrderSerializer,
+    ProductValuesSerializer, OrderValuesSerializer
+)
+
+
+class Command(BaseCommand):
+    help = "Compare ModelSerializer and values() fast path throughput (rows/s)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=5)
+    
+    def handle(self, *args, **options):
+        # Everything is created inside a transaction that is rolled back
+        with transaction.atomic():
+            user = self._seed(options)
+            self._run(user, options['repeat'])
+            transaction.set_rollback(True)
+    
+    def _seed(self, options):
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f'bench-category-{i}') for i in range(10)
+        ])
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'bench-product-{i:06d}',
+                description='benchmark product ' * 5,
+                price=Decimal('10.00') + i % 997,
+                category=categories[i % len(categories)],
+                stock_quantity=100
+            )
+            for i in range(options['products'])
+        ])
+        user = CustomUser.objects.create(username='bench-serializers-user')
+        orders = Order.objects.bulk_create([
+            Order(
+                user=user,
+                subtotal=Decimal('100.00'),
+                total_discount=Decimal('10.00'),
+                final_amount=Decimal('90.00'),
+                discount_breakdown={'percentage_discount': {'amount': 10.0}}
+            )
+            for _ in range(options['orders'])
+        ])
+        per_order = min(options['items_per_order'], len(products))
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=products[(n * per_order + k) % len(products)],
+                category_id=products[(n * per_order + k) % len(products)].category_id,
+                quantity=1 + k,
+                unit_price=products[(n * per_order + k) % len(products)].price
+            )
+            for n, order in enumerate(orders)
+            for k in range(per_order)
+        ])
+        return user
+    
+    def _run(self, user, repeat):
+        products = Product.objects.filter(is_active=True).order_by('name', 'id')
+        orders = Order.objects.filter(user=user).order_by('-order_date', 'id')
+        
+        cases = [
+            (
+                'products',
+                lambda: ProductSerializer(products.select_related('category'), many=True).data,
+                lambda: ProductValuesSerializer.to_representation(
+                    ProductValuesSerializer.values(products)
+                ),
+            ),
+            (
+                'orders',
+                lambda: OrderSerializer(
+                    orders.select_related('user').prefetch_related(
+                        'items__product__category', 'items__category'
+                    ),
+                    many=True
+                ).data,
+                lambda: OrderValuesSerializer.to_representation(
+                    OrderValuesSerializer.values(orders)
+                ),
+            ),
+        ]
+        
+        for name, model_serializer, fast_path in cases:
+            expected = model_serializer()
+            data = fast_path()
+            rows = len(data)
+            identical = JSONRenderer().render(expected) == JSONRenderer().render(data)
+            
+            self.stdout.write(f"{name}: {rows} rows, identical output: {identical}")
+            for label, func in (('ModelSerializer', model_serializer),
+                                ('values() fast path', fast_path)):
+                elapsed = self._best_of(func, repeat)
+                self.stdout.write(f"  {label:<20} {rows / elapsed:>12,.0f} rows/s")
+            for renderer in (JSONRenderer(), ORJSONRenderer()):
+                elapsed = self._best_of(lambda: renderer.render(data), repeat)
+                self.stdout.write(
+                    f"  {type(renderer).__name__:<20} {rows / elapsed:>12,.0f} rows/s rendered"
+                )
+    
+    @staticmethod
+    def _best_of(func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,90 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from order_management.models import DiscountRule
+from order_management.stacking import Candidate, solve, solve_exhaustive
+
+
+class Command(BaseCommand):
+    help = "Compare the stacking solver against exhaustive search (correctness and latency)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='8,12,16,18',
+                            help="Applicable rule counts checked against exhaustive search")
+        parser.add_argument('--large', default='40,80',
+                            help="Rule counts timed for the solver only")
+        parser.add_argument('--groups', type=int, default=12,
+                            help="Size of the exclusivity group pool")
+        parser.add_argument('--trials', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--scenario', choices=['realistic', 'adversarial'], default='realistic',
+            help="realistic: default type/category groups with some explicit "
+                 "groups; adversarial: every rule in 1-3 random groups"
+        )
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        groups = [f'g{i}' for i in range(options['groups'])]
+        self.adversarial = options['scenario'] == 'adversarial'
+        
+        self.stdout.write(f"scenario: {options['scenario']}")
+        self.stdout.write(f"{'rules':>6}{'solver us':>12}{'exhaustive us':>15}{'mismatches':>12}")
+        for size in self._sizes(options['sizes']):
+            solver_time = exhaustive_time = 0.0
+            mismatches = 0
+            for _ in range(options['trials']):
+                candidates, cap = self._scenario(rng, size, groups)
+                start = time.perf_counter()
+                _, total = solve(candidates, cap)
+                solver_time += time.perf_counter() - start
+                start = time.perf_counter()
+                _, expected = solve_exhaustive(candidates, cap)
+                exhaustive_time += time.perf_counter() - start
+                mismatches += total != expected
+            trials = options['trials']
+            self.stdout.write(
+                f"{size:>6}{solver_time / trials * 1e6:>12.1f}"
+                f"{exhaustive_time / trials * 1e6:>15.1f}{mismatches:>12}"
+            )
+        
+        for size in self._sizes(options['large']):
+            elapsed = 0.0
+            for _ in range(options['trials']):
+                candidates, cap = self._scenario(rng, size, groups)
+                start = time.perf_counter()
+                solve(candidates, cap)
+                elapsed += time.perf_counter() - start
+            self.stdout.write(
+                f"{size:>6}{elapsed / options['trials'] * 1e6:>12.1f}{'-':>15}{'-':>12}"
+            )
+    
+    @staticmethod
+    def _sizes(value):
+        return [int(size) for size in value.split(',') if size]
+    
+    def _scenario(self, rng, size, groups):
+        """Random applicable rules with random amounts and subtotal"""
+        candidates = []
+        for pk in range(1, size + 1):
+            if self.adversarial or rng.random() < 0.2:
+                exclusivity_group = ','.join(rng.sample(groups, rng.randint(1, 3)))
+            else:
+                exclusivity_group = ''
+            rule = DiscountRule(
+                id=pk,
+                name=f'rule {pk}',
+                discount_type=rng.choice(['percentage', 'flat', 'category']),
+                value=Decimal(rng.randint(1, 30)),
+                category_id=rng.randint(1, 10),
+                priority=rng.randint(0, 3),
+                exclusivity_group=exclusivity_group,
+                is_combinable=rng.random() > 0.1
+            )
+            amount = Decimal(rng.randint(1000, 100000)) / 100
+            candidates.append(Candidate(rule, amount))
+        cap = Decimal(rng.randint(5000, 500000)) / 100
+        return candidates, cap
@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from order_management.catalogue import CatalogueSnapshot, build_catalogue_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write the memory-mapped catalogue and rule snapshot shared by workers"
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=settings.CATALOGUE_SNAPSHOT_PATH,
+            help="Snapshot file (default: CATALOGUE_SNAPSHOT_PATH)"
+        )
+    
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError("Set CATALOGUE_SNAPSHOT_PATH or pass --path")
+        
+        start = time.perf_counter()
+        path = build_catalogue_snapshot(options['path'])
+        snapshot = CatalogueSnapshot(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(snapshot)} products and {len(snapshot.rules.rules)} rules "
+            f"to {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MiB) "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
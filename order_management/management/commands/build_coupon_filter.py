@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from order_management.coupons import build_coupon_filter
+
+
+class Command(BaseCommand):
+    help = "Rebuild the Bloom filter of coupon codes at COUPON_FILTER_PATH from the database"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Write here instead of COUPON_FILTER_PATH")
+        parser.add_argument('--extra', type=int, default=0,
+                            help="Room for this many codes to be added before the next rebuild")
+    
+    def handle(self, *args, **options):
+        path = options['path'] or settings.COUPON_FILTER_PATH
+        if not path:
+            raise CommandError("Set COUPON_FILTER_PATH or pass --path")
+        bloom = build_coupon_filter(path, extra=options['extra'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {bloom.count} codes to {path} ({bloom.bits // 8 / 2**20:.1f} MiB, "
+            f"{bloom.hashes} hashes, room for {bloom.capacity})"
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from order_management.coupons import create_coupons
+from order_management.models import DiscountRule
+
+
+class Command(BaseCommand):
+    help = "Generate single-use (or --max-uses) coupon codes for a discount rule with requires_coupon"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('rule_id', type=int)
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--length', type=int, default=None,
+                            help="Random characters per code (default COUPON_CODE_LENGTH)")
+        parser.add_argument('--prefix', default='')
+        parser.add_argument('--max-uses', type=int, default=1,
+                            help="Redemptions allowed per code")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--output', help="File to write the new codes to, one per line")
+    
+    def handle(self, *args, **options):
+        rule = DiscountRule.objects.filter(pk=options['rule_id']).first()
+        if rule is None:
+            raise CommandError(f"Discount rule {options['rule_id']} does not exist")
+        if not rule.requires_coupon:
+            raise CommandError(f"Discount rule {rule.pk} does not require a coupon")
+        
+        codes = create_coupons(
+            rule, options['count'], length=options['length'],
+            prefix=options['prefix'].upper(), max_uses=options['max_uses'],
+            batch_size=options['batch_size']
+        )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(f'{code}\n' for code in sorted(codes))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(codes)} coupons for rule {rule.pk} ({rule.name})"
+        ))
@@ -0,0 +1,94 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from order_management import loadgen
+from order_management.models import CustomUser, Product, ProductCategory, DiscountRule
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive mixed browse/checkout/history/admin traffic at a target RPS "
+        "against a running server (seed it first with seed_loadtest)"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--rps', type=float, default=50)
+        parser.add_argument('--duration', type=float, default=30, help="Seconds")
+        parser.add_argument('--users', type=int, default=50,
+                            help="Number of seeded users sending traffic")
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument(
+            '--mix', default=None,
+            help="Endpoint weights, e.g. browse=55,order_history=25,order_create=19,rule_edit=1"
+        )
+        parser.add_argument('--max-in-flight', type=int, default=500)
+        parser.add_argument('--zipf', type=float, default=1.1)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    
+    def handle(self, *args, **options):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise CommandError("loadtest requires httpx: pip install httpx")
+        
+        try:
+            mix = loadgen.parse_mix(options['mix']) if options['mix'] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        
+        usernames = list(
+            CustomUser.objects.filter(username__startswith=loadgen.USER_PREFIX)
+            .order_by('id').values_list('username', flat=True)[:options['users']]
+        )
+        product_ids = list(
+            Product.objects.filter(
+                is_active=True, category__name__startswith=loadgen.CATEGORY_PREFIX
+            ).order_by('id').values_list('id', flat=True)
+        )
+        if not usernames or not product_ids:
+            raise CommandError("No load test data found, run seed_loadtest first")
+        category_names = list(
+            ProductCategory.objects.filter(name__startswith=loadgen.CATEGORY_PREFIX)
+            .values_list('name', flat=True)
+        )
+        rule_ids = list(
+            DiscountRule.objects.filter(name__startswith=loadgen.RULE_PREFIX)
+            .values_list('id', flat=True)
+        )
+        
+        test = loadgen.LoadTest(
+            base_url=options['base_url'],
+            usernames=usernames,
+            password=options['password'],
+            product_ids=product_ids,
+            category_names=category_names,
+            rule_ids=rule_ids,
+            rps=options['rps'],
+            duration=options['duration'],
+            mix=mix,
+            max_in_flight=options['max_in_flight'],
+            zipf_s=options['zipf'],
+            rng=random.Random(options['seed'])
+        )
+        report = test.run()
+        
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        
+        self.stdout.write(
+            f"{'endpoint':<15}{'requests':>9}{'rps':>8}{'errors':>8}{'429':>6}"
+            f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'queries':>9}"
+        )
+        for endpoint, row in report.items():
+            queries = '-' if row['queries'] is None else f"{row['queries']:.1f}"
+            self.stdout.write(
+                f"{endpoint:<15}{row['requests']:>9}{row['rps']:>8.1f}"
+                f"{row['error_rate']:>8.1%}{row['throttled']:>6}"
+                f"{row['p50_ms']:>9.1f}{row['p90_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+                f"{row['max_ms']:>9.1f}{queries:>9}"
+            )
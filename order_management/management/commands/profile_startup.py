@@ -0,0 +1,213 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+PHASE_MARKER = 'profile_startup phase: '
+RESULT_MARKER = 'profile_startup result: '
+PHASES = ('startup', 'harness', 'warmup', 'fixtures', 'requests')
+
+
+def parse_importtime(stderr):
+    """
+    Split ``python -X importtime`` output by phase marker into
+    ``{phase: [(module, self_us, cumulative_us, depth)]}``
+    """
+    phase = 'startup'
+    imports = defaultdict(list)
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER):].strip()
+            continue
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports[phase].append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+CHILD_SCRIPT = """
+import sys, time
+sys.path.insert(0, {base_dir!r})
+import ecommerce.wsgi
+ready_at = time.time()
+sys.stderr.write({marker!r} + 'harness\\n')
+from order_management.management.commands.profile_startup import profile_child
+profile_child(ready_at, {warmup!r})
+"""
+
+
+def profile_child(ready_at, warmup):
+    """Runs in the profiled process once the WSGI module is imported"""
+    def phase(name):
+        sys.stderr.write(f"{PHASE_MARKER}{name}\n")
+        sys.stderr.flush()
+
+    phase('warmup')
+    steps = {}
+    if warmup:
+        # Imported here so the run without warm-up does not preload its modules
+        from order_management.warmup import warm_up
+        steps = warm_up()
+
+    phase('fixtures')
+    with transaction.atomic():
+        client, order_payload = _fixtures()
+
+        phase('requests')
+        endpoints = []
+        order_id = None
+        for name, method, url, body in _endpoints(order_payload):
+            url = url.format(order_id=order_id)
+            timings = []
+            for _ in range(2):
+                start = time.perf_counter()
+                if method == 'POST':
+                    response = client.post(url, body, content_type='application/json')
+                else:
+                    response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            if method == 'POST' and response.status_code == 201:
+                order_id = json.loads(response.content)['id']
+            endpoints.append([name, response.status_code, *timings])
+
+        transaction.set_rollback(True)
+
+    sys.stdout.write(RESULT_MARKER + json.dumps({
+        'ready_at': ready_at, 'warmup_steps': steps, 'endpoints': endpoints,
+    }) + '\n')
+
+
+def _fixtures():
+    """Staff user with a token and an orderable product (rolled back)"""
+    from django.test import Client
+    from order_management.models import CustomUser, Product, ProductCategory
+    from order_management.serializers import VersionedTokenObtainPairSerializer
+
+    user = CustomUser.objects.create(username='profile-startup-user', is_staff=True)
+    token = VersionedTokenObtainPairSerializer.get_token(user).access_token
+    category = ProductCategory.objects.create(name='profile-startup-category')
+    product = Product.objects.create(
+        name='Profile startup product', description='profile_startup fixture',
+        price=100, category=category, stock_quantity=1000
+    )
+    client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+    return client, {'items': [{'product_id': product.id, 'quantity': 1}]}
+
+
+def _endpoints(order_payload):
+    return [
+        ('GET /api/products/', 'GET', '/api/products/', None),
+        ('GET /api/products/?q=', 'GET', '/api/products/?q=profile', None),
+        ('GET /api/orders/', 'GET', '/api/orders/', None),
+        ('POST /api/orders/', 'POST', '/api/orders/', json.dumps(order_payload)),
+        ('GET /api/orders/<id>/', 'GET', '/api/orders/{order_id}/', None),
+        ('GET /api/discount-rules/', 'GET', '/api/discount-rules/', None),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Report import time per module and first-request latency per endpoint of a fresh worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help="Modules listed in the import time report")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail if a first request exceeds COLD_START_BUDGET_MS")
+
+    def handle(self, *args, **options):
+        cold = self._spawn(warmup=False)
+        warm = self._spawn(warmup=True)
+
+        self._imports_report(cold['imports'], warm['imports'], options['top'])
+        self._startup_report(cold, warm)
+        slowest = self._endpoint_report(cold, warm)
+
+        budget = settings.COLD_START_BUDGET_MS
+        verdict = 'within' if slowest <= budget else 'OVER'
+        self.stdout.write(
+            f"\nslowest first request after warm-up: {slowest:.1f} ms, "
+            f"{verdict} the cold-start budget of {budget} ms"
+        )
+        if options['check'] and slowest > budget:
+            raise CommandError("Cold-start budget exceeded")
+
+    def _spawn(self, warmup):
+        """Run a fresh interpreter under -X importtime and collect its results"""
+        # Start like a server worker: import the WSGI module, nothing else
+        command = [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT.format(
+            base_dir=str(settings.BASE_DIR), warmup=warmup, marker=PHASE_MARKER
+        )]
+        # The child decides when (and whether) to warm up
+        env = dict(os.environ, WARMUP_ON_STARTUP='false')
+
+        spawned_at = time.time()
+        process = subprocess.run(command, capture_output=True, text=True, env=env)
+        results = [
+            line[len(RESULT_MARKER):] for line in process.stdout.splitlines()
+            if line.startswith(RESULT_MARKER)
+        ]
+        if process.returncode or not results:
+            raise CommandError(f"Profiled process failed:\n{process.stderr[-3000:]}")
+
+        result = json.loads(results[-1])
+        result['startup_ms'] = (result['ready_at'] - spawned_at) * 1000
+        result['imports'] = parse_importtime(process.stderr)
+        return result
+
+    def _imports_report(self, cold, warm, top):
+        self.stdout.write("Imports per phase (count, self time ms)")
+        self.stdout.write(f"{'phase':<10}{'no warm-up':>18}{'warm-up':>18}")
+        for phase in PHASES:
+            columns = ''.join(
+                f"{len(imports[phase]):>8}{sum(item[1] for item in imports[phase]) / 1000:>10.1f}"
+                for imports in (cold, warm)
+            )
+            self.stdout.write(f"{phase:<10}{columns}")
+
+        self.stdout.write(f"\nSlowest imports at startup (top {top} by self time)")
+        self.stdout.write(f"{'module':<60}{'self ms':>9}{'cumul. ms':>11}")
+        for name, self_us, cumulative_us, _ in sorted(
+                cold['startup'], key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"{name:<60}{self_us / 1000:>9.1f}{cumulative_us / 1000:>11.1f}")
+
+        lazy = [item for item in cold['requests'] if item[3] == 0]
+        self.stdout.write(f"\nImported lazily by the first requests without warm-up ({len(lazy)})")
+        for name, _, cumulative_us, _ in sorted(lazy, key=lambda item: -item[2])[:top]:
+            self.stdout.write(f"  {name:<58}{cumulative_us / 1000:>9.1f} ms")
+        remaining = [item[0] for item in warm['requests'] if item[3] == 0]
+        self.stdout.write(
+            f"Still imported by the first requests after warm-up: {', '.join(remaining) or 'none'}"
+        )
+
+    def _startup_report(self, cold, warm):
+        self.stdout.write("\nStartup (process spawn until the app is importable and set up)")
+        self.stdout.write(f"  without warm-up: {cold['startup_ms']:.1f} ms")
+        steps = ', '.join(f"{name} {ms:.1f}" for name, ms in warm['warmup_steps'].items())
+        self.stdout.write(
+            f"  with warm-up:    {warm['startup_ms']:.1f} ms + warm-up "
+            f"{sum(warm['warmup_steps'].values()):.1f} ms ({steps})"
+        )
+
+    def _endpoint_report(self, cold, warm):
+        self.stdout.write("\nFirst-request latency per endpoint (ms)")
+        self.stdout.write(
+            f"{'endpoint':<34}{'status':>7}{'cold 1st':>10}{'cold 2nd':>10}"
+            f"{'warm 1st':>10}{'warm 2nd':>10}"
+        )
+        slowest = 0.0
+        for (name, status, cold_first, cold_second), (_, _, warm_first, warm_second) in zip(
+                cold['endpoints'], warm['endpoints']):
+            slowest = max(slowest, warm_first)
+            self.stdout.write(
+                f"{name:<34}{status:>7}{cold_first:>10.1f}{cold_second:>10.1f}"
+                f"{warm_first:>10.1f}{warm_second:>10.1f}"
+            )
+        return slowest
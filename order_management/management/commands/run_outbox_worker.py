@@ -0,0 +1,45 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from order_management.outbox import process_batch, purge_processed
+
+
+class Command(BaseCommand):
+    help = "Drain the outbox: loyalty updates, cache invalidations and other post-commit work"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the outbox is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no events are due")
+    
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        
+        total = 0
+        purged_at = 0
+        while self.running:
+            close_old_connections()
+            claimed = process_batch(options['batch_size'])
+            total += claimed
+            if claimed:
+                continue
+            
+            if options['once']:
+                break
+            if time.monotonic() - purged_at > 3600:
+                purge_processed()
+                purged_at = time.monotonic()
+            time.sleep(options['poll_interval'])
+        
+        self.stdout.write(f"Processed {total} outbox events")
+    
+    def _stop(self, signum, frame):
+        self.running = False
@@ -0,0 +1,39 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from order_management import loadgen
+
+
+class Command(BaseCommand):
+    help = "Seed a realistic dataset for the load test harness"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--max-history', type=int, default=12,
+                            help="Maximum completed orders per user")
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help="Zipf exponent of product popularity")
+        parser.add_argument('--seed', type=int, default=None,
+                            help="Random seed for a reproducible dataset")
+        parser.add_argument('--reset', action='store_true',
+                            help="Delete previously seeded data first")
+    
+    def handle(self, *args, **options):
+        if options['reset']:
+            loadgen.reset()
+        
+        summary = loadgen.seed(
+            products=options['products'],
+            categories=options['categories'],
+            users=options['users'],
+            max_history=options['max_history'],
+            password=options['password'],
+            zipf_s=options['zipf'],
+            rng=random.Random(options['seed'])
+        )
+        for key, value in summary.items():
+            self.stdout.write(f"{key:<16} {value}")
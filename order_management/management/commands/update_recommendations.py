@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from order_management.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = "Count newly completed orders into the co-purchase matrix and refresh product recommendations"
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Rebuild the matrix from every completed order, e.g. after returns"
+        )
+    
+    def handle(self, *args, **options):
+        summary = update_recommendations(full=options['full'])
+        mode = "Rebuilt" if summary['full'] else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"{mode} recommendations of {summary['products']} products from "
+            f"{summary['orders']} orders ({summary['lines']} lines) in {summary['seconds']:.1f}s"
+        ))
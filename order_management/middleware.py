@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+
+class QueryCountHeaderMiddleware:
+    """
+    Report the number of DB queries run for a request in ``X-DB-Queries``.
+    
+    Enabled with the ``QUERY_COUNT_HEADER`` setting; used by the load test
+    harness to attribute queries to endpoints.
+    """
+    header = 'X-DB-Queries'
+    
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_HEADER:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        queries = [0]
+        
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+        
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        response[self.header] = str(queries[0])
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0004_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountrule',
+            name='exclusivity_group',
+            field=models.CharField(blank=True, help_text='Rules sharing a group never stack; separate several groups with commas. Defaults to one group per discount type (per category for category-based discounts)', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='discountrule',
+            name='is_combinable',
+            field=models.BooleanField(default=True, help_text='Uncheck to only ever apply this rule on its own'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0005_discountrule_stacking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountrule',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, help_text='Rule stops applying at this time (leave empty for no end)', null=True),
+        ),
+        migrations.AddField(
+            model_name='discountrule',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, help_text='Rule applies from this time (leave empty for no start)', null=True),
+        ),
+    ]
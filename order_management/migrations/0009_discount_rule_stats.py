@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0008_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscountRuleStats',
+            fields=[
+                ('rule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='order_management.discountrule')),
+                ('evaluations', models.PositiveBigIntegerField(default=0)),
+                ('matches', models.PositiveBigIntegerField(default=0, help_text="Evaluations where the order met the rule's conditions")),
+                ('applications', models.PositiveBigIntegerField(default=0, help_text='Matches chosen in the best discount combination')),
+                ('discount_granted', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('timed_evaluations', models.PositiveBigIntegerField(default=0, help_text='Evaluations whose time was measured (a sample)')),
+                ('evaluation_ns', models.PositiveBigIntegerField(default=0, help_text='Time spent in the timed evaluations, in nanoseconds')),
+                ('last_matched_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'discount rule stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='DiscountRuleReport',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'discount rule report',
+                'verbose_name_plural': 'discount rule report',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('order_management.discountrule',),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0009_discount_rule_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendations',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendations', serialize=False, to='order_management.product')),
+                ('items', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'product recommendations',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
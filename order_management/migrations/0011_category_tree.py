@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_closure_rows(apps, schema_editor):
+    """Existing categories are all top level: each is only its own ancestor"""
+    ProductCategory = apps.get_model('order_management', 'ProductCategory')
+    CategoryClosure = apps.get_model('order_management', 'CategoryClosure')
+    CategoryClosure.objects.bulk_create([
+        CategoryClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+        for pk in ProductCategory.objects.values_list('pk', flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0010_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcategory',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='Category rules and default discounts of the parent also cover this category', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='children', to='order_management.productcategory'),
+        ),
+        migrations.AlterField(
+            model_name='discountrule',
+            name='exclusivity_group',
+            field=models.CharField(blank=True, help_text='Rules sharing a group never stack; separate several groups with commas. Defaults to one group per discount type; category-based discounts covering the same categories never stack', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='productcategory',
+            name='discount_percentage',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Default discount percentage for this category and its subcategories', max_digits=5),
+        ),
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='order_management.productcategory')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='order_management.productcategory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='order_manag_descend_9028d5_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='categoryclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_category_closure'),
+        ),
+        migrations.RunPython(add_closure_rows, migrations.RunPython.noop),
+    ]
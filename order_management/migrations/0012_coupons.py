@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0011_category_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountrule',
+            name='max_uses_per_user',
+            field=models.PositiveIntegerField(blank=True, help_text='Coupons of this rule one user can redeem (leave empty for no limit)', null=True),
+        ),
+        migrations.AddField(
+            model_name='discountrule',
+            name='requires_coupon',
+            field=models.BooleanField(default=False, help_text="Only apply to orders redeeming one of this rule's coupons"),
+        ),
+        migrations.CreateModel(
+            name='CouponUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupon_usage', to='order_management.discountrule')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupon_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Coupon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=32, unique=True)),
+                ('max_uses', models.PositiveIntegerField(default=1)),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupons', to='order_management.discountrule')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='coupon',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='order_management.coupon'),
+        ),
+        migrations.AddConstraint(
+            model_name='couponusage',
+            constraint=models.UniqueConstraint(fields=('user', 'rule'), name='unique_coupon_usage'),
+        ),
+    ]
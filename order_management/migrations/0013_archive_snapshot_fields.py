@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:16
+
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+import django.db.models.deletion
+
+
+def copy_product_names(apps, schema_editor):
+    """Fill in the products and categories of already archived items that still exist"""
+    db = schema_editor.connection.alias
+    ArchivedOrderItem = apps.get_model('order_management', 'ArchivedOrderItem')
+    Product = apps.get_model('order_management', 'Product')
+    ProductCategory = apps.get_model('order_management', 'ProductCategory')
+    # Products and categories always live in the main database
+    products = {
+        pk: (name, price) for pk, name, price in
+        Product.objects.using(DEFAULT_DB_ALIAS).values_list('pk', 'name', 'price')
+    }
+    categories = dict(
+        ProductCategory.objects.using(DEFAULT_DB_ALIAS).values_list('pk', 'name')
+    )
+    items = ArchivedOrderItem.objects.using(db).only('product_id', 'category_id').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(items.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            break
+        for item in batch:
+            item.product_name, item.product_price = products.get(item.product_id, ('', None))
+            item.category_name = categories.get(item.category_id, '')
+        ArchivedOrderItem.objects.using(db).bulk_update(
+            batch, ['product_name', 'product_price', 'category_name']
+        )
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0012_coupons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='coupon',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='order_management.coupon'),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='category_name',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product_name',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='product_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        # Runs on the database holding the archive (ORDER_ARCHIVE_DATABASE)
+        migrations.RunPython(
+            copy_product_names, migrations.RunPython.noop,
+            hints={'model_name': 'archivedorderitem'}
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+FTS_TABLE = 'order_management_product_fts'
+PRODUCT_TABLE = 'order_management_product'
+
+
+def sqlite_schema(tokenize):
+    return [
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+        f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+        f"DROP TABLE IF EXISTS {FTS_TABLE}",
+        f"""
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            name, description,
+            content='{PRODUCT_TABLE}', content_rowid='id',
+            tokenize='{tokenize}'
+        )
+        """,
+        f"""
+        CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {FTS_TABLE}_au
+        AFTER UPDATE OF name, description ON {PRODUCT_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+        """,
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def postgres_index(config):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config),
+        name='product_search_idx'
+    )
+
+
+def reindex(tokenize, config, old_config):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            for statement in sqlite_schema(tokenize):
+                schema_editor.execute(statement)
+        elif vendor == 'postgresql':
+            Product = apps.get_model('order_management', 'Product')
+            schema_editor.remove_index(Product, postgres_index(old_config))
+            schema_editor.add_index(Product, postgres_index(config))
+    return run
+
+
+# Stemming broke prefix search ("runn" never matched "running", indexed as "run")
+unstemmed = reindex('unicode61 remove_diacritics 2', 'simple', 'english')
+stemmed = reindex('porter unicode61 remove_diacritics 2', 'english', 'simple')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0013_archive_snapshot_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='order_management.product')),
+                ('document', models.TextField(db_column='order_management_product_fts')),
+            ],
+            options={
+                'db_table': 'order_management_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(unstemmed, stemmed),
+    ]
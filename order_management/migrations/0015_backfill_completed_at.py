@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def backfill_completed_at(apps, schema_editor):
+    """
+    Orders completed before completed_at existed, or through bulk_create,
+    are taken as completed when placed
+    """
+    Order = apps.get_model('order_management', 'Order')
+    Order.objects.using(schema_editor.connection.alias).filter(
+        status='completed', completed_at__isnull=True
+    ).update(completed_at=F('order_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order_management', '0014_product_search_prefix'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_completed_at, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
-from django.db import models
+import secrets
+
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.cache import cache
 from django.utils import timezone
 from django.db.models import Sum, F, Count
@@ -9,11 +12,63 @@ class CustomUser(AbstractUser):
     """Extended user model for e-commerce platform"""
     loyalty_points = models.PositiveIntegerField(default=0)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
+    # Completed orders moved to the archive tables, kept so that loyalty and
+    # eligibility stay correct without querying the archive
+    archived_completed_orders = models.PositiveIntegerField(default=0)
+    archived_completed_total = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0
+    )
+    # Part of the cache key for authenticated users; bump to revoke tokens
+    token_version = models.PositiveIntegerField(default=0)
+    
+    @staticmethod
+    def auth_cache_key(user_id, token_version):
+        """Cache key used by CachedJWTAuthentication"""
+        return f'auth_user_{user_id}_v{token_version}'
+    
+    @staticmethod
+    def token_version_cache_key(user_id):
+        """Current token version of an active user, checked for trusted claims"""
+        return f'auth_user_{user_id}_version'
+    
+    @staticmethod
+    def eligibility_cache_key(user_id):
+        """Cache key for eligible_for_flat_discount"""
+        return f'user_{user_id}_flat_discount_eligible'
+    
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Admin search by exact e-mail address
+            models.Index(fields=['email']),
+        ]
+    
+    def save(self, *args, **kwargs):
+        """Drop the cached authenticated user whenever the row changes"""
+        super().save(*args, **kwargs)
+        cache.delete_many([
+            self.auth_cache_key(self.pk, self.token_version),
+            self.token_version_cache_key(self.pk),
+        ])
+    
+    def delete(self, *args, **kwargs):
+        cache.delete_many([
+            self.auth_cache_key(self.pk, self.token_version),
+            self.token_version_cache_key(self.pk),
+        ])
+        return super().delete(*args, **kwargs)
+    
+    def revoke_tokens(self):
+        """Invalidate every token issued to this user so far"""
+        cache.delete(self.auth_cache_key(self.pk, self.token_version))
+        self.token_version += 1
+        self.save(update_fields=['token_version'])
     
     @property
     def eligible_for_flat_discount(self):
         """Check if user is eligible for flat discount based on purchase history"""
-        cache_key = f'user_{self.id}_flat_discount_eligible'
+        cache_key = self.eligibility_cache_key(self.id)
         eligible = cache.get(cache_key)
         
         if eligible is None:
@@ -22,7 +77,7 @@ class CustomUser(AbstractUser):
                 status='completed',
                 is_cancelled=False,
                 is_returned=False
-            ).count()
+            ).count() + self.archived_completed_orders
             
             eligible = completed_orders >= 5
             cache.set(cache_key, eligible, timeout=3600)  # Cache for 1 hour
@@ -36,26 +91,138 @@ class CustomUser(AbstractUser):
             is_cancelled=False,
             is_returned=False
         ).aggregate(total=Sum('final_amount'))['total'] or 0
+        total_spent += self.archived_completed_total
         
         # 1 point for every ₹100 spent -- added extra requirements
         self.loyalty_points = total_spent//100
-        self.save()
+        self.save(update_fields=['loyalty_points'])
 
 
 class ProductCategory(models.Model):
-    """Product category model"""
+    """Product category model, nested under an optional parent"""
     
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    parent = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='children',
+        help_text="Category rules and default discounts of the parent also cover this category"
+    )
     discount_percentage = models.DecimalField(
         max_digits=5, 
         decimal_places=2, 
         default=0.00,
-        help_text="Default discount percentage for this category"
+        help_text="Default discount percentage for this category and its subcategories"
     )
     
     def __str__(self):
         return self.name
+    
+    def clean(self):
+        if self.parent_id is not None and self.pk is not None and CategoryClosure.objects.filter(
+            ancestor_id=self.pk, descendant_id=self.parent_id
+        ).exists():
+            raise ValidationError({'parent': "A category cannot be nested under itself or its subcategories"})
+    
+    def save(self, *args, **kwargs):
+        """Keep CategoryClosure in step with ``parent``"""
+        with transaction.atomic():
+            adding = self._state.adding
+            if not adding:
+                self.clean()
+                previous_parent_id = (
+                    ProductCategory.objects.filter(pk=self.pk)
+                    .values_list('parent_id', flat=True).first()
+                )
+            super().save(*args, **kwargs)
+            if adding:
+                CategoryClosure.objects.bulk_create(
+                    [CategoryClosure(ancestor_id=self.pk, descendant_id=self.pk, depth=0)]
+                    + [
+                        CategoryClosure(ancestor_id=ancestor_id, descendant_id=self.pk, depth=depth + 1)
+                        for ancestor_id, depth in self._parent_ancestors()
+                    ]
+                )
+            elif previous_parent_id != self.parent_id:
+                self._move_subtree()
+    
+    def _parent_ancestors(self):
+        """(ancestor id, depth below it) of the parent, itself included"""
+        if self.parent_id is None:
+            return []
+        # Categories made with bulk_create() have no rows; top-level ones
+        # need none
+        return list(
+            CategoryClosure.objects.filter(descendant_id=self.parent_id)
+            .values_list('ancestor_id', 'depth')
+        ) or [(self.parent_id, 0)]
+    
+    def _move_subtree(self):
+        """Re-link this category and its subcategories under the new parent"""
+        subtree = list(
+            CategoryClosure.objects.filter(ancestor_id=self.pk)
+            .values_list('descendant_id', 'depth')
+        )
+        if not subtree:
+            CategoryClosure.objects.create(ancestor_id=self.pk, descendant_id=self.pk, depth=0)
+            subtree = [(self.pk, 0)]
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+        CategoryClosure.objects.filter(descendant_id__in=subtree_ids).exclude(
+            ancestor_id__in=subtree_ids
+        ).delete()
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(
+                ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth + below + 1
+            )
+            for ancestor_id, depth in self._parent_ancestors()
+            for descendant_id, below in subtree
+        ], batch_size=1000)
+    
+    @classmethod
+    def ancestor_map(cls):
+        """
+        ``{category id: frozenset of its ancestor ids and itself}`` for the
+        categories that have a parent
+        """
+        ancestors = {}
+        rows = CategoryClosure.objects.filter(depth__gt=0).values_list('descendant_id', 'ancestor_id')
+        for descendant_id, ancestor_id in rows.iterator(chunk_size=10000):
+            ancestors.setdefault(descendant_id, {descendant_id}).add(ancestor_id)
+        return {category_id: frozenset(ids) for category_id, ids in ancestors.items()}
+
+
+class CategoryClosure(models.Model):
+    """
+    Transitive closure of the category tree: one row per (ancestor,
+    descendant) pair, including each category with itself at depth 0, so
+    ancestors and subtrees are read with one indexed query.
+    """
+    
+    ancestor = models.ForeignKey(
+        ProductCategory,
+        on_delete=models.CASCADE,
+        related_name='descendant_links'
+    )
+    descendant = models.ForeignKey(
+        ProductCategory,
+        on_delete=models.CASCADE,
+        related_name='ancestor_links'
+    )
+    depth = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_category_closure'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'ancestor']),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor_id} > {self.descendant_id} ({self.depth})"
 
 
 class Product(models.Model):
@@ -78,6 +245,29 @@ class Product(models.Model):
         return f"{self.name} (₹{self.price})"
 
 
+class ProductSearchEntry(models.Model):
+    """
+    Row of the SQLite FTS5 index over product names and descriptions (see
+    search.py). The table and the triggers keeping it in sync are created by
+    migrations; it is only read, joined through ``Product.search_entry``.
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_entry'
+    )
+    # FTS5's hidden column named after the table: the left side of MATCH
+    # and the first argument of its ranking functions
+    document = models.TextField(db_column='order_management_product_fts')
+    
+    class Meta:
+        managed = False
+        db_table = 'order_management_product_fts'
+
+
 class DiscountRule(models.Model):
     """Model for configurable discount rules"""
     
@@ -119,6 +309,37 @@ class DiscountRule(models.Model):
         default=0,
         help_text="higher priority discounts are applied first"
     )
+    exclusivity_group = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="Rules sharing a group never stack; separate several groups "
+                  "with commas. Defaults to one group per discount type; "
+                  "category-based discounts covering the same categories "
+                  "never stack"
+    )
+    is_combinable = models.BooleanField(
+        default=True,
+        help_text="Uncheck to only ever apply this rule on its own"
+    )
+    requires_coupon = models.BooleanField(
+        default=False,
+        help_text="Only apply to orders redeeming one of this rule's coupons"
+    )
+    max_uses_per_user = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Coupons of this rule one user can redeem (leave empty for no limit)"
+    )
+    starts_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Rule applies from this time (leave empty for no start)"
+    )
+    ends_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Rule stops applying at this time (leave empty for no end)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -129,16 +350,143 @@ class DiscountRule(models.Model):
         return f"{self.name} ({self.get_discount_type_display()})"
     
     @classmethod
-    def get_active_rules(cls):
-        """Get cached active discount rules"""
-        cache_key = 'active_discount_rules'
-        rules = cache.get(cache_key)
+    def get_active_rules(cls, now=None):
+        """Get cached discount rules live at ``now`` (default: current time)"""
+        from .rules import get_rule_snapshot
         
-        if rules is None:
-            rules = list(cls.objects.filter(is_active=True).order_by('-priority'))
-            cache.set(cache_key, rules, timeout=300)  # Cache for 5 minutes
+        return get_rule_snapshot().rules_at(now or timezone.now())
+    
+    @classmethod
+    def get_compiled_rules(cls, now=None):
+        """Rules live at ``now`` indexed for pricing (rules.CompiledRuleSet)"""
+        from .rules import get_rule_snapshot
         
-        return rules
+        return get_rule_snapshot().compiled_at(now or timezone.now())
+    
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': "End must be after the start"})
+
+
+class DiscountRuleStats(models.Model):
+    """
+    How often a rule is evaluated, matches an order and is applied.
+    
+    Counted in memory by each worker and added here periodically (see
+    order_management.telemetry); counts start at ``created_at``.
+    """
+    rule = models.OneToOneField(
+        DiscountRule,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='stats'
+    )
+    evaluations = models.PositiveBigIntegerField(default=0)
+    matches = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Evaluations where the order met the rule's conditions"
+    )
+    applications = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Matches chosen in the best discount combination"
+    )
+    discount_granted = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    timed_evaluations = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Evaluations whose time was measured (a sample)"
+    )
+    evaluation_ns = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Time spent in the timed evaluations, in nanoseconds"
+    )
+    last_matched_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "discount rule stats"
+    
+    def __str__(self):
+        return f"Stats of rule #{self.rule_id}"
+
+
+class DiscountRuleReport(DiscountRule):
+    """Discount rules with their evaluation stats, for the admin report"""
+    
+    class Meta:
+        proxy = True
+        verbose_name = "discount rule report"
+        verbose_name_plural = "discount rule report"
+
+
+class Coupon(models.Model):
+    """
+    Promotional code unlocking a discount rule with ``requires_coupon``.
+    
+    ``uses`` is only incremented by a conditional update (see
+    order_management.coupons), so concurrent checkouts never redeem a code
+    more than ``max_uses`` times.
+    """
+    
+    code = models.CharField(max_length=32, unique=True)
+    rule = models.ForeignKey(
+        DiscountRule,
+        on_delete=models.CASCADE,
+        related_name='coupons'
+    )
+    max_uses = models.PositiveIntegerField(default=1)
+    uses = models.PositiveIntegerField(default=0)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    # Replaced whenever coupons are created; coupon filters keep the stamp
+    # they were last synced at
+    CREATED_CACHE_KEY = 'coupons_created'
+    
+    def __str__(self):
+        return self.code
+    
+    @staticmethod
+    def new_stamp():
+        return secrets.token_bytes(16)
+    
+    @classmethod
+    def mark_created(cls):
+        """Tell coupon filters they miss newer coupons"""
+        cache.set(cls.CREATED_CACHE_KEY, cls.new_stamp(), timeout=None)
+    
+    def save(self, *args, **kwargs):
+        """New coupons are added to the coupon filter by the outbox worker"""
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                OutboxEvent.enqueue('coupons.created')
+                transaction.on_commit(self.mark_created)
+
+
+class CouponUsage(models.Model):
+    """Coupons of a rule redeemed by a user, for ``DiscountRule.max_uses_per_user``"""
+    
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='coupon_usage'
+    )
+    rule = models.ForeignKey(
+        DiscountRule,
+        on_delete=models.CASCADE,
+        related_name='coupon_usage'
+    )
+    uses = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'rule'], name='unique_coupon_usage'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} / {self.rule_id}: {self.uses}"
 
 
 class Order(models.Model):
@@ -150,6 +498,8 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
         ('returned', 'Returned'),
     )
+    # Statuses that change the user's loyalty points or eligibility
+    SETTLED_STATUSES = ('completed', 'cancelled', 'returned')
     
     user = models.ForeignKey(
         CustomUser, 
@@ -168,9 +518,24 @@ class Order(models.Model):
     is_cancelled = models.BooleanField(default=False)
     is_returned = models.BooleanField(default=False)
     discount_breakdown = models.JSONField(default=dict)
+    # Set when the order first becomes completed; recommendation updates
+    # read the orders completed since their previous run
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    coupon = models.ForeignKey(
+        Coupon,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='orders'
+    )
     
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['status', 'order_date']),
+            # Admin changelist order (-order_date, -id)
+            models.Index(fields=['order_date', 'id']),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
@@ -184,6 +549,9 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         """Override save to ensure proper amounts are set"""
         
+        if self.status == 'completed' and self.completed_at is None:
+            self.completed_at = timezone.now()
+        
         if not self.pk:
             # New order - calculate subtotal from items
             super().save(*args, **kwargs)
@@ -191,11 +559,12 @@ class Order(models.Model):
         
         # Calculate final amount
         self.final_amount = self.subtotal - self.total_discount
-        super().save(*args, **kwargs)
-        
-        # Update user's loyalty points if order is completed
-        if self.status == 'completed' and not self.is_cancelled and not self.is_returned:
-            self.user.update_loyalty_points()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Loyalty points and eligibility are refreshed by the outbox worker
+            if self.status in self.SETTLED_STATUSES or self.is_cancelled or self.is_returned:
+                OutboxEvent.enqueue('order.settled', user_id=self.user_id)
 
 class OrderItem(models.Model):
     """Items within an order"""
@@ -240,4 +609,136 @@ class OrderItem(models.Model):
         if self.order_id:
             self.order.subtotal = self.order.items.aggregate(
                 total=Sum(F('quantity') * F('unit_price')))['total'] or 0
-            self.order.save()
\ No newline at end of file
+            self.order.save()
+
+
+class ArchivedOrder(models.Model):
+    """Completed or cancelled order moved out of the live Order table.
+
+    Rows keep the id of the original order so that existing links keep
+    working. Relations are not enforced at the database level because the
+    archive may live on a separate database alias.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='archived_orders'
+    )
+    order_date = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_discount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    final_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    is_cancelled = models.BooleanField(default=False)
+    is_returned = models.BooleanField(default=False)
+    discount_breakdown = models.JSONField(default=dict)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    coupon = models.ForeignKey(
+        Coupon,
+        null=True,
+        blank=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+'
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-order_date']
+    
+    def __str__(self):
+        return f"Archived order #{self.id}"
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    Items within an archived order, with the product and category as they
+    were when archived (they may be deleted since)
+    """
+    
+    order = models.ForeignKey(
+        ArchivedOrder,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+'
+    )
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(
+        ProductCategory,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+'
+    )
+    item_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    product_name = models.CharField(max_length=200, default='')
+    product_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    category_name = models.CharField(max_length=100, default='')
+    
+    def __str__(self):
+        return f" {self.quantity} x product #{self.product_id}--(Archived order #{self.order_id}) "
+
+
+
+class ProductRecommendations(models.Model):
+    """
+    Top co-purchased products of a product, written by
+    `manage.py update_recommendations`.
+    
+    ``items`` is a list of ``[product id, score, co-purchases]`` by
+    descending score.
+    """
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='recommendations'
+    )
+    items = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "product recommendations"
+    
+    def __str__(self):
+        return f"Recommendations for product #{self.product_id}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Side effect recorded in the same transaction as the change causing it.
+    
+    Events are drained by `manage.py run_outbox_worker`; delivery is
+    at-least-once so handlers must be idempotent.
+    """
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['available_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='outbox_pending_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.topic} #{self.id}"
+    
+    @classmethod
+    def enqueue(cls, topic, **payload):
+        """Record an event, call inside the transaction making the change"""
+        return cls.objects.create(topic=topic, payload=payload)
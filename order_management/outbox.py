@@ -0,0 +1,135 @@
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CustomUser, OutboxEvent
+from .catalogue import rebuild_catalogue_snapshot
+from .coupons import add_to_coupon_filter, sync_coupon_filter
+from .rules import invalidate_rule_snapshot
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# Topics whose events rebuild the catalogue file, once per batch after it commits
+REBUILDS_CATALOGUE = {'discount_rules.changed', 'catalogue.changed'}
+
+
+def handler(topic):
+    """Register an idempotent handler for an outbox topic"""
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+@handler('order.settled')
+def refresh_order_summary(user_id):
+    """Recompute loyalty points and drop the cached eligibility"""
+    try:
+        user = CustomUser.objects.get(pk=user_id)
+    except CustomUser.DoesNotExist:
+        return
+    user.update_loyalty_points()
+    cache.delete(CustomUser.eligibility_cache_key(user_id))
+
+
+@handler('discount_rules.changed')
+def invalidate_discount_rules():
+    invalidate_rule_snapshot()
+
+
+@handler('catalogue.changed')
+def refresh_catalogue():
+    """Nothing to do inside the batch, see ``REBUILDS_CATALOGUE``"""
+
+
+@handler('coupons.created')
+def add_new_coupons():
+    sync_coupon_filter()
+
+
+@handler('coupons.renamed')
+def add_renamed_coupons(codes):
+    add_to_coupon_filter(codes)
+
+
+def _retry_later(event, exc, now):
+    event.attempts += 1
+    event.available_at = now + timedelta(seconds=min(2 ** event.attempts, 300))
+    event.last_error = repr(exc)
+
+
+def process_batch(batch_size=None):
+    """
+    Claim and handle one batch of due events, returns how many were claimed.
+    
+    Identical events in a batch (same topic and payload) run their handler
+    once. A failing event is retried with exponential backoff until
+    ``OUTBOX_MAX_ATTEMPTS`` is reached. The catalogue file is rebuilt after
+    the batch commits, so the claimed rows are not locked while it is written.
+    """
+    if batch_size is None:
+        batch_size = settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.filter(
+                processed_at__isnull=True,
+                available_at__lte=now,
+                attempts__lt=settings.OUTBOX_MAX_ATTEMPTS
+            ).order_by('id').select_for_update(skip_locked=True)[:batch_size]
+        )
+        
+        groups = {}
+        for event in events:
+            key = (event.topic, json.dumps(event.payload, sort_keys=True))
+            groups.setdefault(key, []).append(event)
+        
+        done = []
+        failed = []
+        for (topic, _payload), group in groups.items():
+            try:
+                func = HANDLERS[topic]
+                with transaction.atomic():
+                    func(**group[0].payload)
+            except Exception as exc:
+                logger.exception("Outbox handler for %s failed", topic)
+                for event in group:
+                    _retry_later(event, exc, now)
+                failed.extend(group)
+            else:
+                done.extend(group)
+        
+        OutboxEvent.objects.filter(id__in=[event.id for event in done]).update(processed_at=now)
+        OutboxEvent.objects.bulk_update(failed, ['attempts', 'available_at', 'last_error'])
+    
+    rebuilds = [event for event in done if event.topic in REBUILDS_CATALOGUE]
+    if rebuilds:
+        try:
+            rebuild_catalogue_snapshot()
+        except Exception as exc:
+            logger.exception("Rebuilding the catalogue snapshot failed")
+            for event in rebuilds:
+                event.processed_at = None
+                _retry_later(event, exc, now)
+            OutboxEvent.objects.bulk_update(
+                rebuilds, ['processed_at', 'attempts', 'available_at', 'last_error']
+            )
+    
+    return len(events)
+
+
+def purge_processed(days=None):
+    """Delete events processed more than ``days`` ago"""
+    if days is None:
+        days = settings.OUTBOX_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxEvent.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,185 @@
+"""
+Product recommendations from order co-purchases.
+
+``update_recommendations()`` (run by `manage.py update_recommendations`)
+counts completed orders into the co-purchase matrix (see copurchase.py,
+which needs NumPy and SciPy) and stores the top neighbours of every product
+in ProductRecommendations. The API serves them from the cache: one cache
+read per request, the table and products are only read on a miss.
+"""
+import itertools
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrderItem, OrderItem, Product, ProductRecommendations
+from .serializers import ProductValuesSerializer
+
+# Order lines read per step while building the matrix
+LINES_PER_STEP = 1_000_000
+WRITE_BATCH_SIZE = 1000
+
+
+def recommendations_cache_key(product_id):
+    return f'product_recommendations_{product_id}'
+
+
+def _load_recommendations(product_id):
+    """API payload for ``product_id``, None if it is not an active product"""
+    if not Product.objects.filter(pk=product_id, is_active=True).exists():
+        return None
+    items = (
+        ProductRecommendations.objects.filter(pk=product_id)
+        .values_list('items', flat=True).first()
+    ) or []
+    stats = {neighbour_id: (score, count) for neighbour_id, score, count in items}
+    products = ProductValuesSerializer.to_representation(
+        ProductValuesSerializer.values(Product.objects.filter(pk__in=stats, is_active=True))
+    )
+    for product in products:
+        product['score'], product['co_purchases'] = stats[product['id']]
+    products.sort(key=lambda product: (-product['score'], product['id']))
+    return products
+
+
+def get_recommendations(product_id):
+    """
+    Recommended products for ``product_id`` (product dicts with ``score`` and
+    ``co_purchases``), or None when it is not an active product
+    """
+    key = recommendations_cache_key(product_id)
+    payload = cache.get(key)
+    if payload is None:
+        payload = _load_recommendations(product_id)
+        # Not cached when missing: the product may be created or activated
+        if payload is not None:
+            cache.set(key, payload, timeout=settings.RECOMMENDATIONS_CACHE_TIMEOUT)
+    return payload
+
+
+def _order_lines(queryset, completed_field='order__completed_at'):
+    """
+    Yield ``(order ids, product ids, {order id: completed_at})`` steps of
+    about LINES_PER_STEP lines from ``queryset``, never splitting an order
+    """
+    fields = ['order_id', 'product_id'] + ([completed_field] if completed_field else [])
+    rows = queryset.order_by('order_id').values_list(*fields)
+
+    order_ids, product_ids, completed = [], [], {}
+    for order_id, product_id, *completed_at in rows.iterator(chunk_size=10000):
+        if len(order_ids) >= LINES_PER_STEP and order_id != order_ids[-1]:
+            yield order_ids, product_ids, completed
+            order_ids, product_ids, completed = [], [], {}
+        order_ids.append(order_id)
+        product_ids.append(product_id)
+        if completed_at and completed_at[0] is not None:
+            completed[order_id] = completed_at[0].timestamp()
+    if order_ids:
+        yield order_ids, product_ids, completed
+
+
+def completed_order_lines(since=None):
+    """Lines of completed (not returned) orders, completed at or after ``since``"""
+    lines = OrderItem.objects.filter(
+        order__status='completed', order__is_cancelled=False, order__is_returned=False
+    )
+    if since is not None:
+        return lines.filter(order__completed_at__gte=since)
+    return lines
+
+
+def _write(matrix, product_ids, full):
+    """Store the top neighbours of ``product_ids`` and drop their cached payloads"""
+    existing = set()
+    product_ids = [int(pk) for pk in product_ids]
+    for start in range(0, len(product_ids), WRITE_BATCH_SIZE):
+        existing.update(Product.objects.filter(
+            pk__in=product_ids[start:start + WRITE_BATCH_SIZE]
+        ).values_list('pk', flat=True))
+    product_ids = [pk for pk in product_ids if pk in existing]
+    neighbours = matrix.neighbours(
+        product_ids, settings.RECOMMENDATIONS_TOP_K, settings.RECOMMENDATIONS_MIN_CO_PURCHASES
+    )
+
+    invalidated = list(product_ids)
+    with transaction.atomic():
+        if full:
+            # Products without co-purchases any more lose their row
+            invalidated += ProductRecommendations.objects.values_list('pk', flat=True)
+            ProductRecommendations.objects.all().delete()
+        for start in range(0, len(product_ids), WRITE_BATCH_SIZE):
+            batch = product_ids[start:start + WRITE_BATCH_SIZE]
+            ProductRecommendations.objects.bulk_create(
+                [ProductRecommendations(product_id=pk, items=neighbours[pk]) for pk in batch],
+                update_conflicts=True, unique_fields=['product'],
+                update_fields=['items', 'updated_at']
+            )
+    for start in range(0, len(invalidated), WRITE_BATCH_SIZE):
+        cache.delete_many([
+            recommendations_cache_key(pk) for pk in invalidated[start:start + WRITE_BATCH_SIZE]
+        ])
+    return len(product_ids)
+
+
+def update_recommendations(full=False):
+    """
+    Count the orders completed since the previous run (every completed
+    order, archived ones included, when ``full`` or without a saved matrix)
+    and refresh the recommendations of the products in them. Returns a
+    summary dict.
+    """
+    from .copurchase import LOOKBACK, CoPurchaseMatrix
+
+    started = time.perf_counter()
+    path = settings.RECOMMENDATIONS_STATE_PATH
+    matrix = None if full or not path else CoPurchaseMatrix.load(path)
+    full = matrix is None
+    now = timezone.now()
+
+    if full:
+        matrix = CoPurchaseMatrix()
+        steps = [
+            _order_lines(completed_order_lines()),
+            # Archived orders have no completed_at, they are long completed
+            _order_lines(ArchivedOrderItem.objects.filter(
+                order__status='completed', order__is_cancelled=False, order__is_returned=False
+            ), completed_field=None),
+        ]
+    else:
+        steps = [_order_lines(completed_order_lines(since=matrix.watermark - LOOKBACK))]
+
+    lines = orders = 0
+    changed = set()
+    recent = {}
+    for order_ids, product_ids, completed in itertools.chain.from_iterable(steps):
+        recent.update(completed)
+        if not full:
+            # Orders counted by the previous run, inside the lookback
+            counted = matrix.recent
+            kept = [index for index, order_id in enumerate(order_ids) if order_id not in counted]
+            order_ids = [order_ids[index] for index in kept]
+            product_ids = [product_ids[index] for index in kept]
+        changed.update(matrix.add_lines(order_ids, product_ids).tolist())
+        lines += len(order_ids)
+        orders += len(set(order_ids))
+
+    # Orders still inside the next run's lookback must not be counted twice
+    horizon = (now - LOOKBACK).timestamp()
+    matrix.recent = {
+        order_id: at for order_id, at in {**matrix.recent, **recent}.items() if at >= horizon
+    }
+    matrix.watermark = now
+    if path:
+        matrix.save(path)
+
+    products = _write(matrix, sorted(changed), full)
+    return {
+        'full': full,
+        'orders': orders,
+        'lines': lines,
+        'products': products,
+        'seconds': time.perf_counter() - started,
+    }
@@ -0,0 +1,56 @@
+import datetime
+import decimal
+
+import orjson
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+def _default(obj):
+    """Types orjson does not handle natively, encoded like DRF's JSONEncoder"""
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, decimal.Decimal):
+        # Serializer fields already coerce decimals to strings
+        return float(obj)
+    if isinstance(obj, QuerySet):
+        return tuple(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__getitem__'):
+        try:
+            return dict(obj)
+        except Exception:
+            pass
+    elif hasattr(obj, '__iter__'):
+        return tuple(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON renderer backed by orjson.
+
+    Encodes the same values as DRF's JSONRenderer, except that NaN and
+    infinite floats are rendered as ``null`` instead of raising, and large
+    or small floats drop the exponent sign (``1e16``, not ``1e+16``).
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        
+        options = self.options
+        # Browsable API and clients asking for `; indent=N`
+        if accepted_media_type and 'indent=' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
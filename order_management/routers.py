@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+class OrderArchiveRouter:
+    """Send the order archive tables to ``ORDER_ARCHIVE_DATABASE``"""
+    
+    archive_models = {'archivedorder', 'archivedorderitem'}
+    
+    def _is_archive(self, model):
+        return (
+            model._meta.app_label == 'order_management'
+            and model._meta.model_name in self.archive_models
+        )
+    
+    def db_for_read(self, model, **hints):
+        if self._is_archive(model):
+            return settings.ORDER_ARCHIVE_DATABASE
+        
+        # Users and products referenced by archived rows stay in the main db
+        instance = hints.get('instance')
+        if instance is not None and self._is_archive(type(instance)):
+            return DEFAULT_DB_ALIAS
+        return None
+    
+    db_for_write = db_for_read
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        if self._is_archive(type(obj1)) or self._is_archive(type(obj2)):
+            return True
+        return None
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        archive_db = settings.ORDER_ARCHIVE_DATABASE
+        if app_label == 'order_management' and model_name in self.archive_models:
+            return db == archive_db
+        if db == archive_db and archive_db != DEFAULT_DB_ALIAS:
+            return False
+        return None
@@ -0,0 +1,226 @@
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DiscountRule, OutboxEvent, ProductCategory
+
+RULE_SNAPSHOT_CACHE_KEY = 'active_discount_rules_v3'
+# built_at of the cached snapshot, checked before reusing this process's copy
+RULE_SNAPSHOT_STAMP_KEY = f'{RULE_SNAPSHOT_CACHE_KEY}:built_at'
+# When the rules were last edited; a catalogue file built before it is stale
+RULE_SNAPSHOT_CHANGED_KEY = f'{RULE_SNAPSHOT_CACHE_KEY}:changed_at'
+
+# Snapshot last read from the cache, with its compiled rule sets
+_local_snapshot = None
+
+
+def is_live(rule, when):
+    """Whether the rule's window contains ``when`` (None means the distant past)"""
+    if rule.starts_at is not None and (when is None or when < rule.starts_at):
+        return False
+    return rule.ends_at is None or when is None or when < rule.ends_at
+
+
+def category_default_rule(category):
+    """A category's ``discount_percentage`` as an (unsaved) category rule"""
+    return DiscountRule(
+        name=f"{category.name} default discount", discount_type='category',
+        value=category.discount_percentage, category=category
+    )
+
+
+class CompiledRuleSet:
+    """
+    Rules indexed by what an order needs to match them, so pricing only
+    evaluates rules that can apply: percentage rules by minimum amount,
+    category rules by category. Category rules whose category was deleted
+    can never match and are left out.
+    
+    A category rule covers its category's subcategories too. ``ancestors``
+    maps a category to the frozenset of its ancestors and itself (missing
+    for top-level categories), so the rules of an item's category are found
+    with one set intersection whatever the depth of the tree.
+    """
+    
+    def __init__(self, rules, ancestors=None, category_defaults=()):
+        self.rules = tuple(rules) + tuple(category_defaults)
+        self.ancestors = ancestors or {}
+        self.percentage = sorted(
+            (rule for rule in self.rules if rule.discount_type == 'percentage'),
+            key=lambda rule: rule.min_order_amount or Decimal('0')
+        )
+        self.thresholds = [rule.min_order_amount or Decimal('0') for rule in self.percentage]
+        self.flat = [rule for rule in self.rules if rule.discount_type == 'flat']
+        self.by_category = {}
+        for rule in self.rules:
+            if rule.discount_type == 'category' and rule.category_id is not None:
+                self.by_category.setdefault(rule.category_id, []).append(rule)
+        self.rule_categories = frozenset(self.by_category)
+        self._covering = {}
+    
+    def __iter__(self):
+        return iter(self.rules)
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    def ancestors_of(self, category_id):
+        return self.ancestors.get(category_id) or frozenset((category_id,))
+    
+    def covering_categories(self, category_id):
+        """Categories with rules covering ``category_id``, computed once per category"""
+        covering = self._covering.get(category_id)
+        if covering is None:
+            covering = self._covering[category_id] = self.ancestors_of(category_id) & self.rule_categories
+        return covering
+    
+    def items_by_category(self, items):
+        """``{category id: items in it or in one of its subcategories}``"""
+        covered = {}
+        for item in items:
+            for category_id in self.covering_categories(item.category_id):
+                covered.setdefault(category_id, []).append(item)
+        return covered
+    
+    def candidates_for(self, subtotal, category_ids):
+        """
+        Rules that can match an order of ``subtotal`` covering these
+        categories (see items_by_category)
+        """
+        rules = self.percentage[:bisect_right(self.thresholds, subtotal)] + self.flat
+        for category_id in self.rule_categories.intersection(category_ids):
+            rules += self.by_category[category_id]
+        return rules
+
+
+class RuleSnapshot:
+    """
+    Active discount rules with their precomputed activation timeline.
+    
+    Every ``starts_at``/``ends_at`` is a boundary and the rule set between
+    two boundaries is computed once when the snapshot is built. Switching
+    rule sets at a boundary is a bisect, with no DB query or cache flush;
+    the rule set returned for an instant stays valid until the next one.
+    
+    The category tree (``ancestors``, see CompiledRuleSet) and the
+    categories with a default discount are part of the snapshot.
+    """
+    
+    def __init__(self, rules, built_at=None, ancestors=None, default_categories=()):
+        self.built_at = built_at or timezone.now()
+        self.rules = list(rules)
+        self.ancestors = ancestors or {}
+        self.default_categories = list(default_categories)
+        self.category_defaults = [
+            category_default_rule(category) for category in self.default_categories
+        ]
+        self.boundaries = sorted({
+            moment
+            for rule in self.rules
+            for moment in (rule.starts_at, rule.ends_at)
+            if moment is not None
+        })
+        # segments[i] is live from boundaries[i - 1] until boundaries[i]
+        self.segments = [
+            tuple(rule for rule in self.rules if is_live(rule, start))
+            for start in [None] + self.boundaries
+        ]
+        self._compiled = {}
+    
+    @classmethod
+    def build(cls, now=None):
+        """Load active rules whose window has not ended yet and the category tree"""
+        now = now or timezone.now()
+        rules = (
+            # Coupon rules only apply to orders redeeming a coupon
+            DiscountRule.objects.filter(is_active=True, requires_coupon=False)
+            .filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now))
+            .select_related('category')
+            .order_by('-priority', 'created_at')
+        )
+        default_categories = ProductCategory.objects.filter(
+            discount_percentage__gt=0
+        ).only('name', 'discount_percentage').order_by('pk')
+        return cls(
+            rules, built_at=now,
+            ancestors=ProductCategory.ancestor_map(),
+            default_categories=default_categories
+        )
+    
+    def rules_at(self, when):
+        """Rules live at ``when``, in priority order"""
+        return self.segments[bisect_right(self.boundaries, when)]
+    
+    def compiled_at(self, when):
+        """Rules live at ``when`` as a CompiledRuleSet, built once per segment"""
+        index = bisect_right(self.boundaries, when)
+        compiled = self._compiled.get(index)
+        if compiled is None:
+            compiled = self._compiled[index] = CompiledRuleSet(
+                self.segments[index], self.ancestors, self.category_defaults
+            )
+        return compiled
+    
+    def next_boundary(self, when):
+        """When the rule set returned by rules_at(when) changes, or None"""
+        index = bisect_right(self.boundaries, when)
+        return self.boundaries[index] if index < len(self.boundaries) else None
+
+
+def get_rule_snapshot():
+    """
+    Rule snapshot from the shared catalogue file when one is configured,
+    otherwise cached and rebuilt after RULE_SNAPSHOT_TIMEOUT or an edit.
+    A catalogue file built before the last rule edit is skipped until the
+    outbox worker rebuilds it.
+    
+    A process keeps the snapshot it read last for as long as the cached one
+    has the same ``built_at``, so the category tree is not unpickled and the
+    rule sets not recompiled on every request.
+    """
+    global _local_snapshot
+    from .catalogue import get_catalogue
+    
+    catalogue = get_catalogue()
+    if catalogue is not None:
+        changed_at = cache.get(RULE_SNAPSHOT_CHANGED_KEY)
+        if changed_at is None or changed_at <= catalogue.built_at:
+            return catalogue.rules
+    
+    local = _local_snapshot
+    if local is not None and cache.get(RULE_SNAPSHOT_STAMP_KEY) == local.built_at:
+        return local
+    
+    snapshot = cache.get(RULE_SNAPSHOT_CACHE_KEY)
+    
+    if snapshot is None:
+        snapshot = RuleSnapshot.build()
+        # The full timeout even across a starts_at/ends_at: rules_at() switches
+        # rule sets inside the snapshot, so a boundary needs no rebuild
+        cache.set_many({
+            RULE_SNAPSHOT_CACHE_KEY: snapshot,
+            RULE_SNAPSHOT_STAMP_KEY: snapshot.built_at,
+        }, timeout=settings.RULE_SNAPSHOT_TIMEOUT)
+    
+    _local_snapshot = snapshot
+    return snapshot
+
+
+def invalidate_rule_snapshot():
+    cache.set(RULE_SNAPSHOT_CHANGED_KEY, timezone.now(), timeout=None)
+    cache.delete_many([RULE_SNAPSHOT_CACHE_KEY, RULE_SNAPSHOT_STAMP_KEY])
+
+
+def rules_changed():
+    """
+    Call after editing discount rules or categories: drops the cached
+    snapshot once the edit commits and queues the outbox event that
+    rebuilds the catalogue file.
+    """
+    transaction.on_commit(invalidate_rule_snapshot)
+    OutboxEvent.enqueue('discount_rules.changed')
@@ -0,0 +1,102 @@
+"""
+Ranked full-text product search.
+
+SQLite uses an FTS5 external-content table kept in sync with the product
+table by triggers, so every save, bulk_create and delete updates the index
+incrementally; ``ProductSearchEntry`` maps it for the ORM. PostgreSQL uses a
+GIN index over a weighted tsvector of the name and description. Other
+backends fall back to an unranked ``icontains`` scan.
+
+Neither index stems words: a stemmed index stores "running" as "run", which
+the prefix "runn" a user is still typing would never match.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+
+# Must match the GIN index created by migration 0014
+SEARCH_CONFIG = 'simple'
+
+# Matches in the name weigh more than matches in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def search_terms(query):
+    """Words of a search query, lowercased and without FTS syntax"""
+    return re.findall(r'\w+', query.lower())
+
+
+def fts5_query(terms):
+    """
+    FTS5 MATCH expression requiring every term. Terms are quoted so user
+    input can never be parsed as query syntax; the last one is a prefix
+    so results show up while the user is still typing.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+class Match(Func):
+    """``document MATCH query`` on an FTS5 table, usable as a filter"""
+    arg_joiner = ' MATCH '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+def search_products(queryset, query):
+    """
+    Filter a product queryset down to matches for ``query``, best matches
+    first. Other filters (category, price) combine as usual.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        document = F('search_entry__document')
+        # bm25() is lower for better matches
+        return (
+            queryset.filter(
+                Match(document, Value(fts5_query(terms))),
+                # Makes the join an inner one, MATCH fails on an outer join
+                search_entry__isnull=False
+            )
+            .annotate(search_rank=Func(
+                document, Value(NAME_WEIGHT), Value(DESCRIPTION_WEIGHT),
+                function='bm25', output_field=FloatField()
+            ))
+            .order_by('search_rank', 'id')
+        )
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        # Same semantics as fts5_query(): all terms, the last one a prefix
+        search_query = SearchQuery(
+            ' & '.join(terms[:-1] + [f'{terms[-1]}:*']),
+            search_type='raw', config=SEARCH_CONFIG
+        )
+        return (
+            queryset.alias(search_document=search_vector())
+            .filter(search_document=search_query)
+            .annotate(search_rank=SearchRank(search_vector(), search_query))
+            .order_by('-search_rank', 'id')
+        )
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).order_by('name', 'id')
@@ -1,5 +1,12 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Product, Order, OrderItem, DiscountRule
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .models import (
+    Product, Order, OrderItem, DiscountRule,
+    ArchivedOrder, ArchivedOrderItem
+)
+from .catalogue import get_catalogue
+from .coupons import INVALID_CODE, coupon_error, load_coupons, might_exist, normalize_code
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -43,10 +50,83 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
 
+class ArchivedProductSerializer(serializers.Serializer):
+    """ Product of an archived item as it was when archived """
+    
+    id = serializers.IntegerField(source='product_id')
+    name = serializers.CharField(source='product_name')
+    price = serializers.DecimalField(
+        source='product_price', max_digits=10, decimal_places=2, allow_null=True
+    )
+
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    """ Serializer for ArchivedOrderItem model, without reading products or categories """
+    
+    product = ArchivedProductSerializer(source='*')
+    category = serializers.CharField(source='category_name')
+    
+    class Meta:
+        model = ArchivedOrderItem
+        fields = OrderItemSerializer.Meta.fields
+
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """ Serializer for ArchivedOrder model, same shape as OrderSerializer"""
+    
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
+
+class CatalogueProductField(serializers.PrimaryKeyRelatedField):
+    """
+    Active product by id, read from the shared catalogue snapshot when one
+    is configured (no query) and from the database otherwise, or when the
+    product was added after the snapshot was built
+    """
+    
+    def to_internal_value(self, data):
+        catalogue = get_catalogue()
+        if catalogue is None:
+            return super().to_internal_value(data)
+        
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            product = catalogue.product(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if product is None:
+            return super().to_internal_value(data)
+        if not product.is_active:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+
+class CouponCodeField(serializers.CharField):
+    """
+    Normalized coupon code; codes missing from the coupon filter are
+    rejected here without a query
+    """
+    
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_length', 32)
+        kwargs.setdefault('required', False)
+        super().__init__(**kwargs)
+    
+    def to_internal_value(self, data):
+        code = normalize_code(super().to_internal_value(data))
+        if not might_exist(code):
+            raise serializers.ValidationError(INVALID_CODE)
+        return code
+
+
 class OrderItemCreateSerializer(serializers.Serializer):
     """ Serializer for creating order items """
     
-    product_id = serializers.PrimaryKeyRelatedField(
+    product_id = CatalogueProductField(
         queryset=Product.objects.filter(is_active=True)
     )
     quantity = serializers.IntegerField(min_value=1)
@@ -56,6 +136,15 @@ class OrderCreateSerializer(serializers.Serializer):
     """ Serializer for creating orders"""
     
     items = OrderItemCreateSerializer(many=True, min_length=1)
+    coupon_code = CouponCodeField()
+    
+    def validate_coupon_code(self, code):
+        """The Coupon of ``code``, if it can still be redeemed"""
+        coupon = load_coupons([code]).get(code)
+        error = coupon_error(coupon)
+        if error:
+            raise serializers.ValidationError(error)
+        return coupon
     
     def validate(self, data):
         """Validate order data"""
@@ -69,6 +158,186 @@ class OrderCreateSerializer(serializers.Serializer):
         return data
 
 
+class BulkOrderItemSerializer(serializers.Serializer):
+    """ Item of a bulk order; products are looked up once for the whole batch """
+    
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BulkOrderSerializer(serializers.Serializer):
+    """ One order of a bulk submission """
+    
+    reference = serializers.CharField(max_length=100, required=False)
+    items = BulkOrderItemSerializer(many=True, min_length=1)
+    coupon_code = CouponCodeField()
+    
+    def validate_items(self, items):
+        product_ids = [item['product_id'] for item in items]
+        if len(set(product_ids)) != len(product_ids):
+            raise serializers.ValidationError("Each product may only appear once per order")
+        return items
+
+
+class QueuedOrderSerializer(BulkOrderSerializer):
+    """ Order for the group-commit checkout; products are looked up by the writer """
+    
+    reference = None
+
+
+class BulkOrderCreateSerializer(serializers.Serializer):
+    """ Envelope of a bulk submission; each order is validated on its own """
+    
+    orders = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+    
+    def validate_orders(self, orders):
+        limit = settings.BULK_ORDER_MAX_BATCH
+        if len(orders) > limit:
+            raise serializers.ValidationError(f"At most {limit} orders per request")
+        return orders
+
+
+_datetime_field = serializers.DateTimeField()
+
+
+def _decimal(value):
+    """Same string as serializers.DecimalField for already-quantized values"""
+    return None if value is None else '{:f}'.format(value)
+
+
+class ProductValuesSerializer:
+    """
+    Fast path for ProductSerializer on list endpoints.
+    
+    Reads rows with values_list() and builds the same dicts directly,
+    skipping per-field serializer overhead.
+    """
+    columns = (
+        'id', 'name', 'description', 'price',
+        'category__name', 'stock_quantity', 'is_active'
+    )
+    
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values_list(*cls.columns)
+    
+    @staticmethod
+    def to_representation(rows):
+        return [
+            {
+                'id': pk,
+                'name': name,
+                'description': description,
+                'price': _decimal(price),
+                'category': category,
+                'stock_quantity': stock_quantity,
+                'is_active': is_active,
+            }
+            for pk, name, description, price, category, stock_quantity, is_active in rows
+        ]
+
+
+class OrderValuesSerializer:
+    """
+    Fast path for OrderSerializer on list endpoints.
+    
+    One query for the page of orders and one for all of their items.
+    """
+    columns = (
+        'id', 'user__username', 'order_date', 'status',
+        'subtotal', 'total_discount', 'final_amount',
+        'is_cancelled', 'is_returned', 'discount_breakdown'
+    )
+    item_columns = (
+        'order_id', 'id', 'quantity', 'unit_price', 'category__name', 'item_discount',
+        'product_id', 'product__name', 'product__description', 'product__price',
+        'product__category__name', 'product__stock_quantity', 'product__is_active'
+    )
+    
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values_list(*cls.columns)
+    
+    @classmethod
+    def to_representation(cls, rows):
+        orders = []
+        items_by_order = {}
+        for (pk, user, order_date, status, subtotal, total_discount, final_amount,
+                is_cancelled, is_returned, discount_breakdown) in rows:
+            items = items_by_order[pk] = []
+            orders.append({
+                'id': pk,
+                'user': user,
+                'order_date': _datetime_field.to_representation(order_date),
+                'status': status,
+                'subtotal': _decimal(subtotal),
+                'total_discount': _decimal(total_discount),
+                'final_amount': _decimal(final_amount),
+                'is_cancelled': is_cancelled,
+                'is_returned': is_returned,
+                'discount_breakdown': discount_breakdown,
+                'items': items,
+            })
+        
+        if not items_by_order:
+            return orders
+        
+        item_rows = OrderItem.objects.filter(
+            order_id__in=items_by_order
+        ).order_by('id').values_list(*cls.item_columns)
+        for (order_id, pk, quantity, unit_price, category, item_discount,
+                product_id, name, description, price, product_category,
+                stock_quantity, is_active) in item_rows:
+            items_by_order[order_id].append({
+                'id': pk,
+                'product': {
+                    'id': product_id,
+                    'name': name,
+                    'description': description,
+                    'price': _decimal(price),
+                    'category': product_category,
+                    'stock_quantity': stock_quantity,
+                    'is_active': is_active,
+                },
+                'quantity': quantity,
+                'unit_price': _decimal(unit_price),
+                'category': category,
+                'item_discount': _decimal(item_discount),
+            })
+        return orders
+
+
+_money_field = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class BulkOrderResultSerializer:
+    """
+    Compact per-order results of a bulk submission, built from the orders
+    in memory (no query)
+    """
+    
+    @staticmethod
+    def to_representation(results):
+        representation = []
+        for result in results:
+            order = result.order
+            entry = {'index': result.index, 'reference': result.reference}
+            if order is None:
+                entry.update(status='rejected', errors=result.errors)
+            else:
+                entry.update(
+                    status='created',
+                    id=order.id,
+                    order_date=_datetime_field.to_representation(order.order_date),
+                    subtotal=_money_field.to_representation(order.subtotal),
+                    total_discount=_money_field.to_representation(order.total_discount),
+                    final_amount=_money_field.to_representation(order.final_amount),
+                    discount_breakdown=order.discount_breakdown,
+                )
+            representation.append(entry)
+        return representation
+
+
 class DiscountRuleSerializer(serializers.ModelSerializer):
     """ Serializer for DiscountRule model """
     category = serializers.StringRelatedField()
@@ -78,5 +347,26 @@ class DiscountRuleSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'discount_type', 'value',
             'min_order_amount', 'min_quantity', 'category',
-            'min_completed_orders', 'is_active', 'priority'
-        ]
\ No newline at end of file
+            'min_completed_orders', 'is_active', 'priority',
+            'exclusivity_group', 'is_combinable', 'starts_at', 'ends_at'
+        ]
+    
+    def validate(self, data):
+        """Rule windows must end after they start"""
+        starts_at = data.get('starts_at', getattr(self.instance, 'starts_at', None))
+        ends_at = data.get('ends_at', getattr(self.instance, 'ends_at', None))
+        if starts_at and ends_at and ends_at <= starts_at:
+            raise serializers.ValidationError({'ends_at': "End must be after the start"})
+        return data
+
+
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """ Adds token version and basic user claims to issued tokens """
+    
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['token_version'] = user.token_version
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        return token
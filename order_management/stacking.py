@@ -0,0 +1,191 @@
+"""
+Discount stacking: pick the combination of applicable rules granting the
+largest total discount.
+
+Rules sharing an exclusivity group never stack, and a rule that is not
+combinable only applies on its own. Without an explicit group a rule falls
+in the default group of its type, so at most one percentage and one flat
+rule apply; a category rule falls in one group per category of the items it
+covers, so rules on a category and on its parent never discount the same
+item twice.
+"""
+from decimal import Decimal
+from itertools import combinations
+
+
+def rule_groups(rule, covered=None):
+    """
+    Exclusivity groups of a rule as a frozenset; ``covered`` are the item
+    categories a category rule covers (its own category by default)
+    """
+    groups = frozenset(
+        group.strip() for group in (rule.exclusivity_group or '').split(',')
+        if group.strip()
+    )
+    if groups:
+        return groups
+    if rule.discount_type == 'category':
+        return frozenset(f'category:{category_id}' for category_id in covered or [rule.category_id])
+    return frozenset([rule.discount_type])
+
+
+class Candidate:
+    """An applicable rule and the discount it would grant"""
+    __slots__ = ('rule', 'amount', 'groups', 'combinable', 'item_discounts')
+
+    def __init__(self, rule, amount, item_discounts=None, covered=None):
+        self.rule = rule
+        self.amount = amount
+        self.groups = rule_groups(rule, covered)
+        self.combinable = rule.is_combinable
+        # [(item, amount)] for category rules
+        self.item_discounts = item_discounts or []
+
+    def __repr__(self):
+        return f"<Candidate {self.rule.name}: {self.amount}>"
+
+    @property
+    def sort_key(self):
+        # Larger discounts first, then the documented priority order
+        return (-self.amount, -self.rule.priority, self.rule.pk or 0)
+
+
+def split_by_category(candidate):
+    """
+    A category candidate covering items of several categories as one
+    candidate per category, so that a rule on a parent category can apply to
+    some items while a subcategory's rule applies to others. Rules with
+    explicit groups or that are not combinable stay whole.
+    """
+    rule = candidate.rule
+    if rule.discount_type != 'category' or rule.exclusivity_group or not candidate.combinable:
+        return [candidate]
+    parts = {}
+    for item, amount in candidate.item_discounts:
+        parts.setdefault(item.category_id, []).append((item, amount))
+    if len(parts) < 2:
+        return [candidate]
+    return [
+        Candidate(rule, sum(amount for _, amount in part), part, covered=[category_id])
+        for category_id, part in parts.items()
+    ]
+
+
+def _capped(total, cap):
+    return total if cap is None else min(total, cap)
+
+
+def prune_dominated(candidates):
+    """
+    Drop candidates that can never be needed in a best combination.
+
+    B dominates A when B grants at least as much and conflicts with no more
+    groups than A: swapping A for B never makes a combination worse. Only
+    the best non-combinable candidate can ever be chosen.
+    """
+    ordered = sorted((c for c in candidates if c.amount > 0), key=lambda c: c.sort_key)
+
+    kept = []
+    best_solo = None
+    for candidate in ordered:
+        if not candidate.combinable:
+            if best_solo is None:
+                best_solo = candidate
+            continue
+        if any(other.groups <= candidate.groups for other in kept):
+            continue
+        kept.append(candidate)
+    return kept, best_solo
+
+
+def solve(candidates, cap=None):
+    """
+    Best valid combination as ``(selected candidates, total discount)``.
+
+    Branch and bound over the non-dominated combinable candidates, ordered
+    by amount so the first complete branch is already a strong incumbent.
+    Groups are bit masks and amounts exact scaled integers. A branch is cut
+    when even the best remaining amount of every free group cannot beat the
+    incumbent (chosen rules use disjoint groups, so no more can be added).
+    ``cap`` limits the total (the order subtotal).
+    """
+    kept, best_solo = prune_dominated(candidates)
+
+    # Exact integer arithmetic: scale by the largest number of decimals
+    places = max(
+        [0] + [-c.amount.as_tuple().exponent for c in kept]
+        + ([-cap.as_tuple().exponent] if cap is not None else [])
+    )
+    scale = Decimal(10) ** places
+    amounts = [int(c.amount * scale) for c in kept]
+    limit = None if cap is None else int(cap * scale)
+
+    bits = {}
+    masks = []
+    for candidate in kept:
+        mask = 0
+        for group in candidate.groups:
+            mask |= 1 << bits.setdefault(group, len(bits))
+        masks.append(mask)
+
+    # Best amount per group bit among the candidates from each position on
+    count = len(kept)
+    group_best = [None] * count + [{}]
+    for index in range(count - 1, -1, -1):
+        row = dict(group_best[index + 1])
+        mask = masks[index]
+        while mask:
+            low = mask & -mask
+            if amounts[index] > row.get(low, 0):
+                row[low] = amounts[index]
+            mask ^= low
+        group_best[index] = row
+
+    best = [0, []]
+    chosen = []
+
+    def visit(index, used, total):
+        capped = total if limit is None else min(total, limit)
+        if capped > best[0]:
+            best[0], best[1] = capped, list(chosen)
+        if index == count or (limit is not None and best[0] >= limit):
+            return
+
+        bound = total
+        for low, amount in group_best[index].items():
+            if not low & used:
+                bound += amount
+        if (bound if limit is None else min(bound, limit)) <= best[0]:
+            return
+
+        mask = masks[index]
+        if not mask & used:
+            chosen.append(index)
+            visit(index + 1, used | mask, total + amounts[index])
+            chosen.pop()
+        visit(index + 1, used, total)
+
+    visit(0, 0, 0)
+
+    selected = [kept[index] for index in best[1]]
+    total = _capped(sum((c.amount for c in selected), Decimal('0')), cap)
+    if best_solo is not None and _capped(best_solo.amount, cap) > total:
+        return [best_solo], _capped(best_solo.amount, cap)
+    return selected, total
+
+
+def solve_exhaustive(candidates, cap=None):
+    """Reference solver trying every subset, for tests and benchmarks"""
+    candidates = sorted((c for c in candidates if c.amount > 0), key=lambda c: c.sort_key)
+    best, best_total = [], Decimal('0')
+    for size in range(1, len(candidates) + 1):
+        for subset in combinations(candidates, size):
+            if size > 1 and not all(c.combinable for c in subset):
+                continue
+            groups = [group for c in subset for group in c.groups]
+            if len(groups) != len(set(groups)):
+                continue
+            total = _capped(sum(c.amount for c in subset), cap)
+            if total > best_total:
+                best, best_total = list(subset), total
+    return best, best_total
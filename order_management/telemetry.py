@@ -0,0 +1,124 @@
+"""
+Per-rule evaluation telemetry.
+
+DiscountCalculator reports the rules it evaluated for an order, the ones
+that matched and the ones applied; evaluation time is measured on one order
+in ``RULE_STATS_TIMING_SAMPLE``. Counts are aggregated in memory per worker
+and added to DiscountRuleStats at most every ``RULE_STATS_FLUSH_INTERVAL``
+seconds, once a request has finished and before Django closes old database
+connections, so pricing never waits for the write. Counts not yet flushed
+when a worker exits are lost.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DiscountRule, DiscountRuleStats
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('evaluations', 'matches', 'applications', 'timed_evaluations', 'evaluation_ns')
+
+_lock = threading.Lock()
+# {counter: {rule id: count}}, plus the discount granted per rule
+_pending = {name: Counter() for name in COUNTERS}
+_discounts = defaultdict(Decimal)
+_flushed_at = time.monotonic()
+_orders = itertools.count(1)
+
+
+def enabled():
+    return settings.RULE_STATS_FLUSH_INTERVAL > 0
+
+
+def sample_timing():
+    """Whether to time the rule evaluations of the next order"""
+    return next(_orders) % settings.RULE_STATS_TIMING_SAMPLE == 0
+
+
+def record(evaluated, matched, applied, timings=()):
+    """
+    Count one priced order: ids of the rules ``evaluated`` and ``matched``,
+    ``applied`` as [(rule id, discount)] and sampled [(rule id, ns)]
+    """
+    with _lock:
+        # Counter.update() counts an iterable of ids in C
+        _pending['evaluations'].update(evaluated)
+        _pending['matches'].update(matched)
+        for rule_id, amount in applied:
+            _pending['applications'][rule_id] += 1
+            _discounts[rule_id] += amount
+        for rule_id, elapsed in timings:
+            _pending['timed_evaluations'][rule_id] += 1
+            _pending['evaluation_ns'][rule_id] += elapsed
+
+
+def reset():
+    """Take the counts not flushed yet as ``(counters, discounts)``"""
+    global _pending, _discounts, _flushed_at
+
+    with _lock:
+        pending, discounts = _pending, _discounts
+        _pending = {name: Counter() for name in COUNTERS}
+        _discounts = defaultdict(Decimal)
+        _flushed_at = time.monotonic()
+    return pending, discounts
+
+
+def flush():
+    """Add the pending counts to DiscountRuleStats, returns the rules updated"""
+    pending, discounts = reset()
+    counted = set(pending['evaluations']) | set(pending['applications'])
+    counted.discard(None)
+    if not counted:
+        return 0
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            # Rules deleted since they were counted are dropped
+            rule_ids = list(DiscountRule.objects.filter(pk__in=counted).values_list('pk', flat=True))
+            DiscountRuleStats.objects.bulk_create(
+                [DiscountRuleStats(rule_id=rule_id) for rule_id in rule_ids],
+                ignore_conflicts=True
+            )
+            for rule_id in rule_ids:
+                changes = {
+                    name: F(name) + pending[name][rule_id]
+                    for name in COUNTERS if pending[name][rule_id]
+                }
+                if rule_id in discounts:
+                    changes['discount_granted'] = F('discount_granted') + discounts[rule_id]
+                if pending['matches'][rule_id]:
+                    changes['last_matched_at'] = now
+                DiscountRuleStats.objects.filter(rule_id=rule_id).update(updated_at=now, **changes)
+    except DatabaseError:
+        logger.exception("Flushing discount rule stats failed, %d rules dropped", len(counted))
+        return 0
+    return len(rule_ids)
+
+
+def maybe_flush():
+    """Flush when RULE_STATS_FLUSH_INTERVAL has passed since the last flush"""
+    if enabled() and time.monotonic() - _flushed_at >= settings.RULE_STATS_FLUSH_INTERVAL:
+        flush()
+
+
+def flush_after_request(sender, **kwargs):
+    maybe_flush()
+
+
+# Ahead of Django's close_old_connections, so the flush uses the request's
+# connection before its age is checked instead of reopening one afterwards
+request_finished.disconnect(close_old_connections)
+request_finished.connect(flush_after_request)
+request_finished.connect(close_old_connections)
@@ -1,3 +1,1340 @@
-from django.test import TestCase
+import os
+import random
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import orjson
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.signals import request_finished
+from django.db import close_old_connections, connection
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError as APIValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from . import admission, checkout, coupons, groupcommit, outbox, telemetry
+from .archive import archive_cutoff, archive_orders
+from .authentication import CachedJWTAuthentication
+from .catalogue import build_catalogue_snapshot, get_catalogue, rebuild_catalogue_snapshot
+from .checkout import create_orders, load_products
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Coupon, CouponUsage, CustomUser, DiscountRule,
+    DiscountRuleStats, Order, OrderItem, OutboxEvent, Product, ProductCategory
+)
+from .recommendations import get_recommendations, update_recommendations
+from .renderers import ORJSONRenderer
+from .rules import (
+    RULE_SNAPSHOT_CACHE_KEY, RuleSnapshot, get_rule_snapshot, invalidate_rule_snapshot
+)
+from .serializers import (
+    CatalogueProductField, CouponCodeField, OrderSerializer, ProductSerializer,
+    VersionedTokenObtainPairSerializer
+)
+from .stacking import Candidate, solve, solve_exhaustive
+from .utils import DiscountCalculator, EstimatedCountPaginator
+
+START = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def make_rule(pk, starts_at=None, ends_at=None, priority=0):
+    """Unsaved rule for snapshot tests"""
+    return DiscountRule(
+        id=pk, name=f'rule {pk}', discount_type='percentage',
+        value=Decimal('5'), priority=priority,
+        starts_at=starts_at, ends_at=ends_at
+    )
+
+
+def live_rules(rules, when):
+    """Brute-force reference for RuleSnapshot.rules_at"""
+    return tuple(
+        rule for rule in rules
+        if (rule.starts_at is None or rule.starts_at <= when)
+        and (rule.ends_at is None or when < rule.ends_at)
+    )
+
+
+class RuleSnapshotTimelineTests(SimpleTestCase):
+    """Clock progression across overlapping rule windows"""
+
+    def test_matches_brute_force_across_overlapping_windows(self):
+        rng = random.Random(42)
+        rules = []
+        for pk in range(1, 201):
+            starts_at = START + timedelta(minutes=rng.randint(0, 24 * 60))
+            ends_at = starts_at + timedelta(minutes=rng.randint(1, 6 * 60))
+            if pk % 10 == 0:
+                starts_at = None
+            if pk % 15 == 0:
+                ends_at = None
+            rules.append(make_rule(pk, starts_at, ends_at, priority=rng.randint(0, 5)))
+        rules.sort(key=lambda rule: -rule.priority)
+        snapshot = RuleSnapshot(rules, built_at=START)
+
+        now = START - timedelta(hours=1)
+        while now < START + timedelta(hours=32):
+            self.assertEqual(snapshot.rules_at(now), live_rules(rules, now))
+            now += timedelta(seconds=rng.randint(1, 600))
+
+    def test_switches_exactly_at_boundaries(self):
+        rules = []
+        for pk in range(1, 51):
+            starts_at = START + timedelta(minutes=pk)
+            rules.append(make_rule(pk, starts_at, starts_at + timedelta(minutes=30)))
+        snapshot = RuleSnapshot(rules, built_at=START)
+
+        for boundary in snapshot.boundaries:
+            for when in (boundary - timedelta(microseconds=1), boundary):
+                self.assertEqual(snapshot.rules_at(when), live_rules(rules, when))
+
+    def test_next_boundary_is_when_the_rule_set_changes(self):
+        rule = make_rule(1, START + timedelta(hours=1), START + timedelta(hours=2))
+        snapshot = RuleSnapshot([rule], built_at=START)
+
+        self.assertEqual(snapshot.rules_at(START), ())
+        self.assertEqual(snapshot.next_boundary(START), rule.starts_at)
+        self.assertEqual(snapshot.rules_at(rule.starts_at), (rule,))
+        self.assertEqual(snapshot.next_boundary(rule.starts_at), rule.ends_at)
+        self.assertEqual(snapshot.rules_at(rule.ends_at), ())
+        self.assertIsNone(snapshot.next_boundary(rule.ends_at))
+
+    def test_rules_without_window_are_always_live(self):
+        always = make_rule(1)
+        later = make_rule(2, starts_at=START)
+        snapshot = RuleSnapshot([always, later], built_at=START)
+
+        self.assertEqual(snapshot.rules_at(START - timedelta(days=365)), (always,))
+        self.assertEqual(snapshot.rules_at(START + timedelta(days=365)), (always, later))
+
+
+def stacking_candidate(pk, amount, discount_type='percentage', group='', combinable=True, priority=0):
+    """Candidate of an unsaved rule for stacking tests"""
+    rule = DiscountRule(
+        id=pk, name=f'rule {pk}', discount_type=discount_type, value=Decimal('1'),
+        priority=priority, exclusivity_group=group, is_combinable=combinable
+    )
+    return Candidate(rule, Decimal(amount))
+
+
+class StackingTests(SimpleTestCase):
+    """Choosing the best combination of applicable discounts"""
+
+    def assertSolved(self, candidates, cap, expected_pks, expected_total):
+        selected, total = solve(candidates, cap)
+        self.assertEqual(sorted(c.rule.pk for c in selected), expected_pks)
+        self.assertEqual(total, Decimal(expected_total))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            candidates = [
+                stacking_candidate(
+                    pk, f'{rng.randint(0, 5000) / 100:.2f}',
+                    discount_type=rng.choice(['percentage', 'flat']),
+                    group=','.join(rng.sample('abcde', rng.randint(0, 2))),
+                    combinable=rng.random() > 0.15,
+                    priority=rng.randint(0, 3)
+                )
+                for pk in range(1, rng.randint(1, 10) + 1)
+            ]
+            cap = rng.choice([None, Decimal(rng.randint(10, 150))])
+            self.assertEqual(solve(candidates, cap)[1], solve_exhaustive(candidates, cap)[1])
+
+    def test_exclusive_groups_never_stack(self):
+        candidates = [
+            stacking_candidate(1, '10', group='summer'),
+            stacking_candidate(2, '8', discount_type='flat', group='summer'),
+            stacking_candidate(3, '7', discount_type='flat', group='loyalty'),
+            stacking_candidate(4, '5', group='summer,loyalty'),
+        ]
+        self.assertSolved(candidates, None, [1, 3], '17')
+
+    def test_one_percentage_and_one_flat_by_default(self):
+        candidates = [
+            stacking_candidate(1, '10'),
+            stacking_candidate(2, '12'),
+            stacking_candidate(3, '5', discount_type='flat'),
+            stacking_candidate(4, '4', discount_type='flat'),
+        ]
+        self.assertSolved(candidates, None, [2, 3], '17')
+
+    def test_ties_go_to_the_higher_priority(self):
+        candidates = [
+            stacking_candidate(1, '10', priority=1),
+            stacking_candidate(2, '10', priority=5),
+            stacking_candidate(3, '10', priority=3),
+        ]
+        self.assertSolved(candidates, None, [2], '10')
+        solo = [
+            stacking_candidate(1, '10', combinable=False, priority=1),
+            stacking_candidate(2, '10', combinable=False, priority=2),
+        ]
+        self.assertSolved(solo, None, [2], '10')
+
+    def test_total_is_capped(self):
+        candidates = [
+            stacking_candidate(1, '30'),
+            stacking_candidate(2, '25', discount_type='flat'),
+        ]
+        self.assertSolved(candidates, Decimal('40'), [1, 2], '40')
+        # Capped, a lone rule granting more no longer beats the stack
+        candidates.append(stacking_candidate(3, '50', combinable=False))
+        self.assertSolved(candidates, Decimal('40'), [1, 2], '40')
+        self.assertSolved(candidates, None, [1, 2], '55')
+        self.assertSolved(candidates, Decimal('60'), [1, 2], '55')
+        candidates.append(stacking_candidate(4, '58', discount_type='flat', combinable=False))
+        self.assertSolved(candidates, Decimal('60'), [4], '58')
+
+
+class ScheduledDiscountRuleTests(TestCase):
+    """Scheduled rules through DiscountRule.get_active_rules"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_flash_sale_switches_without_queries(self):
+        now = timezone.now()
+        DiscountRule.objects.create(
+            name='always', discount_type='percentage', value=5
+        )
+        sale = DiscountRule.objects.create(
+            name='flash sale', discount_type='percentage', value=20, priority=10,
+            starts_at=now + timedelta(hours=1), ends_at=now + timedelta(hours=2)
+        )
+        DiscountRule.objects.create(
+            name='expired', discount_type='flat', value=50,
+            starts_at=now - timedelta(days=2), ends_at=now - timedelta(days=1)
+        )
+        get_rule_snapshot()
+
+        with self.assertNumQueries(0):
+            before = DiscountRule.get_active_rules(now)
+            during = DiscountRule.get_active_rules(now + timedelta(minutes=90))
+            after = DiscountRule.get_active_rules(now + timedelta(hours=2))
+
+        self.assertEqual([rule.name for rule in before], ['always'])
+        self.assertEqual([rule.name for rule in during], ['flash sale', 'always'])
+        self.assertEqual([rule.name for rule in after], ['always'])
+        self.assertEqual(during[0].pk, sale.pk)
+
+    def test_inactive_rules_are_excluded(self):
+        DiscountRule.objects.create(
+            name='disabled', discount_type='percentage', value=5, is_active=False
+        )
+        invalidate_rule_snapshot()
+
+        self.assertEqual(DiscountRule.get_active_rules(START), ())
+
+
+class AdminQueryCountTests(TestCase):
+    """Admin pages run a fixed number of queries however big the tables are"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='x'
+        )
+        cls.category = ProductCategory.objects.create(name='books')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'book {i}', description='', price=10,
+                    category=cls.category, stock_quantity=10)
+            for i in range(20)
+        ])
+        cls.order = cls.add_orders(1)[0]
+
+    @classmethod
+    def add_orders(cls, count, items=3):
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'buyer-{CustomUser.objects.count()}-{i}')
+            for i in range(count)
+        ])
+        orders = Order.objects.bulk_create([Order(user=user) for user in users])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1,
+                      unit_price=product.price, category=cls.category)
+            for order in orders for product in cls.products[:items]
+        ])
+        return orders
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def count_queries(self, url):
+        # The first request fills process-wide caches (content types)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:order_management_order_changelist')
+        few, _ = self.count_queries(url)
+        self.add_orders(20)
+        many, response = self.count_queries(url)
+
+        self.assertEqual(few, many)
+        self.assertContains(response, 'buyer-')
+
+    def test_change_page_queries_do_not_grow_with_items(self):
+        small = self.add_orders(1, items=2)[0]
+        large = self.add_orders(1, items=20)[0]
+
+        few, _ = self.count_queries(
+            reverse('admin:order_management_order_change', args=[small.pk]))
+        many, response = self.count_queries(
+            reverse('admin:order_management_order_change', args=[large.pk]))
+
+        self.assertEqual(few, many)
+        # Products are picked with autocomplete, not a dropdown of all of them
+        self.assertNotContains(response, f'<option value="{self.products[-1].pk}"')
+
+    def test_search_by_exact_id_and_username_prefix(self):
+        other = self.add_orders(1)[0]
+        url = reverse('admin:order_management_order_changelist')
+
+        response = self.client.get(url, {'q': f'#{other.pk}'})
+        self.assertEqual(list(response.context['cl'].result_list), [other])
+
+        prefix = other.user.username[:-1]
+        response = self.client.get(url, {'q': prefix})
+        self.assertIn(other, response.context['cl'].result_list)
+        self.assertNotIn(self.order, response.context['cl'].result_list)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_paginator_skips_exact_count_on_large_tables(self):
+        self.add_orders(10)
+
+        with CaptureQueriesContext(connection) as context:
+            count = EstimatedCountPaginator(Order.objects.all(), 100).count
+        self.assertGreaterEqual(count, 5)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in context))
+
+        # Filtered lists are counted, but only up to the limit
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(status='pending'), 100).count, 5)
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(pk=self.order.pk), 100).count, 1)
+
+
+class CategoryTreeTests(TestCase):
+    """Nested categories: closure table upkeep and category rule coverage"""
+
+    def setUp(self):
+        cache.clear()
+        self.electronics = ProductCategory.objects.create(name='electronics')
+        self.phones = ProductCategory.objects.create(name='phones', parent=self.electronics)
+        self.android = ProductCategory.objects.create(name='android', parent=self.phones)
+        self.laptops = ProductCategory.objects.create(name='laptops', parent=self.electronics)
+        self.books = ProductCategory.objects.create(name='books')
+
+    def price(self, *lines):
+        """Price an unsaved order of (category, unit price) lines"""
+        items = [
+            OrderItem(product=Product(category=category, price=Decimal(price)), quantity=1,
+                      unit_price=Decimal(price), category=category)
+            for category, price in lines
+        ]
+        order = Order(user=CustomUser(username='buyer'))
+        order.subtotal = sum(item.unit_price for item in items)
+        DiscountCalculator(order, items=items).apply_discounts()
+        return order, items
+
+    def test_ancestor_map_follows_moves(self):
+        ancestors = ProductCategory.ancestor_map()
+        self.assertEqual(
+            ancestors[self.android.pk], {self.android.pk, self.phones.pk, self.electronics.pk}
+        )
+        self.assertNotIn(self.books.pk, ancestors)
+
+        self.phones.parent = self.books
+        self.phones.save()
+
+        ancestors = ProductCategory.ancestor_map()
+        self.assertEqual(ancestors[self.android.pk], {self.android.pk, self.phones.pk, self.books.pk})
+        self.assertEqual(ancestors[self.laptops.pk], {self.laptops.pk, self.electronics.pk})
+
+    def test_category_cannot_be_nested_under_its_subcategory(self):
+        self.electronics.parent = self.android
+        with self.assertRaises(ValidationError):
+            self.electronics.save()
+
+    def test_parent_rule_covers_subcategories(self):
+        DiscountRule.objects.create(
+            name='electronics', discount_type='category', value=10, category=self.electronics
+        )
+        invalidate_rule_snapshot()
+
+        order, items = self.price((self.android, '100'), (self.books, '50'))
+        self.assertEqual(order.total_discount, Decimal('10'))
+        self.assertEqual([item.item_discount for item in items], [Decimal('10'), Decimal('0')])
+
+    def test_subcategory_rule_and_parent_rule_share_an_order(self):
+        DiscountRule.objects.create(
+            name='electronics', discount_type='category', value=10, category=self.electronics
+        )
+        DiscountRule.objects.create(
+            name='phones', discount_type='category', value=15, category=self.phones
+        )
+        invalidate_rule_snapshot()
+
+        # The phone gets the better phones rule, the laptop the parent rule,
+        # and no item is discounted twice
+        order, items = self.price((self.android, '100'), (self.laptops, '200'))
+        self.assertEqual([item.item_discount for item in items], [Decimal('15'), Decimal('20')])
+        self.assertEqual(order.total_discount, Decimal('35'))
+        self.assertEqual(
+            sorted(entry['name'] for entry in order.discount_breakdown.values()),
+            ['electronics', 'phones']
+        )
+
+    def test_category_default_discount_applies_through_the_tree(self):
+        self.phones.discount_percentage = Decimal('5')
+        self.phones.save()
+        invalidate_rule_snapshot()
+
+        order, items = self.price((self.android, '100'), (self.laptops, '100'))
+        self.assertEqual([item.item_discount for item in items], [Decimal('5'), Decimal('0')])
+        self.assertEqual(
+            list(order.discount_breakdown.values())[0]['name'], 'phones default discount'
+        )
+
+
+class ProductSearchTests(TestCase):
+    """The q parameter of the product list"""
+
+    def setUp(self):
+        self.shoes = ProductCategory.objects.create(name='shoes')
+        outdoor = ProductCategory.objects.create(name='outdoor')
+        self.products = {
+            name: Product.objects.create(
+                name=name, description=description, price=Decimal('10'),
+                category=category, stock_quantity=5
+            )
+            for name, description, category in [
+                ('Running shoes', 'Light trainers', self.shoes),
+                ('Trail jacket', 'Waterproof, great for running', outdoor),
+                ('Café table', 'Folding garden table', outdoor),
+            ]
+        }
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='shopper'))
+
+    def search(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_last_word_is_a_prefix(self):
+        self.assertEqual(self.search(q='runn'), ['Running shoes', 'Trail jacket'])
+        self.assertEqual(self.search(q='trail runn'), ['Trail jacket'])
+        # Only the last word
+        self.assertEqual(self.search(q='runn trail'), [])
+        self.assertEqual(self.search(q='cafe'), ['Café table'])
+
+    def test_name_matches_rank_first(self):
+        Product.objects.create(
+            name='Running socks', description='Merino', price=Decimal('5'),
+            category=self.shoes, stock_quantity=5
+        )
+        names = self.search(q='running')
+        self.assertEqual(set(names[:2]), {'Running shoes', 'Running socks'})
+        self.assertEqual(names[2:], ['Trail jacket'])
+
+    def test_index_follows_product_edits(self):
+        jacket = self.products['Trail jacket']
+        jacket.description = 'Waterproof shell'
+        jacket.save()
+        self.products['Running shoes'].delete()
+
+        self.assertEqual(self.search(q='running'), [])
+        self.assertEqual(self.search(q='shell'), ['Trail jacket'])
+
+    def test_combines_with_filters(self):
+        self.assertEqual(self.search(q='running', category='shoes'), ['Running shoes'])
+        self.assertEqual(self.search(q='running', max_price='5'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search(q='"running" OR NEAR(table'), [])
+        self.assertEqual(self.search(q='*'), [])
+
+
+class RuleTelemetryTests(TestCase):
+    """Per-rule counters aggregated in memory and flushed to DiscountRuleStats"""
+
+    def setUp(self):
+        cache.clear()
+        telemetry.reset()
+        self.addCleanup(telemetry.reset)
+        self.rules = [
+            DiscountRule.objects.create(name=name, discount_type='percentage', value=Decimal('5'))
+            for name in ('matched', 'evaluated')
+        ]
+
+    def test_flush_adds_the_pending_counts(self):
+        matched, evaluated = [rule.pk for rule in self.rules]
+        for _ in range(2):
+            telemetry.record([matched, evaluated], [matched], [(matched, Decimal('2.50'))],
+                             [(matched, 100)])
+        # A rule deleted since it was counted is dropped
+        telemetry.record([evaluated + 100], [], [])
+
+        self.assertEqual(telemetry.flush(), 2)
+        self.assertEqual(telemetry.flush(), 0)
+        telemetry.record([matched], [], [])
+        telemetry.flush()
+
+        stats = DiscountRuleStats.objects.get(rule_id=matched)
+        self.assertEqual(
+            (stats.evaluations, stats.matches, stats.applications, stats.discount_granted,
+             stats.timed_evaluations, stats.evaluation_ns),
+            (3, 2, 2, Decimal('5.00'), 2, 200)
+        )
+        self.assertIsNotNone(stats.last_matched_at)
+        stats = DiscountRuleStats.objects.get(rule_id=evaluated)
+        self.assertEqual((stats.evaluations, stats.matches), (2, 0))
+        self.assertIsNone(stats.last_matched_at)
+        self.assertEqual(DiscountRuleStats.objects.count(), 2)
+
+    def test_flushed_before_old_connections_are_closed(self):
+        receivers = request_finished._live_receivers(None)
+        self.assertLess(
+            receivers.index(telemetry.flush_after_request),
+            receivers.index(close_old_connections)
+        )
+
+    @override_settings(RULE_STATS_FLUSH_INTERVAL=3600, DISCOUNT_RULE_INDEX=True)
+    def test_priced_orders_are_counted(self):
+        category = ProductCategory.objects.create(name='games')
+        product = Product.objects.create(
+            name='chess', price=Decimal('30'), category=category, stock_quantity=5
+        )
+        DiscountRule.objects.filter(pk=self.rules[1].pk).update(min_order_amount=Decimal('500'))
+        invalidate_rule_snapshot()
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username='player'))
+
+        response = client.post(
+            reverse('order-list'), {'items': [{'product_id': product.pk, 'quantity': 1}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        # Not flushed within the interval
+        self.assertFalse(DiscountRuleStats.objects.exists())
+        telemetry.flush()
+        stats = DiscountRuleStats.objects.get(rule=self.rules[0])
+        self.assertEqual((stats.evaluations, stats.applications), (1, 1))
+        # Skipped by the rule index, so never evaluated
+        self.assertFalse(DiscountRuleStats.objects.filter(rule=self.rules[1]).exists())
+
+
+@override_settings(RECOMMENDATIONS_MIN_CO_PURCHASES=1)
+class RecommendationTests(TestCase):
+    """Co-purchase recommendations, rebuilt in full or updated incrementally"""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            RECOMMENDATIONS_STATE_PATH=os.path.join(directory.name, 'copurchase.npz')
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = CustomUser.objects.create(username='buyer')
+        category = ProductCategory.objects.create(name='kitchen')
+        self.pan, self.lid, self.whisk, self.apron = Product.objects.bulk_create([
+            Product(name=name, description='', price=Decimal('10'), category=category,
+                    stock_quantity=50)
+            for name in ('pan', 'lid', 'whisk', 'apron')
+        ])
+
+    def complete(self, *products, status='completed'):
+        order = Order.objects.create(user=self.user, status=status)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, unit_price=product.price,
+                      category_id=product.category_id)
+            for product in products
+        ])
+        return order
+
+    def recommended(self, product):
+        return [(item['name'], item['co_purchases']) for item in get_recommendations(product.pk)]
+
+    def test_updates_only_count_new_orders(self):
+        self.complete(self.pan, self.lid)
+        self.complete(self.pan, self.lid)
+        self.complete(self.pan, self.whisk)
+        self.complete(self.pan, self.apron, status='pending')
+
+        summary = update_recommendations()
+        self.assertEqual((summary['full'], summary['orders']), (True, 3))
+        self.assertEqual(self.recommended(self.pan), [('lid', 2), ('whisk', 1)])
+
+        self.complete(self.pan, self.whisk)
+        self.complete(self.pan, self.whisk)
+        summary = update_recommendations()
+        self.assertEqual((summary['full'], summary['orders']), (False, 2))
+        # The cached payload was dropped and earlier orders not counted again
+        self.assertEqual(self.recommended(self.pan), [('whisk', 3), ('lid', 2)])
+        self.assertEqual(self.recommended(self.whisk), [('pan', 3)])
+
+        self.assertEqual(update_recommendations()['orders'], 0)
+        self.assertEqual(update_recommendations(full=True)['orders'], 5)
+        self.assertEqual(self.recommended(self.pan), [('whisk', 3), ('lid', 2)])
+
+    def test_inactive_product_is_found_once_activated(self):
+        Product.objects.filter(pk=self.pan.pk).update(is_active=False)
+        self.assertIsNone(get_recommendations(self.pan.pk))
+
+        Product.objects.filter(pk=self.pan.pk).update(is_active=True)
+        self.assertEqual(get_recommendations(self.pan.pk), [])
+
+
+class RendererTests(TestCase):
+    """orjson rendering of the values() fast path against DRF"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(username='buyer')
+        books = ProductCategory.objects.create(name='books')
+        games = ProductCategory.objects.create(name='games')
+        self.products = [
+            Product.objects.create(
+                name=f'product {i}', description=f'about {i}', price=Decimal(price),
+                category=category, stock_quantity=10 + i
+            )
+            for i, (price, category) in enumerate(
+                [('9.99', books), ('20', games), ('0.50', books)]
+            )
+        ]
+        DiscountRule.objects.create(name='sale', discount_type='percentage', value=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for quantities in ((1, 2, 0), (0, 3, 1)):
+            items = [
+                {'product_id': product.pk, 'quantity': quantity}
+                for product, quantity in zip(self.products, quantities) if quantity
+            ]
+            response = self.client.post(reverse('order-list'), {'items': items}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def assertRenderedLike(self, response, expected):
+        self.assertEqual(response.status_code, 200)
+        renderer = ORJSONRenderer()
+        self.assertEqual(
+            renderer.render(response.data['results']), renderer.render(expected)
+        )
+        self.assertEqual(
+            orjson.loads(response.content)['results'],
+            orjson.loads(JSONRenderer().render(expected))
+        )
+
+    def test_product_list_matches_the_model_serializer(self):
+        response = self.client.get(reverse('product-list'))
+
+        products = Product.objects.filter(is_active=True).order_by('name')
+        self.assertRenderedLike(response, ProductSerializer(products, many=True).data)
+
+    def test_order_list_matches_the_model_serializer(self):
+        response = self.client.get(reverse('order-list'))
+
+        orders = Order.objects.filter(user=self.user).order_by('-order_date')
+        self.assertRenderedLike(response, OrderSerializer(orders, many=True).data)
+
+    def test_values_are_encoded_like_drf(self):
+        data = {
+            'amount': Decimal('1.50'),
+            'elapsed': timedelta(seconds=5),
+            'at': datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=dt_timezone.utc),
+            'day': datetime(2024, 1, 2).date(),
+            'items': (code for code in ('a', 'b')),
+            'counts': {1: 2},
+        }
+        expected = JSONRenderer().render(dict(data, items=['a', 'b']))
+        self.assertEqual(ORJSONRenderer().render(data), expected)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    """Cached request users, token revocation and trusted token claims"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='buyer', password='secret')
+
+    def authenticate(self, user=None, method='get'):
+        token = VersionedTokenObtainPairSerializer.get_token(user or self.user).access_token
+        request = getattr(RequestFactory(), method)('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_second_request_is_served_from_the_cache(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.authenticate()
+        cached = self.authenticate()
+        self.assertIn('password', cached.get_deferred_fields())
+        # Saving it does not blank the password
+        cached.first_name = 'Ann'
+        cached.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret'))
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.authenticate()
+        self.user.loyalty_points = 7
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().loyalty_points, 7)
+
+    def test_revoked_tokens_are_refused(self):
+        token = VersionedTokenObtainPairSerializer.get_token(self.user).access_token
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        CachedJWTAuthentication().authenticate(request)
+
+        self.user.revoke_tokens()
+        with self.assertRaises(AuthenticationFailed):
+            CachedJWTAuthentication().authenticate(request)
+        self.assertEqual(self.authenticate().token_version, 1)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_trusted_claims_still_check_revocation(self):
+        token = VersionedTokenObtainPairSerializer.get_token(self.user).access_token
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        CachedJWTAuthentication().authenticate(request)
+        with self.assertNumQueries(0):
+            CachedJWTAuthentication().authenticate(request)
+
+        self.user.revoke_tokens()
+        with self.assertRaises(AuthenticationFailed):
+            CachedJWTAuthentication().authenticate(request)
+
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_staff_status_never_comes_from_claims(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.authenticate().is_staff)
+
+        staff = CustomUser.objects.create_user(username='staff', is_staff=True)
+        token = VersionedTokenObtainPairSerializer.get_token(staff).access_token
+        url = reverse('discount-rule-list')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 200)
+
+        # Demoted since the token was issued
+        staff.is_staff = False
+        staff.save()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 403)
+
+
+class ArchiveTests(TestCase):
+    """Moving old orders to the archive tables and serving them from there"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(username='buyer')
+        category = ProductCategory.objects.create(name='books')
+        self.product = Product.objects.create(
+            name='novel', price=Decimal('20'), category=category, stock_quantity=10
+        )
+        self.order = Order.objects.create(user=self.user, status='completed')
+        OrderItem.objects.create(
+            order=self.order, product=self.product, quantity=2,
+            unit_price=Decimal('20'), category=category
+        )
+        self.order.subtotal = self.order.final_amount = Decimal('40')
+        self.order.save()
+        Order.objects.filter(pk=self.order.pk).update(
+            order_date=timezone.now() - timedelta(days=400)
+        )
+
+    def test_orders_move_with_their_totals(self):
+        self.assertEqual(archive_orders(archive_cutoff(365)), 1)
+
+        self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+        archived = ArchivedOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(archived.completed_at, self.order.completed_at)
+        item = ArchivedOrderItem.objects.get(order=archived)
+        self.assertEqual((item.product_name, item.product_price, item.category_name),
+                         ('novel', Decimal('20'), 'books'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.archived_completed_orders, 1)
+        self.assertEqual(self.user.archived_completed_total, Decimal('40'))
+        self.assertEqual(archive_orders(archive_cutoff(365)), 0)
+
+    def test_rerun_after_a_failed_delete_overwrites_the_copy(self):
+        # As left by a run whose archive copy committed but whose delete did not
+        ArchivedOrder.objects.create(
+            id=self.order.pk, user=self.user, order_date=timezone.now(), status='pending'
+        )
+        self.assertEqual(archive_orders(archive_cutoff(365)), 1)
+        self.assertEqual(ArchivedOrder.objects.get(pk=self.order.pk).status, 'completed')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.archived_completed_orders, 1)
+
+    def test_detail_view_falls_back_to_the_archive(self):
+        archive_orders(archive_cutoff(365))
+        # Archived items render without their product
+        OrderItem.objects.filter(product=self.product).delete()
+        self.product.delete()
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('order-detail', args=[self.order.pk])
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['items'][0]['product']['name'], 'novel')
+        self.assertEqual(response.data['items'][0]['category'], 'books')
+
+        other = CustomUser.objects.create(username='other')
+        client.force_authenticate(other)
+        self.assertEqual(client.get(url).status_code, 404)
+
+
+class BulkOrderTests(TestCase):
+    """POST /api/orders/bulk/ with a result per order"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(username='reseller')
+        category = ProductCategory.objects.create(name='stationery')
+        self.pen, self.ink = Product.objects.bulk_create([
+            Product(name=name, description='', price=Decimal('4'), category=category,
+                    stock_quantity=10)
+            for name in ('pen', 'ink')
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('order-bulk-create')
+
+    def order(self, reference, *items):
+        return {
+            'reference': reference,
+            'items': [{'product_id': pk, 'quantity': quantity} for pk, quantity in items],
+        }
+
+    def post(self, orders):
+        return self.client.post(self.url, {'orders': orders}, format='json')
+
+    def test_mixed_batch_creates_the_valid_orders(self):
+        response = self.post([
+            self.order('a', (self.pen.pk, 1), (self.ink.pk, 2)),
+            self.order('b', (self.ink.pk + 100, 1)),
+            'not an order',
+            self.order('d', (self.pen.pk, 1), (self.pen.pk, 1)),
+            self.order('e', (self.ink.pk, 11)),
+            self.order('f', (self.pen.pk, 3)),
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['rejected']), (2, 4))
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], list(range(6)))
+        self.assertEqual([result['reference'] for result in results],
+                         ['a', 'b', None, 'd', 'e', 'f'])
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'rejected', 'rejected', 'rejected', 'rejected', 'created'])
+
+        self.assertEqual(results[0]['subtotal'], '12.00')
+        self.assertIn('product_id', results[1]['errors']['items'][0])
+        self.assertIn('non_field_errors', results[2]['errors'])
+        self.assertEqual(results[3]['errors']['items'],
+                         ['Each product may only appear once per order'])
+        self.assertIn('ink', str(results[4]['errors']))
+        self.assertEqual(
+            sorted(Order.objects.filter(user=self.user).values_list('pk', flat=True)),
+            [results[0]['id'], results[5]['id']]
+        )
+
+    def test_status_reflects_the_outcome(self):
+        self.assertEqual(self.post([self.order('a', (self.pen.pk, 1))]).status_code, 201)
+
+        response = self.post([self.order('a', (self.pen.pk, 1), (self.pen.pk, 2)), []])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(BULK_ORDER_MAX_BATCH=2)
+    def test_envelope_is_validated(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        response = self.post([self.order(str(i), (self.pen.pk, 1)) for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('orders', response.data)
+        self.assertFalse(Order.objects.exists())
+
+
+class AdmissionTests(TestCase):
+    """Per-user token buckets and the in-flight limit of checkouts"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_admits_bursts_then_the_rate(self):
+        now = 1000.0
+        waits = [admission.take_token('test', 1, rate=2, burst=3, now=now) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        # Other users have their own bucket
+        self.assertEqual(admission.take_token('test', 2, rate=2, burst=3, now=now), 0)
+        self.assertEqual(admission.take_token('test', 1, rate=2, burst=3, now=now + 0.5), 0)
+        self.assertGreater(admission.take_token('test', 1, rate=2, burst=3, now=now + 0.5), 0)
+
+    def test_busy_lock_is_waited_for(self):
+        lock_key = f'{admission.KEY_PREFIX}:test:user:1:lock'
+        cache.add(lock_key, 1)
+        threading.Timer(0.02, cache.delete, [lock_key]).start()
+        self.assertEqual(admission.take_token('test', 1, rate=1, burst=1), 0)
+
+        # A lock that never frees does not turn the request away either
+        cache.add(lock_key, 1)
+        with mock.patch.object(admission, 'LOCK_TIMEOUT', 0.01):
+            self.assertEqual(admission.take_token('test', 2, rate=1, burst=1), 0)
+
+    def test_slots_limit_requests_in_flight(self):
+        self.assertTrue(admission.acquire_slot('test', 2))
+        self.assertTrue(admission.acquire_slot('test', 2))
+        self.assertFalse(admission.acquire_slot('test', 2))
+        admission.release_slot('test')
+        self.assertTrue(admission.acquire_slot('test', 2))
+
+    def test_rejected_checkout_gets_retry_after(self):
+        category = ProductCategory.objects.create(name='books')
+        product = Product.objects.create(
+            name='book', price=Decimal('10'), category=category, stock_quantity=10
+        )
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username='buyer'))
+        url = reverse('order-list')
+        body = {'items': [{'product_id': product.pk, 'quantity': 1}]}
+        limits = {'order_create': {'rate': 0.25, 'burst': 1, 'concurrency': 1, 'retry_after': 7}}
+
+        with override_settings(ADMISSION_CONTROL=limits):
+            self.assertEqual(client.post(url, body, format='json').status_code, 201)
+            response = client.post(url, body, format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn(response['Retry-After'], ('4', '5'))
+
+            # The first request gave its slot back; taking it turns others away
+            self.assertTrue(admission.acquire_slot('order_create', 1))
+            response = client.post(url, body, format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '7')
+        # Off by default
+        self.assertEqual(client.post(url, body, format='json').status_code, 201)
+
+
+class GroupCommitTests(TransactionTestCase):
+    """Checkouts committed in groups by the writer thread"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(username='buyer')
+        self.category = ProductCategory.objects.create(name='garden')
+        self.hose, self.rake = Product.objects.bulk_create([
+            Product(name=name, description='', price=Decimal('15'), category=self.category,
+                    stock_quantity=3)
+            for name in ('hose', 'rake')
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(setattr, groupcommit, '_queue', None)
+
+    def order(self, *items):
+        return {'items': [{'product_id': pk, 'quantity': quantity} for pk, quantity in items]}
+
+    def commit(self, *orders):
+        """Outcomes of committing ``orders`` as one group, in this thread"""
+        group = [(self.user, order, Future()) for order in orders]
+        groupcommit.GroupCommitQueue(0, 64).commit(group)
+        return [future.result() for _, _, future in group]
+
+    def test_a_bad_order_does_not_fail_its_group(self):
+        outcomes = self.commit(
+            self.order((self.hose.pk, 1)),
+            self.order((self.rake.pk + 100, 1)),
+            self.order((self.rake.pk, 4)),
+            self.order((self.hose.pk, 1), (self.rake.pk, 2)),
+        )
+        self.assertIsNone(outcomes[0][1])
+        self.assertIn('product_id', outcomes[1][1]['items'][0])
+        self.assertIn('non_field_errors', outcomes[2][1])
+        self.assertEqual(outcomes[3][0].subtotal, Decimal('45'))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_vanished_product_only_rejects_its_order(self):
+        gone = Product(
+            pk=self.rake.pk + 100, name='gone', price=Decimal('1'),
+            category=self.category, stock_quantity=5, is_active=True
+        )
+        load_products = checkout.load_products
+
+        def stale_load_products(product_ids):
+            return {**load_products(product_ids), gone.pk: gone}
+
+        with mock.patch.object(checkout, 'load_products', stale_load_products):
+            outcomes = self.commit(
+                self.order((self.hose.pk, 1)),
+                self.order((gone.pk, 1)),
+                self.order((self.rake.pk, 1)),
+            )
+        self.assertIsNotNone(outcomes[0][0])
+        self.assertEqual(outcomes[1], (None, {
+            'non_field_errors': ["A product of this order is no longer available"]
+        }))
+        self.assertIsNotNone(outcomes[2][0])
+        self.assertEqual(
+            set(Order.objects.values_list('pk', flat=True)),
+            {outcomes[0][0].pk, outcomes[2][0].pk}
+        )
+
+    @override_settings(CHECKOUT_GROUP_COMMIT=True)
+    def test_checkout_through_the_writer(self):
+        response = self.client.post(
+            reverse('order-list'), self.order((self.hose.pk, 2)), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['subtotal'], '30.00')
+
+        # Rejected before it is queued, not by the unique index on commit
+        response = self.client.post(
+            reverse('order-list'), self.order((self.hose.pk, 1), (self.hose.pk, 1)),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['items'], ['Each product may only appear once per order'])
+
+    @override_settings(CHECKOUT_GROUP_COMMIT=True, CHECKOUT_GROUP_COMMIT_TIMEOUT=0.01)
+    def test_group_not_committed_in_time_is_a_503(self):
+        with mock.patch.object(groupcommit.GroupCommitQueue, 'submit', return_value=Future()):
+            response = self.client.post(
+                reverse('order-list'), self.order((self.hose.pk, 1)), format='json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['detail'].code, 'checkout_unavailable')
+
+
+class CatalogueSnapshotTests(TestCase):
+    """Product lookups through the memory-mapped catalogue file"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'catalogue.snapshot')
+        self.addCleanup(os.rmdir, directory)
+        override = override_settings(
+            CATALOGUE_SNAPSHOT_PATH=self.path, CATALOGUE_SNAPSHOT_CHECK_INTERVAL=0
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = ProductCategory.objects.create(name='tools')
+        self.products = Product.objects.bulk_create([
+            Product(
+                name=f'tool {i}', description='', price=Decimal(i) + Decimal('0.99'),
+                category=self.category, stock_quantity=i, is_active=i % 7 != 0
+            )
+            for i in range(1, 301)
+        ])
+        build_catalogue_snapshot()
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    def test_lookup_matches_the_database(self):
+        catalogue = get_catalogue()
+        self.assertEqual(len(catalogue), 300)
+        for product in self.products:
+            self.assertEqual(
+                catalogue.lookup(product.pk),
+                (int(product.price * 100), self.category.pk, product.stock_quantity,
+                 int(product.is_active))
+            )
+        self.assertIsNone(catalogue.lookup(self.products[-1].pk + 1))
+
+        with self.assertNumQueries(0):
+            loaded = load_products([product.pk for product in self.products[:20]])
+        self.assertEqual(sorted(loaded), [p.pk for p in self.products[:20] if p.is_active])
+        self.assertEqual(loaded[self.products[0].pk].price, Decimal('1.99'))
+
+    def test_rebuild_is_picked_up(self):
+        old = get_catalogue()
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(price=Decimal('5'))
+
+        rebuild_catalogue_snapshot()
+        self.assertEqual(get_catalogue().product(product.pk).price, Decimal('5'))
+        # Callers still holding the old mapping keep reading it
+        self.assertEqual(old.product(product.pk).price, Decimal('1.99'))
+
+    def test_products_missing_from_the_file_come_from_the_database(self):
+        added = Product.objects.create(
+            name='new tool', description='', price=Decimal('3'),
+            category=self.category, stock_quantity=1
+        )
+        inactive = self.products[6]
+        loaded = load_products([self.products[0].pk, added.pk, inactive.pk])
+        self.assertEqual(sorted(loaded), [self.products[0].pk, added.pk])
+
+        field = CatalogueProductField(queryset=Product.objects.filter(is_active=True))
+        self.assertEqual(field.to_internal_value(added.pk), added)
+        with self.assertRaises(APIValidationError):
+            field.to_internal_value(inactive.pk)
+
+    def test_rule_edit_during_a_build_is_not_in_the_file(self):
+        cache.clear()
+        build = RuleSnapshot.build
+
+        def build_then_edit():
+            snapshot = build()
+            # Committed while the product table is built
+            invalidate_rule_snapshot()
+            return snapshot
+
+        with mock.patch.object(RuleSnapshot, 'build', side_effect=build_then_edit):
+            build_catalogue_snapshot()
+        catalogue = get_catalogue()
+        self.assertIsNot(get_rule_snapshot(), catalogue.rules)
+
+        rebuild_catalogue_snapshot()
+        catalogue = get_catalogue()
+        self.assertIs(get_rule_snapshot(), catalogue.rules)
+
+    def test_missing_file_falls_back_to_the_database(self):
+        os.unlink(self.path)
+        self.assertIsNone(get_catalogue())
+        with self.assertNumQueries(1):
+            loaded = load_products([self.products[0].pk])
+        self.assertEqual(loaded[self.products[0].pk].price, Decimal('1.99'))
+
+
+class OutboxTests(TestCase):
+    """Draining the outbox: deduplication, retries and rule invalidation"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        handlers = mock.patch.dict(outbox.HANDLERS, {
+            'test.recorded': lambda **payload: self.calls.append(payload),
+            'test.failing': mock.Mock(side_effect=RuntimeError('boom')),
+        })
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def test_identical_events_run_once(self):
+        for user_id in (1, 1, 2):
+            OutboxEvent.enqueue('test.recorded', user_id=user_id)
+
+        self.assertEqual(outbox.process_batch(), 3)
+        self.assertEqual(sorted(call['user_id'] for call in self.calls), [1, 2])
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(outbox.process_batch(), 0)
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_event_is_retried_with_backoff(self):
+        event = OutboxEvent.enqueue('test.failing')
+        OutboxEvent.enqueue('test.recorded')
+
+        before = timezone.now()
+        with self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.process_batch(), 2)
+        event.refresh_from_db()
+        self.assertIsNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('boom', event.last_error)
+        self.assertGreaterEqual(event.available_at, before + timedelta(seconds=2))
+        # Not due yet
+        self.assertEqual(outbox.process_batch(), 0)
+
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=before)
+        with self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.process_batch(), 1)
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 2)
+        self.assertGreaterEqual(event.available_at, before + timedelta(seconds=4))
+        # Out of attempts
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=before)
+        self.assertEqual(outbox.process_batch(), 0)
+
+    def test_catalogue_is_rebuilt_once_after_the_batch(self):
+        OutboxEvent.enqueue('discount_rules.changed')
+        OutboxEvent.enqueue('catalogue.changed')
+
+        with mock.patch.object(outbox, 'rebuild_catalogue_snapshot',
+                               side_effect=OSError('disk full')) as rebuild, \
+                self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.process_batch(), 2)
+        rebuild.assert_called_once_with()
+        # A failed rebuild leaves both events to retry
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list('processed_at', 'attempts')),
+            [(None, 1), (None, 1)]
+        )
+
+    def test_rule_edit_clears_the_cache_on_commit(self):
+        rule = DiscountRule.objects.create(
+            name='spring', discount_type='percentage', value=Decimal('5')
+        )
+        get_rule_snapshot()
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username='staff', is_staff=True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(
+                reverse('discount-rule-detail', args=[rule.pk]), {'value': '10'}, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNotNone(cache.get(RULE_SNAPSHOT_CACHE_KEY))
+        self.assertIsNone(cache.get(RULE_SNAPSHOT_CACHE_KEY))
+        self.assertEqual(get_rule_snapshot().rules[0].value, Decimal('10'))
+        self.assertTrue(OutboxEvent.objects.filter(topic='discount_rules.changed').exists())
+
+    def test_stale_catalogue_rules_are_skipped(self):
+        DiscountRule.objects.create(name='spring', discount_type='percentage', value=Decimal('5'))
+        path = os.path.join(tempfile.mkdtemp(), 'catalogue.snapshot')
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.addCleanup(os.unlink, path)
+
+        with override_settings(CATALOGUE_SNAPSHOT_PATH=path, CATALOGUE_SNAPSHOT_CHECK_INTERVAL=0):
+            build_catalogue_snapshot()
+            self.assertEqual(get_rule_snapshot().rules[0].value, Decimal('5'))
+
+            DiscountRule.objects.update(value=Decimal('10'))
+            invalidate_rule_snapshot()
+            self.assertEqual(get_rule_snapshot().rules[0].value, Decimal('10'))
+
+            OutboxEvent.enqueue('discount_rules.changed')
+            outbox.process_batch()
+            self.assertEqual(get_rule_snapshot().rules[0].value, Decimal('10'))
+            self.assertEqual(cache.get(RULE_SNAPSHOT_CACHE_KEY), None)
+
+
+class CouponTests(TestCase):
+    """Coupon lookup through the Bloom filter and single-use redemption"""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, 'coupons.bloom')
+        settings_override = override_settings(COUPON_FILTER_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = ProductCategory.objects.create(name='books')
+        self.product = Product.objects.create(
+            name='book', price=Decimal('100'), category=category, stock_quantity=100
+        )
+        self.rule = DiscountRule.objects.create(
+            name='welcome', discount_type='percentage', value=10, requires_coupon=True
+        )
+        self.code = sorted(coupons.create_coupons(self.rule, 3))[0]
+        self.alice = CustomUser.objects.create(username='alice')
+        self.bob = CustomUser.objects.create(username='bob')
+
+    def checkout(self, user, code=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        body = {'items': [{'product_id': self.product.pk, 'quantity': 1}]}
+        if code is not None:
+            body['coupon_code'] = code
+        return client.post(reverse('order-list'), body, format='json')
+
+    def test_filter_has_no_false_negatives(self):
+        codes = coupons.generate_codes(5000)
+        bloom = coupons.BloomFilter.create(len(codes), error_rate=0.01)
+        bloom.add_many(codes)
+        path = os.path.join(self.directory, 'filter')
+        bloom.save(path)
+
+        loaded = coupons.BloomFilter.load(path)
+        self.assertTrue(all(code in loaded for code in codes))
+        unknown = coupons.generate_codes(5000) - codes
+        self.assertLess(sum(code in loaded for code in unknown), len(unknown) * 0.03)
+
+    def test_unknown_code_is_rejected_without_a_query(self):
+        field = CouponCodeField()
+        with self.assertNumQueries(0):
+            with self.assertRaises(APIValidationError):
+                field.run_validation('NOT-A-REAL-CODE')
+            # Codes are matched case-insensitively
+            self.assertEqual(field.run_validation(f' {self.code.lower()} '), self.code)
+
+    def test_batches_are_added_to_the_filter(self):
+        codes = coupons.create_coupons(self.rule, 25, batch_size=10)
+
+        bloom = coupons.BloomFilter.load(self.path)
+        self.assertEqual(bloom.count, Coupon.objects.count())
+        self.assertEqual(bloom.max_id, Coupon.objects.latest('pk').pk)
+        self.assertTrue(all(code in bloom for code in codes))
+
+    def test_coupons_created_elsewhere_are_found(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Coupon.objects.create(code='SHELL2024', rule=self.rule)
+
+        # Not in the filter yet: looked up among the newer coupons
+        with self.assertNumQueries(1):
+            self.assertTrue(coupons.might_exist('SHELL2024'))
+        self.assertFalse(coupons.might_exist('NOT-A-REAL-CODE'))
+
+        outbox.process_batch()
+        bloom = coupons.BloomFilter.load(self.path)
+        self.assertIn('SHELL2024', bloom)
+        self.assertEqual(bloom.max_id, Coupon.objects.latest('pk').pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(coupons.might_exist('SHELL2024'))
+            self.assertFalse(coupons.might_exist('NOT-A-REAL-CODE'))
+
+    def test_coupon_rule_needs_its_code(self):
+        response = self.checkout(self.alice)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_discount']), Decimal('0'))
+
+        response = self.checkout(self.alice, self.code)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_discount']), Decimal('10'))
+        self.assertEqual(Order.objects.get(pk=response.data['id']).coupon.code, self.code)
+
+    def test_single_use_code_is_redeemed_once(self):
+        self.assertEqual(self.checkout(self.alice, self.code).status_code, 201)
+
+        response = self.checkout(self.bob, self.code)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['coupon_code'], [coupons.USED_UP])
+        self.assertEqual(Coupon.objects.get(code=self.code).uses, 1)
+        self.assertFalse(Order.objects.filter(user=self.bob).exists())
+
+        # A batch redeeming one code twice gets one order
+        other = sorted(coupons.create_coupons(self.rule, 1))[0]
+        data = {'items': [{'product_id': self.product.pk, 'quantity': 1}], 'coupon_code': other}
+        outcomes = create_orders([(self.alice, data), (self.bob, data)])
+        self.assertIsNotNone(outcomes[0][0])
+        self.assertEqual(outcomes[1], (None, {'coupon_code': [coupons.USED_UP]}))
+
+    def test_per_user_limit_holds_across_codes(self):
+        self.rule.max_uses_per_user = 1
+        self.rule.save()
+        first, second = sorted(Coupon.objects.values_list('code', flat=True))[:2]
+
+        self.assertEqual(self.checkout(self.alice, first).status_code, 201)
+        response = self.checkout(self.alice, second)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['coupon_code'], [coupons.USER_LIMIT_REACHED])
+        # The refused checkout used up nothing
+        self.assertEqual(Coupon.objects.get(code=second).uses, 0)
+        self.assertEqual(CouponUsage.objects.get(user=self.alice, rule=self.rule).uses, 1)
+        self.assertEqual(self.checkout(self.bob, second).status_code, 201)
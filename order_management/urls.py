@@ -2,7 +2,9 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import (
     ProductListView,
+    ProductRecommendationsView,
     OrderListView,
+    BulkOrderCreateView,
     OrderDetailView,
     DiscountRuleListView,
     DiscountRuleDetailView
@@ -12,7 +14,10 @@ router = DefaultRouter()
 
 urlpatterns = [
     path('products/', ProductListView.as_view(), name='product-list'),
+    path('products/<int:pk>/recommendations/', ProductRecommendationsView.as_view(),
+         name='product-recommendations'),
     path('orders/', OrderListView.as_view(), name='order-list'),
+    path('orders/bulk/', BulkOrderCreateView.as_view(), name='order-bulk-create'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('discount-rules/', DiscountRuleListView.as_view(), name='discount-rule-list'),
     path('discount-rules/<int:pk>/', DiscountRuleDetailView.as_view(), 
@@ -1,156 +1,241 @@
 from decimal import Decimal
-from django.core.cache import cache
-from django.db import transaction
+from time import perf_counter_ns
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
 
+from . import telemetry
+from .models import DiscountRule, OrderItem
+from .rules import CompiledRuleSet
+from .stacking import Candidate, solve, split_by_category
+
 
 class StandardResultsSetPagination(PageNumberPagination):
     """Custom pagination class"""
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+
+
+def estimated_row_count(model, using='default'):
+    """
+    Cheap row count estimate for a table, or None when unavailable:
+    planner statistics on PostgreSQL and MySQL, the largest rowid on SQLite
+    (rows deleted since, e.g. by archiving, make it an overestimate).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s", [table]
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator that never counts more than ADMIN_EXACT_COUNT_LIMIT rows.
     
+    Unfiltered lists of larger tables report the estimated table size;
+    filtered lists are counted exactly up to the limit and capped there.
+    """
+    
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return min(queryset.order_by()[:limit + 1].count(), limit)
+
 class DiscountCalculator:
     """Handles discount calculations for orders"""
 
-    def __init__(self, order):
+    def __init__(self, order, items=None, rules=None, coupon=None):
         self.order = order
+        # Order items and active rules, loaded when not given
+        self.items = items
+        self.rules = rules
+        # Coupon presented with the order; its rule is priced with the others
+        self.coupon = coupon
         self.discount_breakdown = {}
         self.applied_discounts = []
 
     def calculate_discounts(self):
-        """Calculate all applicable discounts"""
-        # Reset discount amounts
-        self.order.total_discount = Decimal("0")
-        self.discount_breakdown = {}
-
-        # Apply discounts in priority order
-        self._apply_percentage_discount()
-        self._apply_flat_discount()
-        self._apply_category_discounts()
+        """Apply the best valid combination of discounts and save the order"""
+        changed_items = self.apply_discounts()
 
-        # Update order with discount breakdown
-        self.order.discount_breakdown = self.discount_breakdown
         self.order.save()
+        if changed_items:
+            OrderItem.objects.bulk_update(changed_items, ["item_discount"])
 
         return self.order.total_discount
 
-    def _apply_percentage_discount(self):
-        """Apply percentage discount if order meets criteria"""
-        from .models import DiscountRule
-
-        percentage_rules = [
-            rule
-            for rule in DiscountRule.get_active_rules()
-            if rule.discount_type == "percentage"
-            and (
-                rule.min_order_amount is None
-                or self.order.subtotal >= rule.min_order_amount
+    def apply_discounts(self):
+        """
+        Set the discount fields on the order and its items without saving.
+
+        Returns the items whose item_discount changed.
+        """
+        if self.items is None:
+            self.items = list(self.order.items.all())
+        if self.rules is None:
+            self.rules = DiscountRule.get_compiled_rules()
+
+        compiled = self.rules
+        if not isinstance(compiled, CompiledRuleSet):
+            compiled = CompiledRuleSet(compiled)
+        # Items per category with a rule, through their ancestors
+        category_items = compiled.items_by_category(self.items)
+        rules = compiled
+        if settings.DISCOUNT_RULE_INDEX:
+            # Skip rules the order cannot match
+            rules = compiled.candidates_for(self.order.subtotal, category_items)
+        if self.coupon is not None:
+            # Coupon rules are not in the rule set, the order brings its own
+            coupon_rule = self.coupon.rule
+            if coupon_rule.category_id is not None:
+                category_items[coupon_rule.category_id] = [
+                    item for item in self.items
+                    if coupon_rule.category_id in compiled.ancestors_of(item.category_id)
+                ]
+            rules = list(rules) + [coupon_rule]
+
+        track = telemetry.enabled()
+        timed = track and telemetry.sample_timing()
+        timings = []
+        candidates = []
+        matched = []
+        for rule in rules:
+            if timed:
+                start = perf_counter_ns()
+            candidate = self._candidate(rule, category_items)
+            if timed:
+                timings.append((rule.id, perf_counter_ns() - start))
+            if candidate is not None:
+                matched.append(rule.id)
+                candidates += split_by_category(candidate)
+
+        self.applied_discounts, total = solve(candidates, cap=self.order.subtotal)
+        # A split category rule applies once, for the sum of its parts
+        applied = {}
+        for candidate in self.applied_discounts:
+            rule, amount = applied.get(id(candidate.rule), (candidate.rule, Decimal("0")))
+            applied[id(rule)] = (rule, amount + candidate.amount)
+        if track:
+            telemetry.record(
+                [rule.id for rule in rules],
+                matched,
+                [(rule.id, amount) for rule, amount in applied.values()],
+                timings
             )
-        ]
 
-        if not percentage_rules:
-            return
-
-        # Get the highest priority percentage rule
-        rule = percentage_rules[0]
-        discount_amount = (self.order.subtotal * rule.value) / Decimal("100")
-
-        # Check if this is better than any existing percentage discount
-        existing_percentage = self.discount_breakdown.get(
-            "percentage_discount", {}
-        ).get("amount", Decimal("0"))
-        if discount_amount > existing_percentage:
-            self.order.total_discount += discount_amount - existing_percentage
-            self.discount_breakdown["percentage_discount"] = {
-                "type": "percentage",
-                "name": rule.name,
-                "value": float(rule.value),
-                "amount": float(discount_amount),
-                "rule_id": rule.id,
-            }
-
-    def _apply_flat_discount(self):
-        """Apply flat discount if user is eligible"""
-        from .models import DiscountRule
-
-        flat_rules = [
-            rule
-            for rule in DiscountRule.get_active_rules()
-            if rule.discount_type == "flat"
-            and (
-                rule.min_completed_orders is None
-                or self.order.user.eligible_for_flat_discount
-            )
-        ]
+        # Category discounts are spread over their items
+        item_discounts = {}
+        for candidate in self.applied_discounts:
+            for item, amount in candidate.item_discounts:
+                item_discounts[id(item)] = item_discounts.get(id(item), Decimal("0")) + amount
 
-        if not flat_rules:
-            return
+        changed_items = []
+        for item in self.items:
+            line_total = item.unit_price * item.quantity
+            discount = min(item_discounts.get(id(item), Decimal("0")), line_total)
+            if discount != item.item_discount:
+                item.item_discount = discount
+                changed_items.append(item)
 
-        # Get the highest priority flat rule
-        rule = flat_rules[0]
-        discount_amount = rule.value
+        self.discount_breakdown = {}
+        for rule, amount in applied.values():
+            self._record(rule, amount)
 
-        # Only apply if it's better than existing flat discount
-        existing_flat = self.discount_breakdown.get("flat_discount", {}).get(
-            "amount", Decimal("0")
+        if self.coupon is not None:
+            # Only a coupon that discounted the order is redeemed with it
+            self.order.coupon = self.coupon if id(self.coupon.rule) in applied else None
+        self.order.total_discount = total
+        self.order.discount_breakdown = self.discount_breakdown
+        self.order.final_amount = self.order.subtotal - total
+        return changed_items
+
+    def _candidate(self, rule, category_items):
+        """The discount ``rule`` grants this order, or None if it does not match"""
+        if rule.discount_type == "percentage":
+            return self._percentage_candidate(rule)
+        if rule.discount_type == "flat":
+            return self._flat_candidate(rule)
+        if rule.discount_type == "category":
+            return self._category_candidate(rule, category_items)
+        return None
+
+    def _percentage_candidate(self, rule):
+        """Percentage rule, if the order subtotal qualifies"""
+        subtotal = self.order.subtotal
+        if rule.min_order_amount is not None and subtotal < rule.min_order_amount:
+            return None
+        return Candidate(rule, (subtotal * rule.value) / Decimal("100"))
+
+    def _flat_candidate(self, rule):
+        """Flat rule, if the user is eligible"""
+        if rule.min_completed_orders is not None and not self.order.user.eligible_for_flat_discount:
+            return None
+        return Candidate(rule, rule.value)
+
+    def _category_candidate(self, rule, category_items):
+        """
+        Category rule, if its category (or subcategories) is in the order in
+        enough quantity
+        """
+        items = category_items.get(rule.category_id)
+        if rule.category_id is None or not items:
+            return None
+        total_quantity = sum(item.quantity for item in items)
+        if rule.min_quantity is not None and total_quantity < rule.min_quantity:
+            return None
+
+        item_discounts = [
+            (item, (item.unit_price * rule.value) / Decimal("100") * item.quantity)
+            for item in items
+        ]
+        return Candidate(
+            rule, sum(amount for _, amount in item_discounts), item_discounts,
+            covered={item.category_id for item in items}
         )
 
-        if discount_amount > existing_flat:
-            self.order.total_discount += discount_amount - existing_flat
-
-            self.discount_breakdown["flat_discount"] = {
-                "type": "flat",
-                "name": rule.name,
-                "value": float(rule.value),
-                "amount": float(discount_amount),
-                "rule_id": rule.id,
-            }
-
-    def _apply_category_discounts(self):
-        """Apply category-specific discounts"""
-        from .models import DiscountRule
-
-        # Get all active category-based discount rules
-        category_rules = [
-            rule
-            for rule in DiscountRule.get_active_rules()
-            if rule.discount_type == "category" and rule.category is not None
-        ]
-        if not category_rules:
-            return
-        # Group order items by category
-        category_items = {}
-        for item in self.order.items.all():
-            if item.category_id not in category_items:
-                category_items[item.category_id] = []
-            category_items[item.category_id].append(item)
-
-        # Apply category discounts
-        for rule in category_rules:
-            if rule.category_id in category_items:
-                items = category_items[rule.category_id]
-                total_quantity = sum(item.quantity for item in items)
-                if rule.min_quantity is None or total_quantity >= rule.min_quantity:
-                    # Apply discount to each item in category
-                    for item in items:
-                        discount_per_item = (item.unit_price * rule.value) / Decimal(
-                            "100"
-                        )
-                        total_discount = discount_per_item * item.quantity
-
-                        item.item_discount = total_discount
-                        item.save()
-
-                        self.order.total_discount += total_discount
-
-                    # Record in breakdown
-                    category_key = f"category_discount_{rule.category_id}"
-                    self.discount_breakdown[category_key] = {
-                        "type": "category",
-                        "name": rule.name,
-                        "category": rule.category.name,
-                        "value": float(rule.value),
-                        "amount": float(sum(item.item_discount for item in items)),
-                        "rule_id": rule.id,
-                    }
+    def _record(self, rule, amount):
+        """Add an applied discount to the breakdown"""
+        entry = {
+            "type": rule.discount_type,
+            "name": rule.name,
+            "value": float(rule.value),
+            "amount": float(amount),
+            "rule_id": rule.id,
+        }
+        if self.coupon is not None and rule is self.coupon.rule:
+            entry["coupon"] = self.coupon.code
+        if rule.discount_type == "category":
+            key = f"category_discount_{rule.category_id}"
+            entry["category"] = rule.category.name
+        else:
+            key = f"{rule.discount_type}_discount"
+
+        # Explicit exclusivity groups can let two rules of a type stack
+        if key in self.discount_breakdown:
+            key = f"{key}_{rule.id}"
+        self.discount_breakdown[key] = entry
@@ -1,16 +1,36 @@
+from decimal import Decimal, InvalidOperation
+
 from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.core.cache import cache
+from django.conf import settings
 from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 
-from .models import Product, Order, OrderItem, DiscountRule
+from .models import (
+    Product, Order, OrderItem, DiscountRule, ArchivedOrder
+)
 from .serializers import (
     ProductSerializer,
     OrderSerializer,
+    ArchivedOrderSerializer,
+    ProductValuesSerializer,
+    OrderValuesSerializer,
     OrderCreateSerializer,
+    BulkOrderCreateSerializer,
+    QueuedOrderSerializer,
+    BulkOrderResultSerializer,
     DiscountRuleSerializer
 )
-from order_management.utils import StandardResultsSetPagination
+from .admission import AdmissionControlMixin
+from .checkout import place_orders
+from .coupons import NOT_APPLICABLE, redeem
+from .groupcommit import submit_order
+from .recommendations import get_recommendations
+from .rules import rules_changed
+from .search import search_products
+from order_management.utils import StandardResultsSetPagination, DiscountCalculator
 
 
 
@@ -23,20 +43,70 @@ class ProductListView(generics.ListAPIView):
     pagination_class = StandardResultsSetPagination
     
     def get_queryset(self):
-        """Optionally filter by category """
+        """Optionally filter by category and price, and search with q """
         
         queryset = super().get_queryset()
-        category = self.request.query_params.get('category')
+        params = self.request.query_params
+        category = params.get('category')
+        min_price = self._price_param('min_price')
+        max_price = self._price_param('max_price')
+        query = params.get('q', '').strip()
         
         if category:
             queryset = queryset.filter(category__name__iexact=category)
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+        if query:
+            # Ranked by relevance instead of name
+            return search_products(queryset, query)
         return queryset.order_by('name')
+    
+    def _price_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: 'A valid number is required.'})
+        if not price.is_finite():
+            raise ValidationError({name: 'A valid number is required.'})
+        return price
+    
+    def list(self, request, *args, **kwargs):
+        """List products through the values() fast path"""
+        
+        queryset = ProductValuesSerializer.values(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(ProductValuesSerializer.to_representation(queryset))
+        return self.get_paginated_response(
+            ProductValuesSerializer.to_representation(page)
+        )
 
-class OrderListView(generics.ListCreateAPIView):
+class ProductRecommendationsView(generics.GenericAPIView):
+    """ Products often bought together with a product """
+    
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request, pk, *args, **kwargs):
+        """Served from the cache, see `manage.py update_recommendations`"""
+        
+        recommendations = get_recommendations(pk)
+        if recommendations is None:
+            raise Http404
+        return Response({'product_id': pk, 'results': recommendations})
+
+class OrderListView(AdmissionControlMixin, generics.ListCreateAPIView):
     """ List and create orders for the authenticated users """
     
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = StandardResultsSetPagination
+    admission_scope = 'order_create'
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -47,6 +117,40 @@ class OrderListView(generics.ListCreateAPIView):
         """ Only show orders for the current user """
         return Order.objects.filter(user=self.request.user).order_by('-order_date')
     
+    def list(self, request, *args, **kwargs):
+        """List orders through the values() fast path"""
+        
+        queryset = OrderValuesSerializer.values(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(OrderValuesSerializer.to_representation(queryset))
+        return self.get_paginated_response(
+            OrderValuesSerializer.to_representation(page)
+        )
+    
+    def post(self, request, *args, **kwargs):
+        if settings.CHECKOUT_GROUP_COMMIT:
+            return self.create_grouped(request)
+        return super().post(request, *args, **kwargs)
+    
+    def create_grouped(self, request):
+        """Create the order in a group commit with concurrent checkouts"""
+        
+        serializer = QueuedOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        order, errors = submit_order(request.user, serializer.validated_data)
+        if errors:
+            raise ValidationError(errors)
+        
+        # Same shape as OrderSerializer, read back once committed
+        data = OrderValuesSerializer.to_representation(
+            OrderValuesSerializer.values(Order.objects.filter(pk=order.pk))
+        )[0]
+        return Response(data, status=status.HTTP_201_CREATED)
+    
     @transaction.atomic
     def create(self, request, *args, **kwargs):
         """Create a new order with items and apply discounts """
@@ -64,18 +168,25 @@ class OrderListView(generics.ListCreateAPIView):
         # Create order items
         items_data = serializer.validated_data['items']
         for item_data in items_data:
-            product = item_data['product']
+            product = item_data['product_id']
             OrderItem.objects.create(
                 order=order,
                 product=product,
                 quantity=item_data['quantity'],
                 unit_price=product.price,
-                category=product.category
+                category_id=product.category_id
             )
         
         # Calculate discounts
-        from .utils import DiscountCalculator
-        DiscountCalculator(order).calculate_discounts()
+        coupon = serializer.validated_data.get('coupon_code')
+        DiscountCalculator(order, coupon=coupon).calculate_discounts()
+        if coupon is not None:
+            # Errors roll the order back with the transaction
+            if order.coupon is None:
+                raise ValidationError({'coupon_code': [NOT_APPLICABLE]})
+            error = redeem(coupon, request.user)
+            if error:
+                raise ValidationError({'coupon_code': [error]})
         
         # Return created order
         headers = self.get_success_headers(serializer.data)
@@ -86,6 +197,35 @@ class OrderListView(generics.ListCreateAPIView):
         )
 
 
+class BulkOrderCreateView(AdmissionControlMixin, generics.GenericAPIView):
+    """ Create many orders in one request, with a result per order """
+    
+    serializer_class = BulkOrderCreateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    admission_scope = 'order_bulk_create'
+    
+    def post(self, request, *args, **kwargs):
+        """201 when every order is created, 207 when only some are, 400 when none"""
+        
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        results = place_orders(request.user, serializer.validated_data['orders'])
+        created = sum(1 for result in results if result.order is not None)
+        
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': created,
+            'rejected': len(results) - created,
+            'results': BulkOrderResultSerializer.to_representation(results),
+        }, status=response_status)
+
+
 class OrderDetailView(generics.RetrieveAPIView):
     """Retrieve order details"""
     serializer_class = OrderSerializer
@@ -94,6 +234,23 @@ class OrderDetailView(generics.RetrieveAPIView):
     def get_queryset(self):
         """Only allow viewing own orders"""
         return Order.objects.filter(user=self.request.user)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Serve live orders first, then fall back to the archive"""
+        
+        try:
+            instance = self.get_object()
+            serializer = self.get_serializer(instance)
+        except Http404:
+            instance = get_object_or_404(
+                ArchivedOrder.objects.filter(user=request.user)
+                .prefetch_related('items'),
+                pk=self.kwargs['pk']
+            )
+            serializer = ArchivedOrderSerializer(
+                instance, context=self.get_serializer_context()
+            )
+        return Response(serializer.data)
 
 
 class DiscountRuleListView(generics.ListAPIView):
@@ -110,13 +267,15 @@ class DiscountRuleDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = DiscountRuleSerializer
     permission_classes = [permissions.IsAdminUser]
     
+    @transaction.atomic
     def perform_update(self, serializer):
-        """Clear discount rules cache on update """
+        """Clear discount rules cache on update"""
         
         super().perform_update(serializer)
-        cache.delete('active_discount_rules')
+        rules_changed()
     
+    @transaction.atomic
     def perform_destroy(self, instance):
         """Clear discount rules cache on delete"""
         super().perform_destroy(instance)
-        cache.delete('active_discount_rules')
\ No newline at end of file
+        rules_changed()
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Worker warm-up.
+
+Runs once per process before the first request (see ecommerce/wsgi.py and
+asgi.py) so the first requests after a deploy or scale-out do not pay for
+lazy imports, URL resolver and DRF settings initialization, model metadata
+caches, the rule snapshot and the catalogue page faults. Safe to run before
+forking (gunicorn ``--preload``): database connections are closed at the end.
+"""
+import logging
+import mmap
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+# Importing the token backend loads PyJWT and its algorithms
+from rest_framework_simplejwt.state import token_backend  # noqa: F401
+
+from . import serializers
+from .catalogue import get_catalogue
+from .rules import get_rule_snapshot
+
+logger = logging.getLogger(__name__)
+
+# URL names resolved and reversed during warm-up
+WARM_URLS = [
+    'product-list', 'order-list', 'discount-rule-list', 'token_obtain_pair',
+]
+
+
+def warm_urls():
+    """Import every view and build the resolver and reverse caches"""
+    resolver = get_resolver()
+    resolver.url_patterns
+    for name in WARM_URLS:
+        resolver.resolve(reverse(name))
+
+
+def warm_middleware():
+    """Import what middleware loads on the first request"""
+    if 'django.contrib.messages' in settings.INSTALLED_APPS:
+        import_string(settings.MESSAGE_STORAGE)
+
+
+def warm_drf():
+    """Import the classes named in DRF and simplejwt settings"""
+    for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES',
+                 'DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_PERMISSION_CLASSES',
+                 'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'DEFAULT_METADATA_CLASS',
+                 'DEFAULT_VERSIONING_CLASS', 'EXCEPTION_HANDLER'):
+        getattr(api_settings, name)
+    jwt_settings.AUTH_TOKEN_CLASSES
+    import_string(jwt_settings.TOKEN_OBTAIN_SERIALIZER)
+
+
+def _build_fields(serializer):
+    for field in serializer.fields.values():
+        nested = getattr(field, 'child', field)
+        if isinstance(nested, BaseSerializer):
+            _build_fields(nested)
+
+
+def warm_serializers():
+    """Build serializer fields once, filling model metadata caches"""
+    for serializer_class in (
+        serializers.ProductSerializer, serializers.OrderSerializer,
+        serializers.OrderCreateSerializer, serializers.DiscountRuleSerializer,
+        serializers.ArchivedOrderSerializer,
+    ):
+        _build_fields(serializer_class())
+
+
+def warm_rules():
+    """Load the rule snapshot (shared file or cache) and compile its current rule set"""
+    get_rule_snapshot().compiled_at(timezone.now())
+
+
+def warm_catalogue():
+    """Map the shared catalogue and fault its pages in ahead of lookups"""
+    catalogue = get_catalogue()
+    if catalogue is None:
+        return
+    if hasattr(catalogue.buffer, 'madvise'):
+        catalogue.buffer.madvise(mmap.MADV_WILLNEED)
+    else:
+        buffer = catalogue.buffer
+        sum(buffer[offset] for offset in range(0, len(buffer), mmap.PAGESIZE))
+    catalogue.rules
+
+
+WARMUP_STEPS = [
+    ('urls', warm_urls),
+    ('middleware', warm_middleware),
+    ('drf', warm_drf),
+    ('serializers', warm_serializers),
+    ('rules', warm_rules),
+    ('catalogue', warm_catalogue),
+]
+
+
+def warm_up():
+    """
+    Run every warm-up step and return ``{step: milliseconds}``. A failing
+    step (e.g. tables not migrated yet) is logged and skipped, warm-up never
+    prevents a worker from starting.
+    """
+    timings = {}
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning("Warm-up step %s failed", name, exc_info=True)
+        timings[name] = (time.perf_counter() - start) * 1000
+
+    # Connections must not be shared with forked workers
+    connections.close_all()
+
+    total = sum(timings.values())
+    logger.info(
+        "Warm-up done in %.1f ms (%s)", total,
+        ', '.join(f'{name} {ms:.1f} ms' for name, ms in timings.items())
+    )
+    return timings
+
+
+def warm_up_on_startup():
+    """Called from the WSGI/ASGI entry points, honours WARMUP_ON_STARTUP"""
+    if settings.WARMUP_ON_STARTUP:
+        return warm_up()